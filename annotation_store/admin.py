@@ -0,0 +1,55 @@
+from django.contrib import admin
+from django.utils.html import format_html
+from annotation_store.models import LTIGradePassback, AnnotationTransfer, DashboardSnapshot, RequestProfile
+import json
+
+
+class LTIGradePassbackAdmin(admin.ModelAdmin):
+    list_display = ('user_id', 'resource_link_id', 'context_id', 'status', 'score', 'sent_score', 'attempts', 'enqueued_at', 'next_attempt_at', 'sent_at', 'last_latency')
+    list_filter = ('status',)
+    search_fields = ('user_id', 'resource_link_id', 'context_id')
+    readonly_fields = ('version', 'last_latency', 'last_error')
+
+admin.site.register(LTIGradePassback, LTIGradePassbackAdmin)
+
+
+class AnnotationTransferAdmin(admin.ModelAdmin):
+    list_display = ('id', 'old_assignment_id', 'new_assignment_id', 'new_course_id', 'instructor_only', 'status', 'targets_done', 'targets_total', 'annotations_done', 'annotations_total', 'attempts', 'enqueued_at', 'finished_at')
+    list_filter = ('status', 'instructor_only')
+    search_fields = ('old_assignment_id', 'new_assignment_id', 'old_course_id', 'new_course_id', 'user_id')
+    readonly_fields = ('version', 'last_error')
+
+admin.site.register(AnnotationTransfer, AnnotationTransferAdmin)
+
+
+class DashboardSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('context_id', 'total_annotations', 'refreshed_at', 'full_refreshed_at', 'synced_through', 'refreshing_since')
+    search_fields = ('context_id',)
+    readonly_fields = ('version', 'cursors', 'last_error')
+
+admin.site.register(DashboardSnapshot, DashboardSnapshotAdmin)
+
+
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'method', 'path', 'view_name', 'status', 'duration_ms', 'query_count', 'query_ms')
+    list_filter = ('view_name', 'method', 'status')
+    search_fields = ('path', 'view_name')
+    fields = ('created_at', 'method', 'path', 'view_name', 'status', 'duration_ms', 'query_count', 'query_ms', 'phases',
+              'slowest_queries', 'all_queries', 'profile_report')
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def slowest_queries(self, obj):
+        return format_html('<pre>{0}</pre>', '\n\n'.join(
+            '%s ms\n%s\n%s' % (e['ms'], e['sql'], e['plan']) for e in json.loads(obj.explains)))
+
+    def all_queries(self, obj):
+        return format_html('<pre>{0}</pre>', '\n'.join(
+            '%8.2f ms  %s  %s' % (q['ms'], q['sql'], q['params']) for q in json.loads(obj.queries)))
+
+    def profile_report(self, obj):
+        return format_html('<pre>{0}</pre>', obj.profile)
+
+admin.site.register(RequestProfile, RequestProfileAdmin)
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+
+from annotation_store import transfer
+
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Copies queued annotation transfers between courses.'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=10,
+                    help='Maximum number of transfers to run per batch.'),
+        make_option('--interval', dest='interval', type='float', default=0,
+                    help='Keep running and poll the queue every INTERVAL seconds. By default the queue is drained once.'),
+    )
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        while True:
+            counts = self.drain(options['batch_size'])
+            if counts['completed'] or counts['retried'] or counts['failed']:
+                logger.info("process_annotation_transfers: %s" % counts)
+            if interval <= 0:
+                break
+            time.sleep(interval)
+
+    def drain(self, batch_size):
+        totals = {'completed': 0, 'retried': 0, 'failed': 0}
+        while True:
+            counts = transfer.process_pending(batch_size=batch_size)
+            for k in totals:
+                totals[k] += counts[k]
+            if sum(counts.values()) < batch_size:
+                return totals
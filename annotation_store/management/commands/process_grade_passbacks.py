@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+
+from annotation_store import passback
+
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Sends queued LTI grades to the LMS outcome service.'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=100,
+                    help='Maximum number of grades to send per batch.'),
+        make_option('--interval', dest='interval', type='float', default=0,
+                    help='Keep running and poll the queue every INTERVAL seconds. By default the queue is drained once.'),
+        make_option('--stats', dest='stats', action='store_true', default=False,
+                    help='Print the queue depth and latency and exit.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.print_stats()
+            return
+
+        interval = options['interval']
+        while True:
+            counts = self.drain(options['batch_size'])
+            if counts['sent'] or counts['retried'] or counts['failed']:
+                logger.info("process_grade_passbacks: %s" % counts)
+            if interval <= 0:
+                break
+            time.sleep(interval)
+
+    def drain(self, batch_size):
+        totals = {'sent': 0, 'retried': 0, 'failed': 0}
+        while True:
+            counts = passback.process_pending(batch_size=batch_size)
+            for k in totals:
+                totals[k] += counts[k]
+            if sum(counts.values()) < batch_size:
+                return totals
+
+    def print_stats(self):
+        stats = passback.queue_stats()
+        for key in ('pending', 'due', 'failed', 'oldest_pending_age', 'avg_latency', 'max_latency'):
+            self.stdout.write("%s: %s" % (key, stats[key]))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+
+from annotation_store import snapshot
+
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Refreshes the per-course snapshots read by the instructor dashboard.'
+    option_list = BaseCommand.option_list + (
+        make_option('--full', dest='full', action='store_true', default=False,
+                    help='Rebuild snapshots from every annotation instead of refreshing them incrementally.'),
+        make_option('--context-id', dest='context_id', default=None,
+                    help='Only refresh the snapshot of this course.'),
+        make_option('--interval', dest='interval', type='float', default=0,
+                    help='Keep running and refresh snapshots every INTERVAL seconds. By default they are refreshed once.'),
+    )
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        while True:
+            if options['context_id']:
+                result = snapshot.refresh(options['context_id'], full=options['full'])
+                counts = {result: 1}
+            else:
+                counts = snapshot.refresh_all(full=options['full'])
+            logger.info("refresh_dashboard_snapshots: %s" % counts)
+            if interval <= 0:
+                break
+            time.sleep(interval)
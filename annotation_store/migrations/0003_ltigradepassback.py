@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotation_store', '0002_delete_userstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LTIGradePassback',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('user_id', models.CharField(max_length=1024)),
+                ('resource_link_id', models.CharField(max_length=255)),
+                ('context_id', models.CharField(max_length=1024)),
+                ('score', models.FloatField()),
+                ('sent_score', models.FloatField(null=True, blank=True)),
+                ('outcome_params', models.TextField(default='{}', blank=True)),
+                ('status', models.CharField(default='pending', max_length=16, db_index=True, choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed')])),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(default='', blank=True)),
+                ('last_latency', models.FloatField(null=True, blank=True)),
+                ('enqueued_at', models.DateTimeField(null=True, blank=True)),
+                ('next_attempt_at', models.DateTimeField(db_index=True, null=True, blank=True)),
+                ('sent_at', models.DateTimeField(null=True, blank=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='ltigradepassback',
+            unique_together=set([('user_id', 'resource_link_id')]),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotation_store', '0003_ltigradepassback'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnnotationTransfer',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('user_id', models.CharField(max_length=1024)),
+                ('old_course_id', models.CharField(max_length=255)),
+                ('new_course_id', models.CharField(max_length=255, db_index=True)),
+                ('old_assignment_id', models.CharField(max_length=100)),
+                ('new_assignment_id', models.CharField(max_length=100)),
+                ('instructor_only', models.BooleanField(default=True)),
+                ('object_ids', models.TextField(default='[]', blank=True)),
+                ('status', models.CharField(default='pending', max_length=16, db_index=True, choices=[('pending', 'Pending'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')])),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(default='', blank=True)),
+                ('targets_total', models.PositiveIntegerField(default=0)),
+                ('targets_done', models.PositiveIntegerField(default=0)),
+                ('annotations_total', models.PositiveIntegerField(default=0)),
+                ('annotations_done', models.PositiveIntegerField(default=0)),
+                ('enqueued_at', models.DateTimeField(null=True, blank=True)),
+                ('next_attempt_at', models.DateTimeField(db_index=True, null=True, blank=True)),
+                ('started_at', models.DateTimeField(null=True, blank=True)),
+                ('finished_at', models.DateTimeField(null=True, blank=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='AnnotationTransferItem',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('target_object_id', models.CharField(max_length=255)),
+                ('source_id', models.CharField(max_length=255)),
+                ('created_id', models.CharField(default='', max_length=255, blank=True)),
+                ('transfer', models.ForeignKey(related_name='items', to='annotation_store.AnnotationTransfer')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='annotationtransferitem',
+            unique_together=set([('transfer', 'source_id')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='annotationtransfer',
+            unique_together=set([('old_assignment_id', 'new_assignment_id', 'instructor_only')]),
+        ),
+    ]
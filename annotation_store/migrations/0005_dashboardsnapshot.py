@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotation_store', '0004_annotationtransfer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DashboardObjectSummary',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('collection_id', models.CharField(max_length=1024)),
+                ('object_id', models.CharField(max_length=2048)),
+                ('total_annotations', models.IntegerField(default=0)),
+                ('latest_activity', models.DateTimeField(null=True, blank=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='DashboardSnapshot',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('context_id', models.CharField(unique=True, max_length=255)),
+                ('total_annotations', models.PositiveIntegerField(default=0)),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('refreshing_since', models.DateTimeField(null=True, blank=True)),
+                ('refreshed_at', models.DateTimeField(null=True, blank=True)),
+                ('full_refreshed_at', models.DateTimeField(null=True, blank=True)),
+                ('synced_through', models.DateTimeField(null=True, blank=True)),
+                ('cursors', models.TextField(default='{}', blank=True)),
+                ('last_error', models.TextField(default='', blank=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='DashboardUserSummary',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('user_id', models.CharField(max_length=1024)),
+                ('user_name', models.CharField(default='', max_length=1024, blank=True)),
+                ('sort_name', models.CharField(default='', max_length=255, blank=True)),
+                ('total_annotations', models.IntegerField(default=0)),
+                ('latest_activity', models.DateTimeField(null=True, blank=True)),
+                ('snapshot', models.ForeignKey(related_name='user_summaries', to='annotation_store.DashboardSnapshot')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dashboardusersummary',
+            unique_together=set([('snapshot', 'user_id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='dashboardusersummary',
+            index_together=set([('snapshot', 'sort_name')]),
+        ),
+        migrations.AddField(
+            model_name='dashboardobjectsummary',
+            name='snapshot',
+            field=models.ForeignKey(related_name='object_summaries', to='annotation_store.DashboardSnapshot'),
+            preserve_default=True,
+        ),
+        migrations.AlterUniqueTogether(
+            name='dashboardobjectsummary',
+            unique_together=set([('snapshot', 'collection_id', 'object_id')]),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotation_store', '0005_dashboardsnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('method', models.CharField(max_length=16)),
+                ('path', models.CharField(max_length=1024)),
+                ('view_name', models.CharField(default=b'', max_length=255, db_index=True, blank=True)),
+                ('status', models.PositiveSmallIntegerField(null=True, blank=True)),
+                ('duration_ms', models.FloatField()),
+                ('query_count', models.PositiveIntegerField(default=0)),
+                ('query_ms', models.FloatField(default=0)),
+                ('phases', models.TextField(default=b'{}', blank=True)),
+                ('profile', models.TextField(default=b'', blank=True)),
+                ('queries', models.TextField(default=b'[]', blank=True)),
+                ('explains', models.TextField(default=b'[]', blank=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+            bases=(models.Model,),
+        ),
+    ]
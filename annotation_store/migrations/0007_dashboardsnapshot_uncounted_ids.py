@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotation_store', '0006_requestprofile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dashboardsnapshot',
+            name='uncounted_ids',
+            field=models.TextField(default=b'[]', blank=True),
+            preserve_default=True,
+        ),
+    ]
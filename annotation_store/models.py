@@ -30,3 +30,195 @@ class AnnotationTags(models.Model):
 
     def __unicode__(self):
         return self.name
+
+class LTIGradePassback(models.Model):
+    '''
+    Durable queue of LTI grade passback requests, drained by the process_grade_passbacks
+    management command.
+
+    There is at most one row per (user_id, resource_link_id): repeated submissions while a
+    request is pending collapse into the pending row, and a submission that matches the
+    score already sent to the LMS is not queued again.
+    '''
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    )
+
+    user_id = models.CharField(max_length=1024)
+    resource_link_id = models.CharField(max_length=255)
+    context_id = models.CharField(max_length=1024)
+    score = models.FloatField()
+    sent_score = models.FloatField(null=True, blank=True)
+    outcome_params = models.TextField(blank=True, default='{}')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    version = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    last_latency = models.FloatField(null=True, blank=True)
+    enqueued_at = models.DateTimeField(null=True, blank=True)
+    next_attempt_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('user_id', 'resource_link_id')
+
+    def __unicode__(self):
+        return u"%s/%s (%s)" % (self.user_id, self.resource_link_id, self.status)
+
+class AnnotationTransfer(models.Model):
+    '''
+    Copies an assignment's annotations from one course to another in the background. Transfers
+    are run by the process_annotation_transfers management command.
+
+    Each annotation copied to the new course is checkpointed as an AnnotationTransferItem. A
+    transfer that stops part way is resumed by running it again, and annotations that were
+    already copied are skipped instead of being created twice. There is at most one transfer
+    per source assignment, destination assignment and instructor_only choice, so a transfer
+    requested again resumes the existing one.
+    '''
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+    )
+
+    user_id = models.CharField(max_length=1024)
+    old_course_id = models.CharField(max_length=255)
+    new_course_id = models.CharField(max_length=255, db_index=True)
+    old_assignment_id = models.CharField(max_length=100)
+    new_assignment_id = models.CharField(max_length=100)
+    instructor_only = models.BooleanField(default=True)
+    object_ids = models.TextField(blank=True, default='[]')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    version = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    targets_total = models.PositiveIntegerField(default=0)
+    targets_done = models.PositiveIntegerField(default=0)
+    annotations_total = models.PositiveIntegerField(default=0)
+    annotations_done = models.PositiveIntegerField(default=0)
+    enqueued_at = models.DateTimeField(null=True, blank=True)
+    next_attempt_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('old_assignment_id', 'new_assignment_id', 'instructor_only')
+
+    def __unicode__(self):
+        return u"%s -> %s (%s)" % (self.old_assignment_id, self.new_assignment_id, self.status)
+
+class AnnotationTransferItem(models.Model):
+    '''
+    Checkpoint for one annotation copied by an AnnotationTransfer. The row is written before the
+    annotation is created, and created_id is filled in once the database returns it. A row
+    with an empty created_id is in doubt (the worker stopped mid-request), and it is checked
+    against the new course before the annotation is created again.
+    '''
+    transfer = models.ForeignKey(AnnotationTransfer, related_name='items')
+    target_object_id = models.CharField(max_length=255)
+    source_id = models.CharField(max_length=255)
+    created_id = models.CharField(max_length=255, blank=True, default='')
+
+    class Meta:
+        unique_together = ('transfer', 'source_id')
+
+    def __unicode__(self):
+        return u"%s -> %s" % (self.source_id, self.created_id)
+
+class DashboardSnapshot(models.Model):
+    '''
+    Per-course totals for the instructor dashboard, kept up to date by annotation_store.snapshot
+    so that the dashboard doesn't have to read every annotation in the course.
+
+    For the catch backend, synced_through is the latest `updated` timestamp seen and cursors
+    holds the highest annotation id seen in each annotation database (as JSON), which is
+    where the next incremental refresh starts from. uncounted_ids lists the annotations
+    marked deleted that are not in the totals (as JSON), so that they are subtracted once.
+    '''
+    context_id = models.CharField(max_length=255, unique=True)
+    total_annotations = models.PositiveIntegerField(default=0)
+    version = models.PositiveIntegerField(default=0)
+    refreshing_since = models.DateTimeField(null=True, blank=True)
+    refreshed_at = models.DateTimeField(null=True, blank=True)
+    full_refreshed_at = models.DateTimeField(null=True, blank=True)
+    synced_through = models.DateTimeField(null=True, blank=True)
+    cursors = models.TextField(blank=True, default='{}')
+    uncounted_ids = models.TextField(blank=True, default='[]')
+    last_error = models.TextField(blank=True, default='')
+
+    def __unicode__(self):
+        return u"%s (%s annotations)" % (self.context_id, self.total_annotations)
+
+class DashboardUserSummary(models.Model):
+    '''
+    Number of annotations and latest activity of one user in a DashboardSnapshot. Like the
+    snapshot's total, this counts annotations on sources no longer in the course's assignments.
+    '''
+    snapshot = models.ForeignKey(DashboardSnapshot, related_name='user_summaries')
+    user_id = models.CharField(max_length=1024)
+    user_name = models.CharField(max_length=1024, blank=True, default='')
+    sort_name = models.CharField(max_length=255, blank=True, default='')
+    total_annotations = models.IntegerField(default=0)
+    latest_activity = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('snapshot', 'user_id')
+        index_together = [('snapshot', 'sort_name')]
+
+    def __unicode__(self):
+        return u"%s (%s)" % (self.user_name, self.total_annotations)
+
+class DashboardObjectSummary(models.Model):
+    '''
+    Number of annotations and latest activity of one assignment object (collectionId and uri)
+    in a DashboardSnapshot.
+    '''
+    snapshot = models.ForeignKey(DashboardSnapshot, related_name='object_summaries')
+    collection_id = models.CharField(max_length=1024)
+    object_id = models.CharField(max_length=2048)
+    total_annotations = models.IntegerField(default=0)
+    latest_activity = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('snapshot', 'collection_id', 'object_id')
+
+    def __unicode__(self):
+        return u"%s/%s (%s)" % (self.collection_id, self.object_id, self.total_annotations)
+
+class RequestProfile(models.Model):
+    '''
+    Profile of a slow request, saved by annotationsx.profiling for a sample of the requests
+    that take longer than the threshold. Only the most recent profiles are kept.
+
+    profile is the cProfile report, queries the SQL statements made (as JSON, in order,
+    with their duration) and explains the query plans of the slowest ones.
+    '''
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    method = models.CharField(max_length=16)
+    path = models.CharField(max_length=1024)
+    view_name = models.CharField(max_length=255, blank=True, default='', db_index=True)
+    status = models.PositiveSmallIntegerField(null=True, blank=True)
+    duration_ms = models.FloatField()
+    query_count = models.PositiveIntegerField(default=0)
+    query_ms = models.FloatField(default=0)
+    phases = models.TextField(blank=True, default='{}')
+    profile = models.TextField(blank=True, default='')
+    queries = models.TextField(blank=True, default='[]')
+    explains = models.TextField(blank=True, default='[]')
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __unicode__(self):
+        return u"%s %s (%d ms)" % (self.method, self.path, self.duration_ms)
@@ -0,0 +1,179 @@
+'''
+Asynchronous LTI grade passback.
+
+Creating an annotation only records the grade in the LTIGradePassback table; the
+process_grade_passbacks management command sends the queued grades to the LMS outcome
+service, retrying failures with exponential backoff.
+'''
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Max, Min
+from django.utils import timezone
+from ims_lti_py.tool_provider import DjangoToolProvider
+from annotationsx import metrics
+
+from models import LTIGradePassback
+
+import datetime
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+PASSBACK_SETTINGS = getattr(settings, 'LTI_GRADE_PASSBACK', {})
+MAX_ATTEMPTS = PASSBACK_SETTINGS.get('max_attempts', 8)
+BACKOFF_BASE = PASSBACK_SETTINGS.get('backoff_base', 30)       # seconds
+BACKOFF_MAX = PASSBACK_SETTINGS.get('backoff_max', 60 * 60)    # seconds
+CLAIM_TIMEOUT = PASSBACK_SETTINGS.get('claim_timeout', 120)    # seconds a worker may hold an entry
+
+OUTCOME_PARAMS = ('lis_outcome_service_url', 'lis_result_sourcedid')
+
+
+def get_tool_provider(context_id, params=None):
+    '''
+    Returns a tool provider signed with the LTI secret configured for the course.
+    '''
+    try:
+        lti_secret = settings.LTI_SECRET_DICT[context_id]
+    except KeyError:
+        lti_secret = settings.LTI_SECRET
+
+    if params is not None:
+        return DjangoToolProvider(settings.CONSUMER_KEY, lti_secret, params)
+    return DjangoToolProvider(settings.CONSUMER_KEY, lti_secret)
+
+
+def backoff(attempts):
+    '''Returns the number of seconds to wait before the next attempt.'''
+    return min(BACKOFF_MAX, BACKOFF_BASE * (2 ** max(attempts - 1, 0)))
+
+
+@transaction.atomic
+def enqueue(user_id, resource_link_id, context_id, launch_params, score=1.0):
+    '''
+    Queues a grade for the user and resource link, collapsing it into any pending request.
+
+    Returns the queue entry, or None if the LMS already has this score.
+    '''
+    now = timezone.now()
+    outcome_params = dict((k, launch_params.get(k)) for k in OUTCOME_PARAMS)
+    entry, created = LTIGradePassback.objects.select_for_update().get_or_create(
+        user_id=user_id,
+        resource_link_id=resource_link_id,
+        defaults={'context_id': context_id, 'score': score, 'enqueued_at': now},
+    )
+
+    if not created:
+        if entry.status == LTIGradePassback.STATUS_SENT and entry.sent_score == score:
+            logger.debug("Grade passback skipped, score already sent: user_id=%s resource_link_id=%s", user_id, resource_link_id)
+            metrics.GRADE_PASSBACKS.inc(outcome='skipped')
+            return None
+
+    # a pending entry keeps its backoff, so that resubmitting doesn't retry a failing LMS right away
+    if created or entry.status != LTIGradePassback.STATUS_PENDING:
+        entry.enqueued_at = now
+        entry.attempts = 0
+        entry.last_error = ''
+        entry.next_attempt_at = now
+
+    entry.context_id = context_id
+    entry.score = score
+    entry.outcome_params = json.dumps(outcome_params)
+    entry.status = LTIGradePassback.STATUS_PENDING
+    entry.version += 1
+    entry.save()
+    logger.info("Grade passback queued: user_id=%s resource_link_id=%s score=%s", user_id, resource_link_id, score)
+    metrics.GRADE_PASSBACKS.inc(outcome='queued')
+    return entry
+
+
+def send(entry):
+    '''
+    Posts the entry's score to the LMS outcome service. Returns (success, description).
+    '''
+    tool_provider = get_tool_provider(entry.context_id, json.loads(entry.outcome_params))
+    if not tool_provider.is_outcome_service():
+        return (False, 'LTI consumer does not expect a grade for this user and assignment')
+    outcome = tool_provider.post_replace_result(entry.score)
+    return (outcome.is_success(), outcome.description)
+
+
+def process_pending(batch_size=100, now=None):
+    '''
+    Sends pending grades that are due. Entries are claimed before sending so that multiple
+    workers do not send the same grade, and results are only recorded if the entry was not
+    re-queued with a new score in the meantime.
+
+    Returns a dict with the number of entries sent, retried and failed.
+    '''
+    now = timezone.now() if now is None else now
+    counts = {'sent': 0, 'retried': 0, 'failed': 0}
+    due = LTIGradePassback.objects.filter(
+        status=LTIGradePassback.STATUS_PENDING,
+        next_attempt_at__lte=now,
+    ).order_by('next_attempt_at')[:batch_size]
+
+    for entry in list(due):
+        current = LTIGradePassback.objects.filter(pk=entry.pk, version=entry.version, next_attempt_at=entry.next_attempt_at)
+        if current.update(next_attempt_at=now + datetime.timedelta(seconds=CLAIM_TIMEOUT)) == 0:
+            continue  # claimed by another worker or re-queued
+        current = LTIGradePassback.objects.filter(pk=entry.pk, version=entry.version)
+
+        try:
+            success, description = send(entry)
+        except Exception as e:
+            success, description = (False, str(e))
+
+        attempts = entry.attempts + 1
+        finished_at = timezone.now()
+        if success:
+            latency = (finished_at - entry.enqueued_at).total_seconds() if entry.enqueued_at else None
+            current.update(
+                status=LTIGradePassback.STATUS_SENT,
+                sent_score=entry.score,
+                sent_at=finished_at,
+                attempts=attempts,
+                last_error='',
+                last_latency=latency,
+                next_attempt_at=None,
+            )
+            counts['sent'] += 1
+            metrics.GRADE_PASSBACKS.inc(outcome='sent')
+            logger.info("Grade passback sent: user_id=%s resource_link_id=%s score=%s attempts=%s latency=%s",
+                        entry.user_id, entry.resource_link_id, entry.score, attempts, latency)
+        elif attempts >= MAX_ATTEMPTS:
+            current.update(status=LTIGradePassback.STATUS_FAILED, attempts=attempts, last_error=description or '', next_attempt_at=None)
+            counts['failed'] += 1
+            metrics.GRADE_PASSBACKS.inc(outcome='failed')
+            logger.error("Grade passback failed permanently after %s attempts: user_id=%s resource_link_id=%s error=%s",
+                         attempts, entry.user_id, entry.resource_link_id, description)
+        else:
+            delay = backoff(attempts)
+            current.update(attempts=attempts, last_error=description or '', next_attempt_at=finished_at + datetime.timedelta(seconds=delay))
+            counts['retried'] += 1
+            metrics.GRADE_PASSBACKS.inc(outcome='retried')
+            logger.warning("Grade passback failed, retrying in %ss: user_id=%s resource_link_id=%s error=%s",
+                           delay, entry.user_id, entry.resource_link_id, description)
+    return counts
+
+
+def queue_stats(now=None, window=3600):
+    '''
+    Returns the queue depth and latency. Latency is measured from when a grade was first
+    queued until the LMS accepted it, over grades sent in the last `window` seconds.
+    '''
+    now = timezone.now() if now is None else now
+    pending = LTIGradePassback.objects.filter(status=LTIGradePassback.STATUS_PENDING)
+    oldest = pending.aggregate(oldest=Min('enqueued_at'))['oldest']
+    recent = LTIGradePassback.objects.filter(
+        status=LTIGradePassback.STATUS_SENT,
+        sent_at__gte=now - datetime.timedelta(seconds=window),
+    ).aggregate(avg=Avg('last_latency'), max=Max('last_latency'))
+    return {
+        'pending': pending.count(),
+        'due': pending.filter(next_attempt_at__lte=now).count(),
+        'failed': LTIGradePassback.objects.filter(status=LTIGradePassback.STATUS_FAILED).count(),
+        'oldest_pending_age': (now - oldest).total_seconds() if oldest else 0,
+        'avg_latency': recent['avg'] or 0,
+        'max_latency': recent['max'] or 0,
+    }
@@ -0,0 +1,100 @@
+'''
+Per-request logging for the annotation store.
+
+The store logs a line or two for every search, create, update and delete. In the default
+"structured" mode those lines are key=value pairs that are only formatted if a handler
+actually emits them, requests are sampled per route, request bodies are logged by size,
+and auth headers are redacted. Setting the mode to "verbose" logs every request with the
+full body, headers and query string for debugging.
+
+Configured with the "logging" key of the ANNOTATION_STORE setting:
+
+    ANNOTATION_STORE = {
+        "backend": "catch",
+        "logging": {
+            "mode": "structured",              # or "verbose"
+            "sample_rates": {"search": 0.1},   # fraction of requests logged per route
+            "default_sample_rate": 1.0,
+            "redact_headers": True,
+        }
+    }
+
+Warnings and errors are never sampled.
+'''
+from django.conf import settings
+
+import logging
+import random
+
+LOGGING_SETTINGS = getattr(settings, 'ANNOTATION_STORE', {}).get('logging', {})
+
+MODE_STRUCTURED = 'structured'
+MODE_VERBOSE = 'verbose'
+
+REDACTED = '[redacted]'
+SENSITIVE_HEADERS = ('x-annotator-auth-token', 'authorization', 'cookie', 'http_x_annotator_auth_token', 'http_authorization', 'http_cookie')
+
+SAMPLED_ATTR = '_annotation_store_log_sampled'
+
+
+def redact_headers(headers):
+    '''Returns a copy of the headers dict with credentials replaced.'''
+    return dict((k, REDACTED if k.lower() in SENSITIVE_HEADERS else v) for k, v in headers.items())
+
+
+class LogFields(object):
+    '''
+    Formats a dict as sorted key=value pairs when converted to a string. Passing this
+    to the logger as an argument defers the formatting until a handler emits the record.
+    '''
+    def __init__(self, fields):
+        self.fields = fields
+
+    def __unicode__(self):
+        return u' '.join(u'%s=%s' % (k, self.fields[k]) for k in sorted(self.fields))
+
+    def __str__(self):
+        return unicode(self).encode('utf-8')
+
+
+class RequestLogger(object):
+    '''
+    Writes annotation store log lines for a single request.
+
+    The sampling decision for a route is made once per request and stored on the request,
+    so the store and its backend log all or none of the lines for the same request.
+    '''
+    def __init__(self, logger, request, settings_dict=None):
+        config = LOGGING_SETTINGS if settings_dict is None else settings_dict
+        self.logger = logger
+        self.request = request
+        self.verbose = config.get('mode', MODE_STRUCTURED) == MODE_VERBOSE
+        self.sample_rates = config.get('sample_rates', {})
+        self.default_sample_rate = config.get('default_sample_rate', 1.0)
+        self.redact = config.get('redact_headers', True)
+
+    def is_sampled(self, route):
+        if self.verbose:
+            return True
+        decisions = getattr(self.request, SAMPLED_ATTR, None)
+        if decisions is None:
+            decisions = {}
+            setattr(self.request, SAMPLED_ATTR, decisions)
+        if route not in decisions:
+            rate = self.sample_rates.get(route, self.default_sample_rate)
+            decisions[route] = rate >= 1.0 or (rate > 0 and random.random() < rate)
+        return decisions[route]
+
+    def info(self, route, event, **fields):
+        '''
+        Logs an informational line about a request. In structured mode, a "body" field is
+        replaced with its size and a "headers" field is redacted.
+        '''
+        if not self.logger.isEnabledFor(logging.INFO) or not self.is_sampled(route):
+            return
+        if 'headers' in fields and self.redact:
+            fields['headers'] = redact_headers(fields['headers'])
+        if not self.verbose and 'body' in fields:
+            body = fields.pop('body')
+            fields['body_bytes'] = len(body) if body is not None else 0
+        self.logger.info("%s %s %s", route, event, LogFields(fields))
@@ -0,0 +1,386 @@
+'''
+Per-course snapshots for the instructor dashboard.
+
+A DashboardSnapshot holds the number of annotations and latest activity of each user and of
+each assignment object in a course. The dashboard reads them with indexed queries instead of
+fetching and scanning every annotation in the course.
+
+With the app backend, the snapshot is updated from the write path: AppStoreBackend calls
+record_annotation() and record_deletion() in the same transaction as the annotation itself.
+
+With the catch backend, snapshots are refreshed by the refresh_dashboard_snapshots management
+command, and by the dashboard when the snapshot is older than `max_age`. A refresh pages
+through the course newest first and stops at the first page with nothing updated since the
+last refresh. Annotations with ids above the highest id seen before are counted as new. Older
+ones only move the latest activity forward, or are subtracted if they are marked deleted.
+Annotations removed outright, and edits of annotations that are no longer on the first pages,
+are picked up by a full refresh, which the command makes every `full_refresh_interval`.
+'''
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, Q
+from django.utils import timezone
+from dateutil import parser as date_parser, tz
+
+from hx_lti_assignment.models import Assignment
+from hx_lti_initializer import annotation_database
+from hx_lti_initializer.utils import fetch_annotation_pages, get_annotation_databases, _fetch_annotations_by_course
+from models import Annotation, DashboardSnapshot, DashboardUserSummary, DashboardObjectSummary
+
+import datetime
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_SETTINGS = getattr(settings, 'DASHBOARD_SNAPSHOT', {})
+MAX_AGE = SNAPSHOT_SETTINGS.get('max_age', 300)                                        # seconds before the dashboard refreshes a catch snapshot
+FULL_REFRESH_INTERVAL = SNAPSHOT_SETTINGS.get('full_refresh_interval', 24 * 60 * 60)   # seconds between full refreshes by the command
+CLAIM_TIMEOUT = SNAPSHOT_SETTINGS.get('claim_timeout', 300)                            # seconds before an unfinished refresh can be taken over
+PAGE_SIZE = SNAPSHOT_SETTINGS.get('page_size', 200)                                    # annotations per search in incremental refreshes
+
+# results of refresh()
+REBUILT = 'rebuilt'
+UPDATED = 'updated'
+BUSY = 'busy'
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def app_backend():
+    from store import AnnotationStore
+    return AnnotationStore.SETTINGS.get('backend', 'catch') == 'app'
+
+
+def parse_date(value):
+    '''
+    Parses the created/updated timestamp of an annotation. Returns an aware datetime, or None.
+    '''
+    if not value:
+        return None
+    if len(value) == 32 and value.endswith('+00:00'):
+        # the format CATCH uses, which is much faster to parse without dateutil
+        try:
+            return datetime.datetime.strptime(value[:26], '%Y-%m-%dT%H:%M:%S.%f').replace(tzinfo=tz.tzutc())
+        except ValueError:
+            pass
+    try:
+        parsed = date_parser.parse(value)
+    except (ValueError, OverflowError, TypeError):
+        return None
+    return parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=tz.tzutc())
+
+
+def summarize(rows):
+    '''
+    Adds up annotation rows in the CATCH format. Returns ({user_id: [name, total, latest]},
+    {(collection_id, object_id): [total, latest]}).
+    '''
+    users, objects = {}, {}
+    for row in rows:
+        updated = parse_date(row.get('updated'))
+        user = row.get('user', {})
+        user_summary = users.setdefault(user.get('id', ''), [user.get('name', ''), 0, None])
+        object_summary = objects.setdefault((row.get('collectionId', ''), unicode(row.get('uri', ''))), [0, None])
+        user_summary[1] += 1
+        object_summary[0] += 1
+        user_summary[2] = latest([user_summary[2], updated])
+        object_summary[1] = latest([object_summary[1], updated])
+    return users, objects
+
+
+def latest(dates):
+    dates = [date for date in dates if date is not None]
+    return max(dates) if dates else None
+
+
+def sort_name(name):
+    return (name or '').strip().lower()[:255]
+
+
+def claim(snapshot, now):
+    '''
+    Marks the snapshot as being refreshed, unless another refresh started less than
+    CLAIM_TIMEOUT seconds ago. Returns True if the claim was made.
+    '''
+    stale = now - datetime.timedelta(seconds=CLAIM_TIMEOUT)
+    claimed = DashboardSnapshot.objects.filter(pk=snapshot.pk, version=snapshot.version).filter(
+        Q(refreshing_since__isnull=True) | Q(refreshing_since__lt=stale)
+    ).update(version=F('version') + 1, refreshing_since=now)
+    if claimed:
+        snapshot.version += 1
+        snapshot.refreshing_since = now
+    return bool(claimed)
+
+
+def lock(snapshot):
+    '''
+    Locks the snapshot row for the rest of the transaction. Returns False if the claim on it was
+    lost, in which case nothing should be written.
+    '''
+    return DashboardSnapshot.objects.select_for_update().filter(pk=snapshot.pk, version=snapshot.version).exists()
+
+
+def get_snapshot(context_id, now=None):
+    '''
+    Returns the snapshot of a course for the dashboard. A missing snapshot is built, and a
+    catch snapshot older than MAX_AGE is refreshed incrementally first. If it can't be
+    refreshed right now, the snapshot is returned as it is.
+    '''
+    now = timezone.now() if now is None else now
+    snapshot = DashboardSnapshot.objects.filter(context_id=context_id).first()
+    if snapshot is None or snapshot.refreshed_at is None or \
+            (not app_backend() and now - snapshot.refreshed_at > datetime.timedelta(seconds=MAX_AGE)):
+        try:
+            refresh(context_id, now=now)
+        except SnapshotError as e:
+            logger.warning("Could not refresh the dashboard snapshot of %s: %s" % (context_id, e))
+        snapshot = DashboardSnapshot.objects.get(context_id=context_id)
+    return snapshot
+
+
+def user_activity(context_id, user_id):
+    '''
+    Returns the number of annotations and the latest activity of a user in the course's
+    snapshot, or (0, None).
+    '''
+    return DashboardUserSummary.objects.filter(snapshot__context_id=context_id, user_id=user_id).values_list(
+        'total_annotations', 'latest_activity').first() or (0, None)
+
+
+def refresh(context_id, full=False, now=None):
+    '''
+    Refreshes the snapshot of a course, creating it if needed. A snapshot that has never been
+    fully refreshed is rebuilt, as is every app snapshot. Returns REBUILT, UPDATED, or BUSY if
+    another refresh is running. Raises SnapshotError if the annotations can't be fetched.
+    '''
+    now = timezone.now() if now is None else now
+    snapshot, created = DashboardSnapshot.objects.get_or_create(context_id=context_id)
+    if not claim(snapshot, now):
+        return BUSY
+
+    try:
+        if app_backend():
+            result = rebuild_from_app(snapshot, now)
+        elif full or snapshot.full_refreshed_at is None:
+            result = rebuild_from_catch(snapshot, now)
+        else:
+            result = update_from_catch(snapshot, now)
+    except Exception as e:
+        DashboardSnapshot.objects.filter(pk=snapshot.pk, version=snapshot.version).update(
+            refreshing_since=None, last_error="%s: %s" % (e.__class__.__name__, e))
+        raise
+    logger.info("Dashboard snapshot of %s: %s" % (context_id, result))
+    return result
+
+
+def refresh_all(full=False, now=None):
+    '''
+    Refreshes the snapshots of all courses with assignments. Catch snapshots are fully
+    refreshed every FULL_REFRESH_INTERVAL seconds, or always if `full` is set. App snapshots
+    are kept up to date by the write path, so only missing ones are built unless `full` is set.
+    Returns the number of snapshots for each result, plus 'failed'.
+    '''
+    now = timezone.now() if now is None else now
+    full_before = now - datetime.timedelta(seconds=FULL_REFRESH_INTERVAL)
+    snapshots = dict((s.context_id, s) for s in DashboardSnapshot.objects.all())
+    counts = {REBUILT: 0, UPDATED: 0, BUSY: 0, 'failed': 0}
+    for context_id in Assignment.objects.order_by().values_list('course__course_id', flat=True).distinct():
+        snapshot = snapshots.get(context_id)
+        missing = snapshot is None or snapshot.full_refreshed_at is None
+        due = missing or snapshot.full_refreshed_at < full_before
+        if app_backend() and not (full or missing):
+            continue
+        try:
+            counts[refresh(context_id, full=full or due, now=now)] += 1
+        except SnapshotError as e:
+            logger.warning("Could not refresh the dashboard snapshot of %s: %s" % (context_id, e))
+            counts['failed'] += 1
+    return counts
+
+
+def replace_summaries(snapshot, users, objects):
+    DashboardUserSummary.objects.filter(snapshot=snapshot).delete()
+    DashboardObjectSummary.objects.filter(snapshot=snapshot).delete()
+    DashboardUserSummary.objects.bulk_create([
+        DashboardUserSummary(snapshot=snapshot, user_id=user_id, user_name=name, sort_name=sort_name(name),
+                             total_annotations=total, latest_activity=latest)
+        for user_id, (name, total, latest) in users.iteritems()
+    ])
+    DashboardObjectSummary.objects.bulk_create([
+        DashboardObjectSummary(snapshot=snapshot, collection_id=collection_id, object_id=object_id,
+                               total_annotations=total, latest_activity=latest)
+        for (collection_id, object_id), (total, latest) in objects.iteritems()
+    ])
+    return sum(total for name, total, latest in users.itervalues())
+
+
+def rebuild_from_app(snapshot, now):
+    with transaction.atomic():
+        if not lock(snapshot):
+            return BUSY
+        annotations = Annotation.objects.filter(context_id=snapshot.context_id).order_by()
+        users = dict(
+            (row['user_id'], (row['name'], row['total'], row['latest']))
+            for row in annotations.values('user_id').annotate(name=Max('user_name'), total=Count('id'), latest=Max('updated_at'))
+        )
+        objects = dict(
+            ((row['collection_id'], row['uri']), (row['total'], row['latest']))
+            for row in annotations.values('collection_id', 'uri').annotate(total=Count('id'), latest=Max('updated_at'))
+        )
+        total = replace_summaries(snapshot, users, objects)
+        DashboardSnapshot.objects.filter(pk=snapshot.pk).update(
+            total_annotations=total, refreshing_since=None, refreshed_at=now, full_refreshed_at=now, last_error='')
+    return REBUILT
+
+
+def rebuild_from_catch(snapshot, now):
+    context_id = snapshot.context_id
+    rows, cursors, uncounted_ids = [], {}, []
+    for db_url, token in get_annotation_databases(context_id, annotation_database.ADMIN_GROUP_ID):
+        results = fetch_annotation_pages(context_id, [(db_url, token)])
+        if results['errors']:
+            raise SnapshotError("%s of %s pages could not be fetched from %s" % (results['errors'], len(results['pages']), db_url))
+        rows.extend(row for row in results['rows'] if not row.get('deleted'))
+        uncounted_ids.extend(row_key(db_url, row) for row in results['rows'] if row.get('deleted'))
+        cursors[db_url] = max([row['id'] for row in results['rows']] or [0])
+    users, objects = summarize(rows)
+    synced_through = latest([latest_activity for name, total, latest_activity in users.itervalues()])
+
+    with transaction.atomic():
+        if not lock(snapshot):
+            return BUSY
+        total = replace_summaries(snapshot, users, objects)
+        DashboardSnapshot.objects.filter(pk=snapshot.pk).update(
+            total_annotations=total, refreshing_since=None, refreshed_at=now, full_refreshed_at=now,
+            synced_through=synced_through, cursors=json.dumps(cursors), uncounted_ids=json.dumps(uncounted_ids), last_error='')
+    return REBUILT
+
+
+def row_key(db_url, row):
+    return '%s#%s' % (db_url, row['id'])
+
+
+def fetch_changes(snapshot, db_url, token, last_id):
+    '''
+    Pages through a course newest first until a page has nothing new or updated since the
+    snapshot was last refreshed. Returns (new rows, updated rows).
+    '''
+    new_rows, updated_rows, seen, offset = [], [], set(), 0
+    while True:
+        page = _fetch_annotations_by_course(snapshot.context_id, db_url, token, limit=PAGE_SIZE, offset=offset)
+        if page.error is not None:
+            raise SnapshotError(page.error)
+        changed = False
+        for row in page.rows:
+            if row['id'] in seen:
+                continue # shifted to the next page by an annotation created while paging
+            seen.add(row['id'])
+            if row['id'] > last_id:
+                new_rows.append(row)
+                changed = True
+            else:
+                updated = parse_date(row.get('updated'))
+                if updated is not None and snapshot.synced_through is not None and updated >= snapshot.synced_through:
+                    updated_rows.append(row)
+                    changed = True
+        if not changed or len(page.rows) < PAGE_SIZE:
+            return new_rows, updated_rows
+        offset += PAGE_SIZE
+
+
+def update_from_catch(snapshot, now):
+    context_id = snapshot.context_id
+    cursors = json.loads(snapshot.cursors or '{}')
+    uncounted_ids = set(json.loads(snapshot.uncounted_ids or '[]'))
+    new_rows, updated_rows, removed_rows = [], [], []
+    for db_url, token in get_annotation_databases(context_id, annotation_database.ADMIN_GROUP_ID):
+        db_new_rows, db_updated_rows = fetch_changes(snapshot, db_url, token, cursors.get(db_url, 0))
+        new_rows.extend(db_new_rows)
+        updated_rows.extend(db_updated_rows)
+        cursors[db_url] = max([cursors.get(db_url, 0)] + [row['id'] for row in db_new_rows])
+        # deleted rows are subtracted once, and only if they were counted: the newest row is
+        # seen again by every refresh, and rows deleted before they were counted never were
+        new_ids = set(row['id'] for row in db_new_rows)
+        for row in db_new_rows + db_updated_rows:
+            if row.get('deleted') and row_key(db_url, row) not in uncounted_ids:
+                uncounted_ids.add(row_key(db_url, row))
+                if row['id'] not in new_ids:
+                    removed_rows.append(row)
+    synced_through = latest([snapshot.synced_through] + [parse_date(row.get('updated')) for row in new_rows + updated_rows])
+
+    added, activity = summarize([row for row in new_rows if not row.get('deleted')]), summarize(updated_rows)
+    removed = summarize(removed_rows)
+    with transaction.atomic():
+        if not lock(snapshot):
+            return BUSY
+        total = apply_summaries(snapshot, added, sign=1)
+        total -= apply_summaries(snapshot, removed, sign=-1)
+        apply_summaries(snapshot, activity, sign=0)
+        DashboardSnapshot.objects.filter(pk=snapshot.pk).update(
+            total_annotations=F('total_annotations') + total, refreshing_since=None, refreshed_at=now,
+            synced_through=synced_through, cursors=json.dumps(cursors), uncounted_ids=json.dumps(sorted(uncounted_ids)), last_error='')
+    return UPDATED
+
+
+def apply_summaries(snapshot, summaries, sign):
+    '''
+    Adds (sign=1) or subtracts (sign=-1) the totals from summarize() to the snapshot's
+    summaries, and moves their latest activity forward. With sign=0, only the latest activity
+    is updated. Returns the number of annotations added or subtracted.
+    '''
+    users, objects = summaries
+    for user_id, (name, total, latest) in users.iteritems():
+        add_to_summary(DashboardUserSummary, {'snapshot_id': snapshot.pk, 'user_id': user_id}, sign * total, latest,
+                       user_name=name, sort_name=sort_name(name))
+    for (collection_id, object_id), (total, latest) in objects.iteritems():
+        add_to_summary(DashboardObjectSummary, {'snapshot_id': snapshot.pk, 'collection_id': collection_id, 'object_id': object_id},
+                       sign * total, latest)
+    return sum(total for name, total, latest in users.itervalues())
+
+
+def add_to_summary(model, lookup, total, latest, **fields):
+    '''
+    Adds `total` to the summary matching `lookup`, creating it if needed, and moves its latest
+    activity forward to `latest`. Other `fields` are overwritten.
+    '''
+    summary, created = model.objects.get_or_create(defaults=fields, **lookup)
+    updates = {} if created else dict(fields)
+    if total:
+        updates['total_annotations'] = F('total_annotations') + total
+    if updates:
+        model.objects.filter(pk=summary.pk).update(**updates)
+    if latest is not None:
+        model.objects.filter(pk=summary.pk).filter(Q(latest_activity__isnull=True) | Q(latest_activity__lt=latest)).update(latest_activity=latest)
+
+
+def record_annotation(anno, created):
+    '''
+    Updates the course's snapshot for an annotation saved by the app backend. Does nothing if
+    the course has no snapshot yet, since it will be built from the annotations table when the
+    dashboard first reads it.
+
+    The snapshot row is updated first, which locks it until the transaction commits, so that a
+    rebuild can't run between the annotation being saved and the snapshot being updated.
+    '''
+    total = 1 if created else 0
+    if not DashboardSnapshot.objects.filter(context_id=anno.context_id).update(total_annotations=F('total_annotations') + total):
+        return
+    snapshot = DashboardSnapshot.objects.get(context_id=anno.context_id)
+    add_to_summary(DashboardUserSummary, {'snapshot_id': snapshot.pk, 'user_id': anno.user_id}, total, anno.updated_at,
+                   user_name=anno.user_name, sort_name=sort_name(anno.user_name))
+    add_to_summary(DashboardObjectSummary, {'snapshot_id': snapshot.pk, 'collection_id': anno.collection_id, 'object_id': anno.uri},
+                   total, anno.updated_at)
+
+
+def record_deletion(anno):
+    '''
+    Updates the course's snapshot for an annotation deleted by the app backend.
+    '''
+    if not DashboardSnapshot.objects.filter(context_id=anno.context_id).update(total_annotations=F('total_annotations') - 1):
+        return
+    snapshot = DashboardSnapshot.objects.get(context_id=anno.context_id)
+    add_to_summary(DashboardUserSummary, {'snapshot_id': snapshot.pk, 'user_id': anno.user_id}, -1, None)
+    add_to_summary(DashboardObjectSummary, {'snapshot_id': snapshot.pk, 'collection_id': anno.collection_id, 'object_id': anno.uri}, -1, None)
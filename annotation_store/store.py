@@ -2,18 +2,23 @@ from django.conf import settings
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
 from django.core.exceptions import PermissionDenied
-from django.db import transaction
+from django.db import IntegrityError, transaction
 from django.db.models import F, Q
-from ims_lti_py.tool_provider import DjangoToolProvider
 from hx_lti_assignment.models import Assignment
-from hx_lti_initializer.utils import retrieve_token
+from hx_lti_initializer.utils import retrieve_token, invalidate_student_panel
+from annotationsx.compression import accepts_encoding
+from annotationsx import metrics, timing
 
 from models import Annotation, AnnotationTags
+import passback
+import snapshot
+from request_log import RequestLogger
 
 import json
 import requests
 import datetime
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -55,6 +60,7 @@ class AnnotationStore(object):
         self.backend = backend_instance
         self.outcome = None
         self.logger = logging.getLogger('{module}.{cls}'.format(module=__name__, cls=self.__class__.__name__))
+        self.request_log = RequestLogger(self.logger, request)
         assert self.backend is not None
 
     @classmethod
@@ -77,7 +83,7 @@ class AnnotationStore(object):
         raise NotImplementedError
 
     def search(self):
-        self.logger.info(u"Search: %s" % self.request.GET)
+        self.request_log.info('search', 'received', params=self.request.GET)
         self._verify_course(self.request.GET.get('contextId', None))
         if hasattr(self.backend, 'before_search'):
             self.backend.before_search()
@@ -85,14 +91,20 @@ class AnnotationStore(object):
 
     def create(self):
         body = json.loads(self.request.body)
-        self.logger.info(u"Create annotation: %s" % body)
+        self.request_log.info('create', 'received', body=self.request.body)
         self._verify_course(body.get('contextId', None))
         self._verify_user(body.get('user', {}).get('id', None))
         if hasattr(self.backend, 'before_create'):
             self.backend.before_create()
         response = self.backend.create()
+        self.after_create(body, response)
         return response
 
+    def after_create(self, body, response):
+        # the author's dashboard panel has a new annotation
+        if response.status_code == 200:
+            invalidate_student_panel(body.get('contextId', ''), body.get('user', {}).get('id', None) or None)
+
     def read(self, annotation_id):
         raise NotImplementedError
 
@@ -101,20 +113,25 @@ class AnnotationStore(object):
 
     def update(self, annotation_id):
         body = json.loads(self.request.body)
-        self.logger.info(u"Update annotation %s: %s" % (annotation_id, body))
+        self.request_log.info('update', 'received', annotation_id=annotation_id, body=self.request.body)
         self._verify_course(body.get('contextId', None))
         self._verify_user(body.get('user', {}).get('id', None))
         if hasattr(self.backend, 'before_update'):
             self.backend.before_update(annotation_id)
         response = self.backend.update(annotation_id)
-        self.after_update(annotation_id, response)
+        self.after_update(annotation_id, response, body)
         return response
 
-    def after_update(self, annotation_id, response):
-        pass
+    def after_update(self, annotation_id, response, body=None):
+        # replies show the text of the annotation they reply to in their authors' panels
+        if response.status_code == 200 and body is not None:
+            context_id = body.get('contextId', '')
+            invalidate_student_panel(context_id, body.get('user', {}).get('id', None) or None)
+            if body.get('totalComments', 0):
+                invalidate_student_panel(context_id)
 
     def delete(self, annotation_id):
-        self.logger.info(u"Delete annotation %s" % annotation_id)
+        self.request_log.info('delete', 'received', annotation_id=annotation_id)
         if hasattr(self.backend, 'before_delete'):
             self.backend.before_delete(annotation_id)
         response = self.backend.delete(annotation_id)
@@ -122,7 +139,9 @@ class AnnotationStore(object):
         return response
 
     def after_delete(self, annotation_id, response):
-        pass
+        # the owner of a deleted annotation isn't known to every backend, so the whole course is invalidated
+        if response.status_code in (200, 204):
+            invalidate_student_panel(self.request.LTI['hx_context_id'])
 
     def _verify_course(self, context_id, raise_exception=True):
         expected = self.request.LTI['hx_context_id']
@@ -143,15 +162,7 @@ class AnnotationStore(object):
         return result
 
     def _get_tool_provider(self):
-        try:
-            lti_secret = settings.LTI_SECRET_DICT[self.request.LTI.get('hx_context_id')]
-        except KeyError:
-            lti_secret = settings.LTI_SECRET
-
-        if 'launch_params' in self.request.LTI:
-            params = self.request.LTI['launch_params']
-            return DjangoToolProvider(CONSUMER_KEY, lti_secret, params)
-        return DjangoToolProvider(CONSUMER_KEY, lti_secret)
+        return passback.get_tool_provider(self.request.LTI.get('hx_context_id'), self.request.LTI.get('launch_params'))
 
     def lti_grade_passback(self, score=1.0):
         if score < 0 or score > 1.0 or isinstance(score, basestring):
@@ -166,13 +177,36 @@ class AnnotationStore(object):
             self.logger.info(vars(outcome))
             if outcome.is_success():
                 self.logger.info(u"LTI grade request was successful. Description: %s" % outcome.description)
+                metrics.GRADE_PASSBACKS.inc(outcome='sent')
             else:
                 self.logger.error(u"LTI grade request failed. Description: %s" % outcome.description)
+                metrics.GRADE_PASSBACKS.inc(outcome='failed')
             self.outcome = outcome
         except Exception as e:
             self.logger.error("LTI post_replace_result request failed: %s" % str(e))
+            metrics.GRADE_PASSBACKS.inc(outcome='error')
         return self.outcome
 
+    def queue_lti_grade_passback(self, score=1.0):
+        '''
+        Queues the grade to be sent by the process_grade_passbacks worker instead of
+        posting it to the LMS during the request.
+        '''
+        if score < 0 or score > 1.0 or isinstance(score, basestring):
+            return
+        tool_provider = self._get_tool_provider()
+        if not tool_provider.is_outcome_service():
+            self.logger.debug("LTI consumer does not expect a grade for the current user and assignment")
+            return
+        launch_params = self.request.LTI['launch_params']
+        return passback.enqueue(
+            user_id=launch_params['user_id'],
+            resource_link_id=launch_params['resource_link_id'],
+            context_id=self.request.LTI['hx_context_id'],
+            launch_params=launch_params,
+            score=score,
+        )
+
 
 ###########################################################
 # Backend Classes
@@ -186,6 +220,7 @@ class StoreBackend(object):
     def __init__(self, request):
         self.request = request
         self.logger = logging.getLogger('{module}.{cls}'.format(module=__name__, cls=self.__class__.__name__))
+        self.request_log = RequestLogger(self.logger, request)
 
     def root(self):
         return HttpResponse(json.dumps(dict(name=self.BACKEND_NAME)), content_type='application/json')
@@ -236,7 +271,9 @@ class StoreBackend(object):
         '''
         permissions = {"read": [], "admin": [], "update": [], "delete": []}
         permissions.update(data.get('permissions', {}))
-        self.logger.debug("_modify_permissions() before: %s" % str(permissions))
+        log_permissions = self.logger.isEnabledFor(logging.DEBUG)
+        if log_permissions:
+            self.logger.debug("_modify_permissions() before: %s", str(permissions))
 
         # No change required when the annotation is world-readable
         if len(permissions['read']) == 0:
@@ -261,7 +298,8 @@ class StoreBackend(object):
             if self.ADMIN_GROUP_ID not in permissions['read']:
                 permissions['read'].append(self.ADMIN_GROUP_ID)
 
-        self.logger.debug("_modify_permissions() after: %s" % str(permissions))
+        if log_permissions:
+            self.logger.debug("_modify_permissions() after: %s", str(permissions))
 
         data['permissions'] = permissions
         return data
@@ -272,6 +310,7 @@ class CatchStoreBackend(StoreBackend):
     def __init__(self, request):
         super(CatchStoreBackend, self).__init__(request)
         self.logger = logging.getLogger('{module}.{cls}'.format(module=__name__, cls=self.__class__.__name__))
+        self.request_log = RequestLogger(self.logger, request)
         self.headers = {
             'x-annotator-auth-token': request.META.get('HTTP_X_ANNOTATOR_AUTH_TOKEN', '!!MISSING!!'),
             'content-type': 'application/json',
@@ -288,6 +327,24 @@ class CatchStoreBackend(StoreBackend):
     def _response_timeout(self):
         return HttpResponse(json.dumps({"error": "request timeout"}), status=500, content_type='application/json')
 
+    def _send(self, operation, method, url, **kwargs):
+        '''
+        Sends a request to the database with the given requests method, timed for the
+        Server-Timing header and counted in the metrics by operation and status.
+        '''
+        status = 'error'
+        start = time.time()
+        try:
+            with timing.phase('catch'):
+                response = method(url, **kwargs)
+            status = response.status_code
+            return response
+        except requests.exceptions.Timeout:
+            status = 'timeout'
+            raise
+        finally:
+            metrics.observe_catch(operation, time.time() - start, status)
+
     def before_search(self):
         # Override the auth token when the user is a course administrator, so they can query annotations
         # that have set their read permissions to private (i.e. read: self-only).
@@ -301,50 +358,62 @@ class CatchStoreBackend(StoreBackend):
         timeout = 10.0
         params = self.request.GET.urlencode()
         database_url = self._get_database_url('/search')
-        self.logger.info('search request: url=%s headers=%s params=%s timeout=%s' % (database_url, self.headers, params, timeout))
+        self.request_log.info('search', 'request', url=database_url, headers=self.headers, params=params, timeout=timeout)
         try:
-            response = requests.get(database_url, headers=self.headers, params=params, timeout=timeout)
+            response = self._send('search', requests.get, database_url, headers=self.headers, params=params, timeout=timeout, stream=True)
         except requests.exceptions.Timeout as e:
             self.logger.error("requested timed out!")
             return self._response_timeout()
-        self.logger.info('search response status_code=%s content_length=%s' % (response.status_code, response.headers.get('content-length', 0)))
-        return HttpResponse(response.content, status=response.status_code, content_type='application/json')
+        self.request_log.info('search', 'response', status_code=response.status_code, content_length=response.headers.get('content-length', 0))
+
+        # If the database already compressed the results and the client can decode them, pass the
+        # encoded bytes through rather than decompressing here and compressing them again.
+        content_encoding = response.headers.get('content-encoding', None)
+        if content_encoding and accepts_encoding(self.request, content_encoding):
+            with timing.phase('catch', calls=0):
+                content = response.raw.read(decode_content=False)
+            http_response = HttpResponse(content, status=response.status_code, content_type='application/json')
+            http_response['Content-Encoding'] = content_encoding
+            return http_response
+        with timing.phase('catch', calls=0):
+            content = response.content
+        return HttpResponse(content, status=response.status_code, content_type='application/json')
 
     def create(self):
         body = self._get_request_body()
         database_url = self._get_database_url('/create')
         data = json.dumps(body)
-        self.logger.info('create request: url=%s headers=%s data=%s' % (database_url, self.headers, data))
+        self.request_log.info('create', 'request', url=database_url, headers=self.headers, body=data)
         try:
-            response = requests.post(database_url, data=data, headers=self.headers, timeout=self.timeout)
+            response = self._send('create', requests.post, database_url, data=data, headers=self.headers, timeout=self.timeout)
         except requests.exceptions.Timeout as e:
             self.logger.error("requested timed out!")
             return self._response_timeout()
-        self.logger.info('create response status_code=%s' % response.status_code)
+        self.request_log.info('create', 'response', status_code=response.status_code)
         return HttpResponse(response.content, status=response.status_code, content_type='application/json')
 
     def update(self, annotation_id):
         body = self._get_request_body()
         database_url = self._get_database_url('/update/%s' % annotation_id)
         data = json.dumps(body)
-        self.logger.info('update request: url=%s headers=%s data=%s' % (database_url, self.headers, data))
+        self.request_log.info('update', 'request', url=database_url, headers=self.headers, body=data)
         try:
-            response = requests.post(database_url, data=data, headers=self.headers, timeout=self.timeout)
+            response = self._send('update', requests.post, database_url, data=data, headers=self.headers, timeout=self.timeout)
         except requests.exceptions.Timeout as e:
             self.logger.error("requested timed out!")
             return self._response_timeout()
-        self.logger.info('update response status_code=%s' % response.status_code)
+        self.request_log.info('update', 'response', status_code=response.status_code)
         return HttpResponse(response.content, status=response.status_code, content_type='application/json')
 
     def delete(self, annotation_id):
         database_url = self._get_database_url('/delete/%s' % annotation_id)
-        self.logger.info('delete request: url=%s headers=%s' % (database_url, self.headers))
+        self.request_log.info('delete', 'request', url=database_url, headers=self.headers)
         try:
-            response = requests.delete(database_url, headers=self.headers, timeout=self.timeout)
+            response = self._send('delete', requests.delete, database_url, headers=self.headers, timeout=self.timeout)
         except requests.exceptions.Timeout as e:
             self.logger.error("requested timed out!")
             return self._response_timeout()
-        self.logger.info('delete response status_code=%s' % response.status_code)
+        self.request_log.info('delete', 'response', status_code=response.status_code)
         return HttpResponse(response)
 
 
@@ -446,6 +515,7 @@ class AppStoreBackend(StoreBackend):
         anno = Annotation.objects.get(pk=annotation_id)
         anno.is_deleted = True
         anno.save()
+        snapshot.record_deletion(anno)
 
         if anno.parent_id:
             parent_anno = Annotation.objects.get(pk=anno.parent_id)
@@ -476,6 +546,7 @@ class AppStoreBackend(StoreBackend):
         if 'parent' in body and body['parent'] != '0':
             anno.parent_id = int(body['parent'])
         anno.save()
+        snapshot.record_annotation(anno, created=create)
 
         if create and anno.parent_id:
             parent_anno = Annotation.objects.get(pk=int(body['parent']))
@@ -484,9 +555,18 @@ class AppStoreBackend(StoreBackend):
 
         if not create:
             anno.tags.clear()
-        for tag_name in body.get('tags', []):
-            tag_object, created = AnnotationTags.objects.get_or_create(name=tag_name.strip())
-            anno.tags.add(tag_object)
+        tag_names = set(tag_name.strip() for tag_name in body.get('tags', []))
+        if tag_names:
+            # a fixed number of queries however many tags there are
+            existing = set(AnnotationTags.objects.filter(name__in=tag_names).values_list('name', flat=True))
+            try:
+                with transaction.atomic():
+                    AnnotationTags.objects.bulk_create([AnnotationTags(name=name) for name in tag_names - existing])
+            except IntegrityError:
+                # another request created one of them in the meantime
+                for name in tag_names - existing:
+                    AnnotationTags.objects.get_or_create(name=name)
+            anno.tags.add(*AnnotationTags.objects.filter(name__in=tag_names))
 
         return anno
 
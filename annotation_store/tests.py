@@ -1,15 +1,32 @@
 import copy
+import datetime
 import json
 import logging
 import mock
 
+from django.contrib.auth.models import User
 from django.core.exceptions import PermissionDenied
-from django.http import HttpResponse
+from django.http import HttpResponse, Http404
 from django.test import TestCase
 from django.test.client import RequestFactory
+from django.utils import timezone
 import ims_lti_py.tool_provider
 
-from store import StoreBackend, AnnotationStore
+from benchmarks.catch_server import CatchServer
+from hx_lti_assignment.models import Assignment
+from hx_lti_initializer.models import LTICourse, LTIProfile
+from hx_lti_initializer.utils import student_panel_version
+from hx_lti_initializer.test_helper import QueryBudgetMixin
+from target_object_database.models import TargetObject
+from benchmarks import make_annotations
+from store import StoreBackend, CatchStoreBackend, AppStoreBackend, AnnotationStore
+from models import LTIGradePassback, AnnotationTransfer, DashboardSnapshot, AnnotationTags
+import store
+import transfer
+import views
+from request_log import RequestLogger, REDACTED
+import passback
+import snapshot
 
 logger = logging.getLogger(__name__)
 
@@ -128,6 +145,20 @@ class AnnotationStoreTest(TestCase):
         response = store.create()
         self.assertIsInstance(response, HttpResponse, 'Create should return an HttpResponse')
 
+    def test_writes_invalidate_dashboard_panels(self):
+        session = self.not_staff_session
+        data = object_params_from_session(session)
+        context_id, user_id = data['contextId'], data['user']['id']
+        request = create_request(method="post", session=session, data=data)
+        store = AnnotationStore(request, backend_instance=DummyStoreBackend(request))
+        version = student_panel_version(context_id, user_id)
+        store.create()
+        self.assertNotEqual(version, student_panel_version(context_id, user_id))
+
+        version = student_panel_version(context_id, 'someone-else')
+        store.delete(123)
+        self.assertNotEqual(version, student_panel_version(context_id, 'someone-else'))
+
     def test_permission_denied(self):
         def invalidator(key, corruptor='_INVALID_'):
             def invalidate(data):
@@ -256,3 +287,454 @@ class StoreBackendTest(TestCase):
                     self.assertEqual(0, len(result['permissions']['read']))
 
 
+class CatchStoreBackendTest(TestCase):
+    def setUp(self):
+        self.results = json.dumps({'total': 1, 'rows': [{'id': 1, 'text': 'hello'}]})
+        self.gzipped = 'gzipped bytes from the database'
+
+    def _upstream(self):
+        response = mock.Mock(status_code=200, headers={'content-encoding': 'gzip'}, content=self.results)
+        response.raw.read.return_value = self.gzipped
+        return response
+
+    def _search(self, accept_encoding):
+        request = create_request(method="get", session=TEST_SESSION_NOT_STAFF)
+        request.META['HTTP_ACCEPT_ENCODING'] = accept_encoding
+        with mock.patch('requests.get', return_value=self._upstream()):
+            return CatchStoreBackend(request).search()
+
+    def test_search_passes_content_encoding_through(self):
+        response = self._search('gzip, deflate')
+        self.assertEqual('gzip', response['Content-Encoding'])
+        self.assertEqual(self.gzipped, response.content)
+
+    def test_search_decodes_for_client_without_gzip(self):
+        response = self._search('identity')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(self.results, response.content)
+
+
+class CatchStandInTest(TestCase):
+    '''
+    Runs CatchStoreBackend against the stand-in CATCH database in benchmarks.catch_server.
+    '''
+    def setUp(self):
+        self.server = CatchServer().start()
+        self.database_url = store.ANNOTATION_DB_URL
+        store.ANNOTATION_DB_URL = self.server.url
+
+    def tearDown(self):
+        store.ANNOTATION_DB_URL = self.database_url
+        self.server.stop()
+
+    def _backend(self, method='get', **kwargs):
+        request = create_request(method=method, session=TEST_SESSION_NOT_STAFF, **kwargs)
+        request.META['HTTP_X_ANNOTATOR_AUTH_TOKEN'] = 'token'
+        return CatchStoreBackend(request)
+
+    def test_create_search_update_delete(self):
+        anno = object_params_from_session(TEST_SESSION_NOT_STAFF)
+        response = self._backend('post', data=anno).create()
+        self.assertEqual(200, response.status_code)
+        created = json.loads(response.content)
+
+        response = self._backend('post', data=dict(anno, text='updated')).update(created['id'])
+        self.assertEqual('updated', json.loads(response.content)['text'])
+
+        response = self._backend(params=search_params_from_session(TEST_SESSION_NOT_STAFF)).search()
+        results = json.loads(response.content)
+        self.assertEqual(1, results['total'])
+        self.assertEqual(created['id'], results['rows'][0]['id'])
+
+        self._backend('delete').delete(created['id'])
+        response = self._backend(params=search_params_from_session(TEST_SESSION_NOT_STAFF)).search()
+        self.assertEqual(0, json.loads(response.content)['total'])
+
+    def test_injected_failure_is_passed_through(self):
+        self.server.failure_rate = 1.0
+        response = self._backend(params=search_params_from_session(TEST_SESSION_NOT_STAFF)).search()
+        self.assertEqual(500, response.status_code)
+
+
+class AnnotationTransferTest(TestCase):
+    def setUp(self):
+        self.server = CatchServer().start()
+        self.user = User.objects.create(username='instructor')
+        old_admin = LTIProfile.objects.create(user=self.user, anon_id='old-admin', name='Prof')
+        new_admin = LTIProfile.objects.create(user=self.user, anon_id='new-admin', name='Prof')
+        self.old_course = LTICourse.create_course('old-course', old_admin)
+        self.new_course = LTICourse.create_course('new-course', new_admin)
+        self.old_assignment = Assignment.objects.create(
+            assignment_name='Old', pagination_limit=10, course=self.old_course,
+            annotation_database_url=self.server.url, annotation_database_apikey='key', annotation_database_secret_token='secret')
+        self.new_assignment = Assignment.objects.create(
+            assignment_name='New', pagination_limit=10, course=self.new_course,
+            annotation_database_url=self.server.url, annotation_database_apikey='key', annotation_database_secret_token='secret')
+        self.target = TargetObject.objects.create(target_title='Text', target_author='Author', target_content='Content', target_type='tx')
+
+        root = self._annotate('old-admin', 'Prof', 'root')
+        self._annotate('student', 'Student', 'reply', parent=str(root['id']))
+        self._annotate('student', 'Student', 'other')
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _annotate(self, user_id, user_name, text, parent='0', context_id='old-course'):
+        return self.server.db.create({
+            'contextId': context_id,
+            'collectionId': str(self.old_assignment.assignment_id),
+            'uri': str(self.target.pk),
+            'media': 'text',
+            'user': {'id': user_id, 'name': user_name},
+            'text': text,
+            'parent': parent,
+        })
+
+    def _enqueue(self, instructor_only=False):
+        return transfer.enqueue(
+            user_id='new-admin',
+            old_course_id='old-course',
+            new_course_id='new-course',
+            old_assignment_id=str(self.old_assignment.assignment_id),
+            new_assignment_id=str(self.new_assignment.assignment_id),
+            object_ids=[str(self.target.pk)],
+            instructor_only=instructor_only,
+        )
+
+    def _copied(self):
+        return self.server.db.search({'contextId': 'new-course', 'limit': -1})['rows']
+
+    def _run_again(self, annotation_transfer):
+        AnnotationTransfer.objects.filter(pk=annotation_transfer.pk).update(next_attempt_at=timezone.now())
+        return transfer.process_pending()
+
+    def test_transfer_copies_annotations(self):
+        annotation_transfer = self._enqueue()
+        self.assertEqual({'completed': 1, 'retried': 0, 'failed': 0}, transfer.process_pending())
+
+        copied = dict((ann['text'], ann) for ann in self._copied())
+        self.assertEqual(set(['root', 'reply', 'other']), set(copied))
+        self.assertEqual('new-admin', copied['root']['user']['id'])
+        self.assertEqual(unicode(copied['root']['id']), copied['reply']['parent'])
+        self.assertTrue(all(ann['collectionId'] == str(self.new_assignment.assignment_id) for ann in copied.values()))
+
+        status = transfer.status(AnnotationTransfer.objects.get(pk=annotation_transfer.pk))
+        self.assertEqual('completed', status['status'])
+        self.assertEqual((1, 1, 3, 3), (status['targets_total'], status['targets_done'], status['annotations_total'], status['annotations_done']))
+
+    def test_instructor_only(self):
+        self._enqueue(instructor_only=True)
+        transfer.process_pending()
+        self.assertEqual(['root'], [ann['text'] for ann in self._copied()])
+
+    def test_failed_transfer_resumes_without_duplicates(self):
+        real_create = transfer.TransferRunner.create
+        calls = []
+        def flaky_create(runner, ann):
+            calls.append(ann['text'])
+            if len(calls) == 2:
+                return (None, 'create failed with status 500', False)
+            return real_create(runner, ann)
+
+        annotation_transfer = self._enqueue()
+        with mock.patch.object(transfer, 'BATCH_SIZE', 1), mock.patch.object(transfer.TransferRunner, 'create', flaky_create):
+            self.assertEqual(1, transfer.process_pending()['retried'])
+            annotation_transfer = AnnotationTransfer.objects.get(pk=annotation_transfer.pk)
+            self.assertEqual(('pending', 1), (annotation_transfer.status, annotation_transfer.attempts))
+            self.assertEqual(1, len(self._copied()))
+            self.assertEqual(1, self._run_again(annotation_transfer)['completed'])
+        self.assertEqual(3, len(self._copied()))
+
+    def test_interrupted_create_is_not_duplicated(self):
+        real_create = transfer.TransferRunner.create
+        def timed_out_create(runner, ann):
+            real_create(runner, ann)
+            return (None, 'read timed out', True)
+
+        annotation_transfer = self._enqueue()
+        with mock.patch.object(transfer.TransferRunner, 'create', timed_out_create):
+            self.assertEqual(1, transfer.process_pending()['retried'])
+        self.assertEqual(2, len(self._copied())) # the reply waits for its parent
+        self.assertEqual(1, self._run_again(annotation_transfer)['completed'])
+        self.assertEqual(3, len(self._copied()))
+
+    def test_expired_claim_is_not_run_twice(self):
+        real_transfer_target = transfer.TransferRunner.transfer_target
+        taken_over = []
+        def slow_transfer_target(runner, target_object):
+            if not taken_over:
+                # another worker takes the transfer over once this one's claim has expired
+                later = timezone.now() + datetime.timedelta(seconds=transfer.CLAIM_TIMEOUT + 1)
+                taken_over.append(None)
+                taken_over[0] = transfer.process_pending(now=later)
+            return real_transfer_target(runner, target_object)
+
+        annotation_transfer = self._enqueue()
+        with mock.patch.object(transfer.TransferRunner, 'transfer_target', slow_transfer_target):
+            self.assertEqual({'completed': 0, 'retried': 0, 'failed': 0}, transfer.process_pending())
+        self.assertEqual([{'completed': 1, 'retried': 0, 'failed': 0}], taken_over)
+        self.assertEqual(3, len(self._copied()))
+        self.assertEqual('completed', AnnotationTransfer.objects.get(pk=annotation_transfer.pk).status)
+
+    def test_views(self):
+        request = RequestFactory().post('/', {
+            'old_course_id': 'old-course',
+            'new_course_id': 'new-course',
+            'old_assignment_id': str(self.old_assignment.assignment_id),
+            'new_assignment_id': str(self.new_assignment.assignment_id),
+            'object_ids[]': [str(self.target.pk)],
+        })
+        request.user = self.user
+        request.LTI = {'hx_user_id': 'new-admin', 'hx_context_id': 'new-course'}
+        response = views.transfer(request, instructor_only="0")
+        self.assertEqual(202, response.status_code)
+        data = json.loads(response.content)
+        self.assertEqual('pending', data['status'])
+
+        request = RequestFactory().get(data['status_url'])
+        request.user = self.user
+        request.LTI = {'hx_context_id': 'new-course'}
+        self.assertEqual('pending', json.loads(views.transfer_status(request, data['id']).content)['status'])
+        request.LTI = {'hx_context_id': 'old-course'}
+        self.assertRaises(Http404, views.transfer_status, request, data['id'])
+
+
+class GradePassbackQueueTest(TestCase):
+    def setUp(self):
+        self.session = dict(TEST_SESSION_NOT_STAFF)
+        self.request = create_request(method='post', session=self.session, data=object_params_from_session(self.session))
+        self.store = AnnotationStore(self.request, backend_instance=DummyStoreBackend(self.request))
+
+    def _outcome(self, success=True):
+        outcome = mock.Mock()
+        outcome.is_success.return_value = success
+        outcome.description = 'ok' if success else 'error'
+        return outcome
+
+    @mock.patch.object(ims_lti_py.tool_provider.DjangoToolProvider, 'post_replace_result')
+    def test_queue_does_not_post(self, mock_post_replace_result):
+        entry = self.store.queue_lti_grade_passback()
+        self.assertFalse(mock_post_replace_result.called)
+        self.assertEqual(LTIGradePassback.STATUS_PENDING, entry.status)
+        self.assertEqual(launch_params['lis_result_sourcedid'], json.loads(entry.outcome_params)['lis_result_sourcedid'])
+
+    def test_queue_not_triggered_for_staff(self):
+        request = create_request(method='post', session=dict(TEST_SESSION_IS_STAFF), data={})
+        store = AnnotationStore(request, backend_instance=DummyStoreBackend(request))
+        self.assertIsNone(store.queue_lti_grade_passback())
+        self.assertEqual(0, LTIGradePassback.objects.count())
+
+    @mock.patch.object(ims_lti_py.tool_provider.DjangoToolProvider, 'post_replace_result')
+    def test_repeated_submissions_collapse(self, mock_post_replace_result):
+        mock_post_replace_result.return_value = self._outcome()
+        for i in range(5):
+            self.store.queue_lti_grade_passback()
+        self.assertEqual(1, LTIGradePassback.objects.count())
+
+        counts = passback.process_pending()
+        self.assertEqual(1, counts['sent'])
+        self.assertEqual(1, mock_post_replace_result.call_count)
+
+        # the LMS already has this score, so nothing new is queued
+        self.assertIsNone(self.store.queue_lti_grade_passback())
+        self.assertEqual(0, passback.process_pending()['sent'])
+        self.assertEqual(1, mock_post_replace_result.call_count)
+
+    @mock.patch.object(ims_lti_py.tool_provider.DjangoToolProvider, 'post_replace_result')
+    def test_failure_retries_with_backoff(self, mock_post_replace_result):
+        mock_post_replace_result.return_value = self._outcome(success=False)
+        self.store.queue_lti_grade_passback()
+
+        counts = passback.process_pending()
+        self.assertEqual(1, counts['retried'])
+        entry = LTIGradePassback.objects.get()
+        self.assertEqual(1, entry.attempts)
+        self.assertEqual(LTIGradePassback.STATUS_PENDING, entry.status)
+        self.assertTrue(entry.next_attempt_at > entry.enqueued_at)
+
+        # not due yet
+        self.assertEqual(0, sum(passback.process_pending().values()))
+
+        mock_post_replace_result.return_value = self._outcome()
+        counts = passback.process_pending(now=entry.next_attempt_at)
+        self.assertEqual(1, counts['sent'])
+        self.assertEqual(LTIGradePassback.STATUS_SENT, LTIGradePassback.objects.get().status)
+
+    @mock.patch.object(ims_lti_py.tool_provider.DjangoToolProvider, 'post_replace_result')
+    def test_resubmission_keeps_backoff(self, mock_post_replace_result):
+        mock_post_replace_result.return_value = self._outcome(success=False)
+        self.store.queue_lti_grade_passback()
+        passback.process_pending()
+        entry = LTIGradePassback.objects.get()
+
+        self.store.queue_lti_grade_passback()
+        requeued = LTIGradePassback.objects.get()
+        self.assertEqual((1, entry.next_attempt_at, 'error'), (requeued.attempts, requeued.next_attempt_at, requeued.last_error))
+        self.assertEqual(0, sum(passback.process_pending().values()))
+        self.assertEqual(1, mock_post_replace_result.call_count)
+
+    def test_backoff(self):
+        self.assertEqual(passback.BACKOFF_BASE, passback.backoff(1))
+        self.assertEqual(passback.BACKOFF_BASE * 2, passback.backoff(2))
+        self.assertEqual(passback.BACKOFF_MAX, passback.backoff(100))
+
+    def test_queue_stats(self):
+        self.store.queue_lti_grade_passback()
+        stats = passback.queue_stats()
+        self.assertEqual(1, stats['pending'])
+        self.assertEqual(1, stats['due'])
+        self.assertEqual(0, stats['failed'])
+
+
+class RequestLoggerTest(TestCase):
+    def setUp(self):
+        self.request = RequestFactory().post('/foo', data='{"text": "secret annotation"}', content_type='application/json')
+        self.logger = mock.Mock()
+        self.logger.isEnabledFor.return_value = True
+        self.headers = {'x-annotator-auth-token': 'token', 'content-type': 'application/json'}
+
+    def _logged_fields(self):
+        self.assertTrue(self.logger.info.called)
+        return self.logger.info.call_args[0][3].fields
+
+    def test_structured_logs_body_size_and_redacts_headers(self):
+        request_log = RequestLogger(self.logger, self.request, {})
+        request_log.info('create', 'request', headers=dict(self.headers), body=self.request.body)
+        fields = self._logged_fields()
+        self.assertEqual(len(self.request.body), fields['body_bytes'])
+        self.assertNotIn('body', fields)
+        self.assertEqual(REDACTED, fields['headers']['x-annotator-auth-token'])
+        self.assertEqual('application/json', fields['headers']['content-type'])
+
+    def test_verbose_logs_body(self):
+        request_log = RequestLogger(self.logger, self.request, {'mode': 'verbose', 'sample_rates': {'create': 0}})
+        request_log.info('create', 'request', headers=dict(self.headers), body=self.request.body)
+        fields = self._logged_fields()
+        self.assertEqual(self.request.body, fields['body'])
+        self.assertEqual(REDACTED, fields['headers']['x-annotator-auth-token'])
+
+    def test_sample_rate(self):
+        config = {'sample_rates': {'search': 0.0}}
+        RequestLogger(self.logger, self.request, config).info('search', 'request')
+        self.assertFalse(self.logger.info.called)
+        RequestLogger(self.logger, self.request, config).info('create', 'request')
+        self.assertTrue(self.logger.info.called)
+
+    def test_sampling_decision_is_shared_by_request(self):
+        config = {'sample_rates': {'search': 0.5}}
+        with mock.patch('random.random', return_value=0.9):
+            RequestLogger(self.logger, self.request, config).info('search', 'received')
+        with mock.patch('random.random', return_value=0.1):
+            RequestLogger(self.logger, self.request, config).info('search', 'request')
+        self.assertFalse(self.logger.info.called)
+
+    def test_not_formatted_when_disabled(self):
+        self.logger.isEnabledFor.return_value = False
+        RequestLogger(self.logger, self.request, {}).info('create', 'request', body=self.request.body)
+        self.assertFalse(self.logger.info.called)
+
+
+class DashboardSnapshotTest(TestCase):
+    context_id = 'course-v1:HarvardX+HDS3221.2x+2016'
+
+    def setUp(self):
+        self.server = CatchServer(rows=make_annotations(students=5, per_student=10, seed=1)).start()
+        credentials = [{'annotation_database_url': self.server.url, 'annotation_database_apikey': 'key', 'annotation_database_secret_token': 'secret'}]
+        patcher = mock.patch('hx_lti_initializer.utils.get_annotation_db_credentials_by_course', return_value=credentials)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        AnnotationStore.update_settings({})
+        self.server.stop()
+
+    def _users(self):
+        summaries = DashboardSnapshot.objects.get(context_id=self.context_id).user_summaries.all()
+        return dict((s.user_id, (s.total_annotations, s.latest_activity)) for s in summaries)
+
+    def test_catch_refresh_is_incremental(self):
+        self.assertEqual(snapshot.REBUILT, snapshot.refresh(self.context_id))
+        users = self._users()
+        self.assertEqual(dict(('student%04d' % n, 10) for n in range(5)), dict((k, v[0]) for k, v in users.items()))
+
+        self.server.db.create(dict(self.server.db.read(1), user={'id': 'newcomer', 'name': 'Newcomer'}))
+        self.server.db.update(3, {'text': 'edited'})
+        with mock.patch.object(snapshot, 'PAGE_SIZE', 10), \
+                mock.patch.object(snapshot, '_fetch_annotations_by_course', wraps=snapshot._fetch_annotations_by_course) as fetch:
+            self.assertEqual(snapshot.UPDATED, snapshot.refresh(self.context_id))
+        self.assertEqual(2, fetch.call_count) # the second page has nothing new, so paging stops there
+
+        users = self._users()
+        self.assertEqual(1, users['newcomer'][0])
+        self.assertEqual(10, users['student0002'][0])
+        self.assertGreater(users['student0002'][1], users['student0001'][1])
+        self.assertEqual(51, DashboardSnapshot.objects.get(context_id=self.context_id).total_annotations)
+
+        self.server.db.delete(4)
+        self.assertEqual(snapshot.REBUILT, snapshot.refresh(self.context_id, full=True))
+        self.assertEqual(9, self._users()['student0003'][0])
+
+    def test_deleted_rows_are_subtracted_once(self):
+        # marked deleted before the snapshot is built, and edited since
+        self.server.db.update(1, {'deleted': True})
+        self.assertEqual(snapshot.REBUILT, snapshot.refresh(self.context_id))
+        self.server.db.update(1, {'text': 'edited while deleted'})
+        self.assertEqual(snapshot.UPDATED, snapshot.refresh(self.context_id))
+        self.assertEqual(49, DashboardSnapshot.objects.get(context_id=self.context_id).total_annotations)
+
+        # a counted row is deleted, and is seen again by the refreshes after that
+        student = self.server.db.read(2)['user']['id']
+        before = self._users()[student][0]
+        self.server.db.update(2, {'deleted': True})
+        for i in range(3):
+            self.assertEqual(snapshot.UPDATED, snapshot.refresh(self.context_id))
+        self.assertEqual(48, DashboardSnapshot.objects.get(context_id=self.context_id).total_annotations)
+        self.assertEqual(before - 1, self._users()[student][0])
+
+    def test_concurrent_refresh_is_skipped(self):
+        snapshot.refresh(self.context_id)
+        DashboardSnapshot.objects.update(refreshing_since=timezone.now())
+        self.assertEqual(snapshot.BUSY, snapshot.refresh(self.context_id))
+
+    def test_app_backend_updates_snapshot_on_write(self):
+        AnnotationStore.update_settings({'backend': 'app'})
+        session = dict(TEST_SESSION_IS_STAFF, hx_context_id=self.context_id)
+        self.assertEqual(snapshot.REBUILT, snapshot.refresh(self.context_id))
+
+        anno = dict(object_params_from_session(session), user={'id': 'student', 'name': 'Student'})
+        request = create_request(method='post', session=session, data=anno)
+        created = json.loads(AppStoreBackend(request).create().content)
+        self.assertEqual({'student': 1}, dict((k, v[0]) for k, v in self._users().items()))
+
+        AppStoreBackend(create_request(method='delete', session=session)).delete(created['id'])
+        self.assertEqual({'student': 0}, dict((k, v[0]) for k, v in self._users().items()))
+        self.assertEqual(0, DashboardSnapshot.objects.get(context_id=self.context_id).total_annotations)
+
+
+class AppStoreQueryBudgetTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        AnnotationStore.update_settings({'backend': 'app'})
+        self.session = dict(TEST_SESSION_IS_STAFF)
+        self.tags = 0
+
+    def tearDown(self):
+        AnnotationStore.update_settings({})
+
+    def _grow(self, n):
+        AnnotationTags.objects.bulk_create([AnnotationTags(name='tag%04d' % i) for i in range(self.tags, n)])
+        self.tags = n
+
+    def _body(self):
+        # up to 50 of the existing tags and 50 new ones
+        tags = ['tag%04d' % i for i in range(0, self.tags, max(1, self.tags // 50))]
+        tags.extend('new%04d-%d' % (self.tags, i) for i in range(len(tags)))
+        return dict(object_params_from_session(self.session), user={'id': 'student', 'name': 'Student'}, tags=tags)
+
+    def test_create_and_update(self):
+        def create_and_update():
+            body = self._body()
+            created = json.loads(AppStoreBackend(create_request(method='post', session=self.session, data=body)).create().content)
+            body['tags'] = body['tags'][::2] + ['renamed-' + name for name in body['tags'][1::2]]
+            AppStoreBackend(create_request(method='put', session=self.session, data=body)).update(created['id'])
+            self.assertEqual(sorted(body['tags']), sorted(t.name for t in store.Annotation.objects.get(pk=created['id']).tags.all()))
+        self.assertQueryBudget(create_and_update, self._grow)
@@ -0,0 +1,374 @@
+'''
+Background annotation transfers between courses.
+
+The transfer view only queues an AnnotationTransfer. The process_annotation_transfers
+management command runs it. For each target object, the annotations are fetched from the old
+course with a single search. They are then created in the new course in batches of
+`batch_size`, with `parallelism` create requests in flight at once. Top-level annotations are
+created before replies, so that replies can point at the copied parent.
+
+Every created annotation is checkpointed. A transfer that fails is retried with exponential
+backoff and picks up where it stopped. A transfer whose worker died is taken over by another
+worker once its claim expires.
+'''
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from multiprocessing.pool import ThreadPool
+
+from hx_lti_assignment.models import Assignment
+from hx_lti_initializer.models import LTICourse
+from hx_lti_initializer.utils import retrieve_token
+from target_object_database.models import TargetObject
+from target_object_database import iiif
+from models import AnnotationTransfer, AnnotationTransferItem
+
+import datetime
+import json
+import logging
+import requests
+import urllib
+
+logger = logging.getLogger(__name__)
+
+TRANSFER_SETTINGS = getattr(settings, 'ANNOTATION_TRANSFER', {})
+PARALLELISM = TRANSFER_SETTINGS.get('parallelism', 4)            # create requests in flight per transfer
+BATCH_SIZE = TRANSFER_SETTINGS.get('batch_size', 50)             # annotations checkpointed together
+SEARCH_TIMEOUT = TRANSFER_SETTINGS.get('search_timeout', 60)     # seconds
+REQUEST_TIMEOUT = TRANSFER_SETTINGS.get('request_timeout', 10)   # seconds, for creates
+MAX_ATTEMPTS = TRANSFER_SETTINGS.get('max_attempts', 5)
+BACKOFF_BASE = TRANSFER_SETTINGS.get('backoff_base', 60)         # seconds
+BACKOFF_MAX = TRANSFER_SETTINGS.get('backoff_max', 60 * 60)      # seconds
+CLAIM_TIMEOUT = TRANSFER_SETTINGS.get('claim_timeout', 300)      # seconds without progress before the claim expires
+
+TARGET_TYPES = {
+    "ig": "image",
+    "tx": "text",
+    "vd": "video",
+}
+
+
+class TransferError(Exception):
+    pass
+
+
+class LostClaim(Exception):
+    '''Raised when the transfer was requeued or taken over by another worker.'''
+    pass
+
+
+def backoff(attempts):
+    '''Returns the number of seconds to wait before the next attempt.'''
+    return min(BACKOFF_MAX, BACKOFF_BASE * (2 ** max(attempts - 1, 0)))
+
+
+@transaction.atomic
+def enqueue(user_id, old_course_id, new_course_id, old_assignment_id, new_assignment_id, object_ids, instructor_only=True):
+    '''
+    Queues a transfer, or requeues the existing transfer between the same assignments so
+    that it resumes from its checkpoints.
+    '''
+    now = timezone.now()
+    transfer, created = AnnotationTransfer.objects.select_for_update().get_or_create(
+        old_assignment_id=old_assignment_id,
+        new_assignment_id=new_assignment_id,
+        instructor_only=instructor_only,
+        defaults={'user_id': user_id, 'old_course_id': old_course_id, 'new_course_id': new_course_id},
+    )
+    transfer.user_id = user_id
+    transfer.old_course_id = old_course_id
+    transfer.new_course_id = new_course_id
+    transfer.object_ids = json.dumps([str(pk) for pk in object_ids])
+    transfer.status = AnnotationTransfer.STATUS_PENDING
+    transfer.attempts = 0
+    transfer.last_error = ''
+    transfer.targets_total = len(object_ids)
+    transfer.targets_done = 0
+    transfer.enqueued_at = now
+    transfer.next_attempt_at = now
+    transfer.finished_at = None
+    transfer.version += 1
+    transfer.save()
+    logger.info("Annotation transfer queued: id=%s old_assignment_id=%s new_assignment_id=%s targets=%s resumed=%s",
+                transfer.pk, old_assignment_id, new_assignment_id, len(object_ids), not created)
+    return transfer
+
+
+def process_pending(batch_size=10, now=None):
+    '''
+    Runs transfers that are due, including running transfers whose claim has expired.
+    Returns a dict with the number of transfers completed, retried and failed.
+    '''
+    now = timezone.now() if now is None else now
+    counts = {'completed': 0, 'retried': 0, 'failed': 0}
+    due = AnnotationTransfer.objects.filter(
+        status__in=(AnnotationTransfer.STATUS_PENDING, AnnotationTransfer.STATUS_RUNNING),
+        next_attempt_at__lte=now,
+    ).order_by('next_attempt_at')[:batch_size]
+
+    for transfer in list(due):
+        current = AnnotationTransfer.objects.filter(pk=transfer.pk, version=transfer.version, next_attempt_at=transfer.next_attempt_at)
+        # the new version is this worker's claim: a worker that takes over once the claim has
+        # expired bumps it again, and this one's next checkpoint raises LostClaim
+        claimed = current.update(
+            status=AnnotationTransfer.STATUS_RUNNING,
+            started_at=now,
+            next_attempt_at=now + datetime.timedelta(seconds=CLAIM_TIMEOUT),
+            version=F('version') + 1,
+        )
+        if claimed == 0:
+            continue  # claimed by another worker or requeued
+        transfer.version += 1
+        result = run(transfer)
+        if result in counts:
+            counts[result] += 1
+    return counts
+
+
+def run(transfer):
+    '''
+    Runs a claimed transfer and records the outcome. Returns "completed", "retried",
+    "failed", or None if the claim was lost.
+    '''
+    current = AnnotationTransfer.objects.filter(pk=transfer.pk, version=transfer.version)
+    try:
+        TransferRunner(transfer).run()
+    except LostClaim:
+        logger.info("Annotation transfer %s was requeued while running, stopping", transfer.pk)
+        return None
+    except Exception as e:
+        attempts = transfer.attempts + 1
+        description = str(e)
+        if attempts >= MAX_ATTEMPTS:
+            current.update(status=AnnotationTransfer.STATUS_FAILED, attempts=attempts, last_error=description,
+                           next_attempt_at=None, finished_at=timezone.now())
+            logger.error("Annotation transfer %s failed permanently after %s attempts: %s", transfer.pk, attempts, description)
+            return 'failed'
+        delay = backoff(attempts)
+        current.update(status=AnnotationTransfer.STATUS_PENDING, attempts=attempts, last_error=description,
+                       next_attempt_at=timezone.now() + datetime.timedelta(seconds=delay))
+        logger.warning("Annotation transfer %s failed, resuming in %ss: %s", transfer.pk, delay, description)
+        return 'retried'
+    logger.info("Annotation transfer %s completed", transfer.pk)
+    return 'completed'
+
+
+def status(transfer):
+    '''
+    Returns the progress of the transfer as a dict for the status endpoint.
+    '''
+    def isoformat(dt):
+        return dt.isoformat() if dt else None
+
+    return {
+        'id': transfer.pk,
+        'status': transfer.status,
+        'attempts': transfer.attempts,
+        'last_error': transfer.last_error,
+        'targets_total': transfer.targets_total,
+        'targets_done': transfer.targets_done,
+        'annotations_total': transfer.annotations_total,
+        'annotations_done': transfer.annotations_done,
+        'enqueued_at': isoformat(transfer.enqueued_at),
+        'started_at': isoformat(transfer.started_at),
+        'finished_at': isoformat(transfer.finished_at),
+    }
+
+
+class TransferRunner(object):
+    '''
+    Copies the annotations for one claimed transfer. `done` maps the id of every checkpointed
+    source annotation to its id in the new course, or to '' if its creation is in doubt.
+    '''
+    def __init__(self, transfer):
+        self.transfer = transfer
+        self.current = AnnotationTransfer.objects.filter(pk=transfer.pk, version=transfer.version)
+        self.done = dict(transfer.items.values_list('source_id', 'created_id'))
+        self.annotations_total = 0
+
+        assignment = Assignment.objects.get(assignment_id=transfer.old_assignment_id)
+        database_url = str(assignment.annotation_database_url).strip()
+        self.search_url = database_url + '/search'
+        self.create_url = database_url + '/create'
+
+        self.old_admins = [admin.anon_id for admin in LTICourse.objects.get(course_id=transfer.old_course_id).course_admins.all()]
+        self.new_admins = dict((admin.name, admin.anon_id) for admin in LTICourse.objects.get(course_id=transfer.new_course_id).course_admins.all())
+
+        token = retrieve_token(transfer.user_id, assignment.annotation_database_apikey, assignment.annotation_database_secret_token)
+        self.session = requests.Session()
+        self.session.headers.update({
+            'x-annotator-auth-token': token,
+            'content-type': 'application/json',
+        })
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=PARALLELISM)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @property
+    def annotations_done(self):
+        return sum(1 for created_id in self.done.itervalues() if created_id)
+
+    def checkpoint(self, **fields):
+        '''
+        Saves progress and extends the claim. Raises LostClaim if the transfer was requeued
+        or claimed by another worker.
+        '''
+        fields.setdefault('next_attempt_at', timezone.now() + datetime.timedelta(seconds=CLAIM_TIMEOUT))
+        if self.current.update(**fields) == 0:
+            raise LostClaim()
+
+    def run(self):
+        object_ids = json.loads(self.transfer.object_ids)
+        targets = TargetObject.objects.in_bulk([int(pk) for pk in object_ids])
+        self.checkpoint(targets_total=len(object_ids), targets_done=0, annotations_total=0, annotations_done=self.annotations_done)
+
+        self.pool = ThreadPool(PARALLELISM)
+        try:
+            for n, pk in enumerate(object_ids):
+                if int(pk) in targets:
+                    self.annotations_total += self.transfer_target(targets[int(pk)])
+                else:
+                    logger.warning("Annotation transfer %s: target object %s does not exist, skipping", self.transfer.pk, pk)
+                self.checkpoint(targets_done=n + 1, annotations_total=self.annotations_total, annotations_done=self.annotations_done)
+        finally:
+            self.pool.close()
+            self.pool.join()
+            self.session.close()
+
+        self.checkpoint(status=AnnotationTransfer.STATUS_COMPLETED, finished_at=timezone.now(), next_attempt_at=None, last_error='')
+
+    def transfer_target(self, target_object):
+        '''
+        Copies the annotations on one target object. Returns the number of source annotations.
+        '''
+        media = TARGET_TYPES[target_object.target_type]
+        uri = self.resolve_uri(target_object, media)
+        params = {
+            'uri': uri,
+            'contextId': self.transfer.old_course_id,
+            'collectionId': self.transfer.old_assignment_id,
+            'media': media,
+            'limit': -1,
+        }
+        if self.transfer.instructor_only:
+            params['userid'] = self.old_admins
+        rows = self.search(params)
+
+        in_doubt = [row for row in rows if self.done.get(str(row['id'])) == '']
+        if in_doubt:
+            self.resolve_in_doubt(target_object, uri, media, in_doubt)
+
+        roots = [row for row in rows if not self.is_reply(row)]
+        replies = [row for row in rows if self.is_reply(row)]
+        for group in (roots, replies):
+            pending = [row for row in group if not self.done.get(str(row['id']))]
+            for i in range(0, len(pending), BATCH_SIZE):
+                self.create_batch(target_object, pending[i:i + BATCH_SIZE])
+        return len(rows)
+
+    def resolve_uri(self, target_object, media):
+        if media != "image":
+            return str(target_object.pk)
+        return iiif.first_canvas_id(target_object.target_content)
+
+    def search(self, params):
+        response = self.session.get(self.search_url, params=urllib.urlencode(params, True), timeout=SEARCH_TIMEOUT)
+        if response.status_code != 200:
+            raise TransferError("search failed with status %s" % response.status_code)
+        return response.json()['rows']
+
+    def is_reply(self, row):
+        return unicode(row.get('parent') or '0') != u'0'
+
+    def copy_annotation(self, row):
+        ann = dict(row)
+        ann['user'] = dict(row['user'])
+        ann['contextId'] = unicode(self.transfer.new_course_id)
+        ann['collectionId'] = unicode(self.transfer.new_assignment_id)
+        ann['id'] = None
+        if self.is_reply(row) and self.done.get(unicode(row['parent'])):
+            ann['parent'] = self.done[unicode(row['parent'])]
+        if ann['user']['id'] in self.old_admins:
+            ann['user']['id'] = self.new_admins.get(ann['user'].get('name')) or self.transfer.user_id
+        return ann
+
+    def fingerprint(self, ann):
+        '''Identifies a copied annotation in the new course, for resolving checkpoints in doubt.'''
+        fields = [ann.get(key) for key in ('text', 'quote', 'ranges', 'tags')]
+        return json.dumps(fields + [unicode(ann.get('parent') or '0'), ann['user']['id']], sort_keys=True)
+
+    def resolve_in_doubt(self, target_object, uri, media, rows):
+        '''
+        Looks up annotations whose creation was interrupted in the new course. Those that were
+        created are checkpointed; the others are cleared so they are created again.
+        '''
+        existing = self.search({
+            'uri': uri,
+            'contextId': self.transfer.new_course_id,
+            'collectionId': self.transfer.new_assignment_id,
+            'media': media,
+            'limit': -1,
+        })
+        created_ids = {}
+        for ann in existing:
+            created_ids.setdefault(self.fingerprint(ann), []).append(unicode(ann['id']))
+
+        items = AnnotationTransferItem.objects.filter(transfer=self.transfer)
+        with transaction.atomic():
+            for row in rows:
+                source_id = str(row['id'])
+                matches = created_ids.get(self.fingerprint(self.copy_annotation(row)))
+                if matches:
+                    self.done[source_id] = matches.pop(0)
+                    items.filter(source_id=source_id).update(created_id=self.done[source_id])
+                else:
+                    del self.done[source_id]
+                    items.filter(source_id=source_id).delete()
+        logger.info("Annotation transfer %s: resolved %s interrupted creates on target object %s",
+                    self.transfer.pk, len(rows), target_object.pk)
+
+    def create(self, ann):
+        '''
+        Creates the annotation in the new course. Returns (created_id, error, in_doubt), where
+        in_doubt means the request may have reached the database.
+        '''
+        try:
+            response = self.session.post(self.create_url, data=json.dumps(ann), timeout=REQUEST_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            return (None, str(e), True)
+        if response.status_code != 200:
+            return (None, "create failed with status %s" % response.status_code, False)
+        try:
+            return (unicode(response.json()['id']), None, False)
+        except (ValueError, KeyError) as e:
+            return (None, "invalid create response: %s" % e, True)
+
+    def create_batch(self, target_object, rows):
+        self.checkpoint()  # don't create anything if another worker has taken over
+        sources = [str(row['id']) for row in rows]
+        AnnotationTransferItem.objects.bulk_create([
+            AnnotationTransferItem(transfer=self.transfer, target_object_id=str(target_object.pk), source_id=source_id)
+            for source_id in sources if source_id not in self.done
+        ])
+        for source_id in sources:
+            self.done[source_id] = ''
+
+        results = self.pool.map(self.create, [self.copy_annotation(row) for row in rows])
+
+        errors = []
+        items = AnnotationTransferItem.objects.filter(transfer=self.transfer)
+        with transaction.atomic():
+            for source_id, (created_id, error, in_doubt) in zip(sources, results):
+                if created_id:
+                    self.done[source_id] = created_id
+                    items.filter(source_id=source_id).update(created_id=created_id)
+                    continue
+                errors.append(error)
+                if not in_doubt:
+                    del self.done[source_id]
+                    items.filter(source_id=source_id).delete()
+        self.checkpoint(annotations_done=self.annotations_done)
+        if errors:
+            raise TransferError("%s of %s annotations could not be created on target object %s: %s" % (
+                len(errors), len(rows), target_object.pk, errors[0]))
@@ -1,19 +1,18 @@
 from django.conf import settings
+from django.core.urlresolvers import reverse
 from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required
 
-from target_object_database.models import TargetObject
-from hx_lti_initializer.models import LTICourse 
-from hx_lti_assignment.models import Assignment
-from hx_lti_initializer.utils import retrieve_token
 from hx_lti_initializer import annotation_database
+from annotationsx.compression import gzip_response
+from models import AnnotationTransfer
 from store import AnnotationStore
+import transfer as transfer_queue
 
 import json
-import requests
-import urllib
 import logging
 
 logger = logging.getLogger(__name__)
@@ -23,6 +22,7 @@ def api_root(request):
     return AnnotationStore.from_settings(request).root()
 
 @require_http_methods(["GET"])
+@gzip_response
 def search(request):
     return AnnotationStore.from_settings(request).search()
 
@@ -32,7 +32,10 @@ def create(request):
     store = AnnotationStore.from_settings(request)
     response = store.create()
     if response.status_code == 200:
-        store.lti_grade_passback()
+        if AnnotationStore.SETTINGS.get('grade_passback', 'queue') == 'queue':
+            store.queue_lti_grade_passback()
+        else:
+            store.lti_grade_passback()
     return response
 
 # NOTE: annotator updates text annotations using the "PUT" method, while
@@ -49,77 +52,28 @@ def delete(request, annotation_id):
     return AnnotationStore.from_settings(request).delete(annotation_id)
 
 @login_required
+@require_http_methods(["POST"])
 def transfer(request, instructor_only="1"):
-    user_id = request.LTI['hx_user_id']
-
-    old_assignment_id = request.POST.get('old_assignment_id')
-    new_assignment_id = request.POST.get('new_assignment_id')
-    old_course_id = request.POST.get('old_course_id')
-    new_course_id = request.POST.get('new_course_id')
-    old_course = LTICourse.objects.get(course_id=old_course_id)
-    new_course = LTICourse.objects.get(course_id=new_course_id)
-    old_admins = []
-    new_admins = dict()
-    for ads in old_course.course_admins.all():
-        old_admins.append(ads.anon_id)
-    for ads in new_course.course_admins.all():
-        new_admins[ads.name] = ads.anon_id
-
-    assignment = Assignment.objects.get(assignment_id=old_assignment_id)
-    object_ids = request.POST.getlist('object_ids[]')
-    token = retrieve_token(
-            user_id,
-            assignment.annotation_database_apikey,
-            assignment.annotation_database_secret_token
+    '''
+    Queues a copy of the assignment's annotations to another course. The copy is made in the
+    background by the process_annotation_transfers command; poll the returned status_url for
+    progress. Posting the same transfer again resumes it rather than copying annotations twice.
+    '''
+    annotation_transfer = transfer_queue.enqueue(
+        user_id=request.LTI['hx_user_id'],
+        old_course_id=request.POST.get('old_course_id'),
+        new_course_id=request.POST.get('new_course_id'),
+        old_assignment_id=request.POST.get('old_assignment_id'),
+        new_assignment_id=request.POST.get('new_assignment_id'),
+        object_ids=request.POST.getlist('object_ids[]'),
+        instructor_only=(str(instructor_only) == "1"),
     )
+    data = transfer_queue.status(annotation_transfer)
+    data['status_url'] = reverse('annotation_store:api_transfer_status', kwargs={'transfer_id': annotation_transfer.pk})
+    return HttpResponse(json.dumps(data), status=202, content_type='application/json')
 
-    types = {
-        "ig": "image",
-        "tx": "text",
-        "vd": "video"
-    }
-    responses = []
-    for pk in object_ids:
-        obj = TargetObject.objects.get(pk=pk)
-        uri = pk
-        target_type = types[obj.target_type]
-        if target_type == "image":
-            result = requests.get(obj.target_content)
-            uri = json.loads(result.text)["sequences"][0]["canvases"][0]["@id"]
-        search_database_url = str(assignment.annotation_database_url).strip() + '/search?'
-        create_database_url = str(assignment.annotation_database_url).strip() + '/create'
-        headers = {
-            'x-annotator-auth-token': token,
-            'content-type': 'application/json',
-        }
-
-        params = {
-            'uri': uri,
-            'contextId': old_course_id,
-            'collectionId': old_assignment_id,
-            'media': target_type,
-            'limit': -1,
-        }
-
-        if str(instructor_only) == "1":
-            params.update({'userid': old_admins})
-        url_values = urllib.urlencode(params, True)
-        response = requests.get(search_database_url, headers=headers, params=url_values)
-        if response.status_code == 200:
-            annotations = json.loads(response.text)
-            for ann in annotations['rows']:
-                ann['contextId'] = unicode(new_course_id)
-                ann['collectionId'] = unicode(new_assignment_id)
-                ann['id'] = None
-                logger.info("annotation user_id: %s" % ann['user']['id'])
-                if ann['user']['id'] in old_admins:
-                    try:
-                        if new_admins[ann['user']['name']]:
-                            ann['user']['id'] = new_admins[ann['user']['name']]
-                    except:
-                        ann['user']['id'] = user_id
-                response2 = requests.post(create_database_url, headers=headers, data=json.dumps(ann))
-
-    #logger.debug("%s" % str(request.POST.getlist('assignment_inst[]')))
-    data = dict()
-    return HttpResponse(json.dumps(data), content_type='application/json')
+@login_required
+@require_http_methods(["GET"])
+def transfer_status(request, transfer_id):
+    annotation_transfer = get_object_or_404(AnnotationTransfer, pk=transfer_id, new_course_id=request.LTI['hx_context_id'])
+    return HttpResponse(json.dumps(transfer_queue.status(annotation_transfer)), content_type='application/json')
@@ -0,0 +1,83 @@
+"""
+compression.py
+
+Gzip compression for individual views. This works like django's GZipMiddleware, but it is
+applied only to the views that return large, repetitive payloads (annotation searches and
+the instructor dashboard fragments), and responses smaller than GZIP_MIN_LENGTH bytes are
+sent as-is since compressing them costs more CPU than it saves on the wire.
+
+Usage:
+
+    @gzip_response
+    def search(request):
+        ...
+
+Responses that already have a Content-Encoding (e.g. a gzipped search result passed
+through from the CATCH database) are left alone. Streaming responses are compressed
+chunk by chunk, and they are never held back by the size threshold since their length
+isn't known up front.
+"""
+from functools import wraps
+import re
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence, compress_string
+
+re_accepts_gzip = re.compile(r'\bgzip\b')
+
+
+def accepts_encoding(request, encoding):
+    '''
+    Returns True if the request's Accept-Encoding header allows the given content encoding.
+    '''
+    accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    return re.search(r'\b%s\b' % re.escape(encoding), accept_encoding) is not None
+
+
+def compress_response(request, response, min_length=None):
+    '''
+    Gzips the response in place if the client accepts it, and returns the response.
+    '''
+    if min_length is None:
+        min_length = getattr(settings, 'GZIP_MIN_LENGTH', 1024)
+
+    # The response may be compressed for some clients and not others, so caches must
+    # key on Accept-Encoding. This applies to passed-through encodings as well, whatever
+    # their size.
+    if response.has_header('Content-Encoding'):
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+    if not response.streaming and len(response.content) < min_length:
+        return response
+    patch_vary_headers(response, ('Accept-Encoding',))
+
+    if not re_accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+        return response
+
+    if response.streaming:
+        response.streaming_content = compress_sequence(response.streaming_content)
+        del response['Content-Length']
+    else:
+        compressed_content = compress_string(response.content)
+        if len(compressed_content) >= len(response.content):
+            return response
+        response.content = compressed_content
+        response['Content-Length'] = str(len(response.content))
+
+    if response.has_header('ETag'):
+        response['ETag'] = re.sub('"$', ';gzip"', response['ETag'])
+    response['Content-Encoding'] = 'gzip'
+    return response
+
+
+def gzip_response(view_func):
+    '''
+    View decorator that compresses the view's response with compress_response().
+    '''
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        response = view_func(request, *args, **kwargs)
+        return compress_response(request, response)
+    return _wrapped_view
@@ -0,0 +1,197 @@
+"""
+loghandlers.py
+
+Asynchronous logging handlers. Python 2.7 doesn't ship logging.handlers.QueueHandler, so
+this provides a small equivalent: the handler formats the message on the calling thread
+and puts the record on a bounded queue, and a background listener thread passes records to
+the wrapped handler (e.g. a WatchedFileHandler) so that slow disk or NFS writes don't block
+request threads.
+
+Example LOGGING handler config:
+
+    'default': {
+        'class': 'annotationsx.loghandlers.QueueHandler',
+        'level': 'INFO',
+        'formatter': 'verbose',
+        'handler_class': 'logging.handlers.WatchedFileHandler',
+        'handler_kwargs': {'filename': '/var/log/app.log'},
+        'maxsize': 10000,
+        'drop_policy': 'drop_new',
+    }
+
+When the queue is full, records are dropped according to the drop policy:
+    - drop_new: discard the record being logged (default)
+    - drop_oldest: discard the oldest queued record to make room
+    - block: wait for room, which gives up the latency guarantee but never loses records
+The number of dropped records is reported in a warning by the listener.
+"""
+import Queue
+import atexit
+import copy
+import importlib
+import logging
+import os
+import threading
+import weakref
+
+DROP_NEW = 'drop_new'
+DROP_OLDEST = 'drop_oldest'
+BLOCK = 'block'
+
+_handlers = weakref.WeakSet()
+
+
+def _import_class(path):
+    module_name, class_name = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+class QueueHandler(logging.Handler):
+    '''
+    Puts log records on a bounded queue to be written by a QueueListener thread.
+
+    The listener thread is started on the first record, and restarted if the process has
+    forked since (e.g. pre-forked WSGI workers), since threads do not survive a fork.
+    '''
+    def __init__(self, handler_class=None, handler_kwargs=None, handler=None, maxsize=10000, drop_policy=DROP_NEW, level=logging.NOTSET):
+        logging.Handler.__init__(self, level=level)
+        assert drop_policy in (DROP_NEW, DROP_OLDEST, BLOCK), "invalid drop_policy: %s" % drop_policy
+        if handler is None:
+            handler = _import_class(handler_class)(**(handler_kwargs or {}))
+        self.handler = handler
+        self.maxsize = maxsize
+        self.drop_policy = drop_policy
+        self.dropped = 0
+        self.queue = None
+        self.listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        _handlers.add(self)
+
+    def setFormatter(self, fmt):
+        logging.Handler.setFormatter(self, fmt)
+        self.handler.setFormatter(fmt)
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = Queue.Queue(self.maxsize)
+            self.dropped = 0
+            self.listener = QueueListener(self.queue, self.handler, self)
+            self.listener.start()
+            self._pid = os.getpid()
+
+    def prepare(self, record):
+        '''
+        Merges the message arguments and exception text into a copy of the record, so the
+        listener doesn't format mutable arguments after the caller has changed them. The
+        caller's record is left alone for the handlers after this one.
+        '''
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            self._ensure_listener()
+            record = self.prepare(record)
+            if self.drop_policy == BLOCK:
+                self.queue.put(record)
+                return
+            try:
+                self.queue.put_nowait(record)
+            except Queue.Full:
+                if self.drop_policy == DROP_OLDEST:
+                    try:
+                        self.queue.get_nowait()
+                        self.queue.task_done()
+                    except Queue.Empty:
+                        pass
+                    try:
+                        self.queue.put_nowait(record)
+                    except Queue.Full:
+                        pass
+                self.dropped += 1
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        if self.listener is not None and self._pid == os.getpid():
+            self.queue.join()
+        self.handler.flush()
+
+    def close(self):
+        self.stop()
+        self.handler.close()
+        logging.Handler.close(self)
+
+    def stop(self, timeout=5.0):
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop(timeout)
+            self.listener = None
+            self._pid = None
+
+
+class QueueListener(object):
+    '''
+    Background thread that takes records off the queue and hands them to the wrapped handler.
+    '''
+    _sentinel = None
+
+    def __init__(self, queue, handler, queue_handler):
+        self.queue = queue
+        self.handler = handler
+        self.queue_handler = queue_handler
+        self.reported_dropped = 0
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._monitor, name='QueueListener')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        # Unlike records, the sentinel must not be dropped, so wait for room.
+        self.queue.put(self._sentinel)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _report_dropped(self):
+        dropped = self.queue_handler.dropped
+        if dropped > self.reported_dropped:
+            record = logging.LogRecord(
+                __name__, logging.WARNING, __file__, 0,
+                "Log queue full: dropped %d records" % (dropped - self.reported_dropped), None, None)
+            self.reported_dropped = dropped
+            self.handler.handle(record)
+
+    def _monitor(self):
+        while True:
+            record = self.queue.get()
+            try:
+                if record is self._sentinel:
+                    self._report_dropped()
+                    break
+                self._report_dropped()
+                if record.levelno >= self.handler.level:
+                    self.handler.handle(record)
+            except Exception:
+                self.handler.handleError(record)
+            finally:
+                self.queue.task_done()
+
+
+def _stop_all():
+    for handler in list(_handlers):
+        handler.stop()
+
+atexit.register(_stop_all)
@@ -0,0 +1,270 @@
+"""
+metrics.py
+
+Counters and latency histograms of requests, annotation database calls, caches, grade
+passbacks and LTI launches, served in the Prometheus text format at /metrics (see
+annotationsx.views.metrics_view). Metrics are updated where things happen:
+
+    metrics.CACHE_REQUESTS.inc(cache='token', result='hit')
+    metrics.CATCH_SECONDS.observe(elapsed, operation='search')
+
+Each process counts in memory. Under a pre-forking server (gunicorn, uWSGI), and for the
+worker commands, set `multiprocess_dir` in the METRICS setting to a directory shared by
+all of them: every process then writes its values to a file of its own there at most every
+`flush_interval` seconds, and the endpoint adds up the files, so it reports the same
+totals whichever worker serves it. The files of processes that have exited are kept, since
+their counts are part of the totals, but gauges only add up live processes. Empty the
+directory when the service is restarted.
+"""
+from django.conf import settings
+import bisect
+import collections
+import errno
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+METRICS_SETTINGS = getattr(settings, 'METRICS', {})
+ENABLED = METRICS_SETTINGS.get('enabled', True)
+MULTIPROCESS_DIR = METRICS_SETTINGS.get('multiprocess_dir', None)   # directory shared by the processes, or None to count per process
+FLUSH_INTERVAL = METRICS_SETTINGS.get('flush_interval', 1)          # seconds between writes of a process's file
+
+# seconds, from a cached fragment to a course-wide export
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Registry(object):
+    '''
+    The metrics and the values counted by this process, keyed by metric name and then by
+    the tuple of label values. A histogram's value is a list of the observations in each
+    bucket (not cumulative), then +Inf, then their sum.
+    '''
+    def __init__(self):
+        self.metrics = collections.OrderedDict()
+        self.values = {}
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.path = None
+        self.dirty = False
+        self.flusher = None
+
+    def register(self, metric):
+        assert metric.name not in self.metrics, "metric %s is already registered" % metric.name
+        self.metrics[metric.name] = metric
+        return metric
+
+    def _values_of(self, name):
+        if os.getpid() != self.pid:
+            # forked: the parent's values are counted in its own file
+            self.values, self.pid, self.path, self.flusher = {}, os.getpid(), None, None
+        self.dirty = True
+        if MULTIPROCESS_DIR and self.flusher is None:
+            self.flusher = threading.Thread(target=self._flush_periodically, name='metrics-flusher')
+            self.flusher.daemon = True
+            self.flusher.start()
+        return self.values.setdefault(name, {})
+
+    def add(self, name, key, amount):
+        with self.lock:
+            values = self._values_of(name)
+            values[key] = values.get(key, 0) + amount
+
+    def observe(self, name, key, index, value, size):
+        with self.lock:
+            values = self._values_of(name)
+            buckets = values.get(key)
+            if buckets is None:
+                buckets = values[key] = [0] * (size + 2)
+            buckets[index] += 1
+            buckets[-1] += value
+
+    def _flush_periodically(self):
+        pid = self.pid
+        while self.pid == pid and MULTIPROCESS_DIR:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except (IOError, OSError) as e:
+                logger.warning("Could not write metrics to %s: %s" % (MULTIPROCESS_DIR, e))
+
+    def flush(self):
+        '''
+        Writes this process's values to its file in MULTIPROCESS_DIR, if they have changed.
+        '''
+        with self.lock:
+            if not self.dirty:
+                return
+            if self.path is None:
+                self.path = os.path.join(MULTIPROCESS_DIR, 'metrics-%d-%d.json' % (self.pid, int(time.time() * 1000)))
+            content = json.dumps(dict((name, values.items()) for name, values in self.values.iteritems()))
+            self.dirty = False
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        os.rename(tmp_path, self.path)
+
+    def collect(self):
+        '''
+        Returns the values of every process in multiprocess mode, otherwise of this one.
+        '''
+        if not MULTIPROCESS_DIR:
+            with self.lock:
+                return dict((name, dict((key, _copy(value)) for key, value in values.iteritems()))
+                            for name, values in self.values.iteritems())
+        self.flush()
+        totals = {}
+        for path in glob.glob(os.path.join(MULTIPROCESS_DIR, 'metrics-*.json')):
+            try:
+                with open(path) as f:
+                    process_values = json.load(f)
+            except (IOError, ValueError):
+                continue  # removed, or written by an older version
+            alive = None
+            for name, values in process_values.iteritems():
+                metric = self.metrics.get(name)
+                if metric is None:
+                    continue
+                if metric.kind == 'gauge':
+                    if alive is None:
+                        alive = _is_alive(int(os.path.basename(path).split('-')[1]))
+                    if not alive:
+                        continue
+                merged = totals.setdefault(name, {})
+                for key, value in values:
+                    key = tuple(key)
+                    merged[key] = _merge(merged.get(key), value)
+        return totals
+
+
+def _copy(value):
+    return list(value) if isinstance(value, list) else value
+
+
+def _merge(total, value):
+    if total is None:
+        return _copy(value)
+    if isinstance(total, list):
+        return [a + b for a, b in zip(total, value)]
+    return total + value
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+REGISTRY = Registry()
+
+
+class Metric(object):
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY.register(self)
+
+    def _key(self, labels):
+        assert len(labels) == len(self.labelnames), "%s takes the labels %s" % (self.name, self.labelnames)
+        return tuple(unicode(labels[name]) for name in self.labelnames)
+
+    def samples(self, key, value):
+        yield self.name, self._labels(key), value
+
+    def _labels(self, key, **extra):
+        return zip(self.labelnames, key) + sorted(extra.items())
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if ENABLED:
+            REGISTRY.add(self.name, self._key(labels), amount)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        if ENABLED:
+            REGISTRY.add(self.name, self._key(labels), amount)
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        if ENABLED:
+            REGISTRY.observe(self.name, self._key(labels), bisect.bisect_left(self.buckets, value), value, len(self.buckets))
+
+    def samples(self, key, value):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), value):
+            cumulative += count
+            yield self.name + '_bucket', self._labels(key, le=_format_value(bound)), cumulative
+        yield self.name + '_sum', self._labels(key), value[-1]
+        yield self.name + '_count', self._labels(key), cumulative
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def render(values=None):
+    '''
+    Returns the metrics in the Prometheus text exposition format (version 0.0.4).
+    '''
+    values = REGISTRY.collect() if values is None else values
+    lines = []
+    for metric in REGISTRY.metrics.itervalues():
+        lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+        lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+        for key, value in sorted(values.get(metric.name, {}).iteritems()):
+            for name, labels, sample in metric.samples(key, value):
+                label_text = ','.join(u'%s="%s"' % (label, _escape(label_value)) for label, label_value in labels)
+                lines.append(u'%s%s %s' % (name, '{%s}' % label_text if label_text else '', _format_value(sample)))
+    return u'\n'.join(lines) + u'\n'
+
+
+def observe_catch(operation, elapsed, status):
+    '''
+    Records a request to the annotation database. The status is the HTTP status code, or
+    "timeout" or "error" if there was no response.
+    '''
+    CATCH_SECONDS.observe(elapsed, operation=operation)
+    CATCH_RESPONSES.inc(operation=operation, status=status)
+
+
+REQUEST_SECONDS = Histogram('hxat_request_duration_seconds', 'Time to handle a request, by URL name.', ['view'])
+REQUESTS = Counter('hxat_requests_total', 'Requests handled, by URL name and status code.', ['view', 'status'])
+DB_QUERIES = Counter('hxat_db_queries_total', 'SQL queries made while handling requests, by URL name.', ['view'])
+DB_SECONDS = Counter('hxat_db_query_seconds_total', 'Time spent in SQL queries while handling requests, by URL name.', ['view'])
+CATCH_SECONDS = Histogram('hxat_catch_request_duration_seconds', 'Time of requests to the annotation database, by operation.', ['operation'])
+CATCH_RESPONSES = Counter('hxat_catch_responses_total', 'Responses of the annotation database, by operation and status.', ['operation', 'status'])
+CACHE_REQUESTS = Counter('hxat_cache_requests_total', 'Cache lookups, by cache and whether they were a hit or a miss.', ['cache', 'result'])
+GRADE_PASSBACKS = Counter('hxat_grade_passbacks_total', 'Grades sent to the LMS, by outcome.', ['outcome'])
+LTI_LAUNCHES = Counter('hxat_lti_launches_total', 'LTI launch requests, by whether they were valid.', ['result'])
+LTI_LAUNCHES_IN_PROGRESS = Gauge('hxat_lti_launches_in_progress', 'LTI launch requests being handled.')
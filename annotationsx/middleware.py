@@ -16,9 +16,12 @@ import collections
 
 from django.conf import settings
 from django.core.exceptions import PermissionDenied, ImproperlyConfigured
+from django.db import connections
 from django.http import HttpResponse
 from ims_lti_py.tool_provider import DjangoToolProvider
+from annotationsx import metrics, profiling, timing
 import logging
+import random
 import time
 import json
 import importlib
@@ -157,7 +160,8 @@ class CookielessSessionMiddleware(object):
         request.session = self.SessionStore(session_key)
         if request.session.exists(session_key):
             self.logger.info('Session exists')
-            self.logger.debug('Session data: %s' % dict(request.session.items()))
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug('Session data: %s', dict(request.session.items()))
         else:
             self.logger.info("Session does not exist. Creating new session.")
             request.session.create()
@@ -202,7 +206,12 @@ class MultiLTILaunchMiddleware(object):
         is_basic_lti_launch = (request.method == 'POST' and request.POST.get('lti_message_type') == 'basic-lti-launch-request')
         self.logger.info("basic-lti-launch-request? %s" % is_basic_lti_launch)
         if is_basic_lti_launch:
-            self._validate_request(request)
+            try:
+                self._validate_request(request)
+            except LTILaunchError:
+                metrics.LTI_LAUNCHES.inc(result='invalid')
+                raise
+            metrics.LTI_LAUNCHES.inc(result='valid')
             self._update_session(request)
             self._log_ip_address(request)
             self._set_current_session(request, resource_link_id=request.POST.get('resource_link_id'), raise_exception=True)
@@ -232,16 +241,17 @@ class MultiLTILaunchMiddleware(object):
             self.logger.error("could not get a secret for requested key: %s" % request_key)
             raise LTILaunchError
 
-        self.logger.debug('using key/secret %s/%s' % (request_key, secret))
         tool_provider = DjangoToolProvider(request_key, secret, request.POST)
 
-        postparams = request.POST.dict()
-        self.logger.debug('request is secure: %s' % request.is_secure())
-        for key in postparams:
-            self.logger.debug('POST %s: %s' % (key, postparams.get(key)))
-        self.logger.debug('request abs url is %s' % request.build_absolute_uri())
-        for key in request.META:
-            self.logger.debug('META %s: %s' % (key, request.META.get(key)))
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('using key/secret %s/%s', request_key, secret)
+            postparams = request.POST.dict()
+            self.logger.debug('request is secure: %s', request.is_secure())
+            for key in postparams:
+                self.logger.debug('POST %s: %s', key, postparams.get(key))
+            self.logger.debug('request abs url is %s', request.build_absolute_uri())
+            for key in request.META:
+                self.logger.debug('META %s: %s', key, request.META.get(key))
 
         self.logger.debug("about to check the signature")
         try:
@@ -317,7 +327,10 @@ class MultiLTILaunchMiddleware(object):
         if len(lti_launches.keys()) >= max_launches:
             self.logger.info("Invalidating oldest LTI launch (FIFO)")
             invalidated_launch = lti_launches.popitem(last=False)
-            self.logger.info("LTI launch invalidated: %s", json.dumps(invalidated_launch, indent=4))
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("LTI launch invalidated: %s", json.dumps(invalidated_launch, indent=4))
+            else:
+                self.logger.info("LTI launch invalidated: %s", invalidated_launch[0])
 
         lti_launches[resource_link_id] = {
             'launch_params': lti_params,
@@ -347,4 +360,109 @@ class MultiLTILaunchMiddleware(object):
 class ExceptionLoggingMiddleware(object):
 
     def process_exception(self, request, exception):
-        logging.exception('Exception logged for request: %s message: %s' % (request.path, str(exception)))
\ No newline at end of file
+        logging.exception('Exception logged for request: %s message: %s' % (request.path, str(exception)))
+
+
+class ServerTimingMiddleware(object):
+    '''
+    Times a sample of requests by phase (SQL queries, annotation database requests, token
+    signing and template rendering, see annotationsx.timing) and reports them in a
+    Server-Timing header, which browsers show in the network panel, and as a log line of
+    JSON on the annotationsx.timing logger.
+
+    The share of requests that are reported is the `sample_rate` of the SERVER_TIMING
+    setting. When metrics are enabled, every request is timed for MetricsMiddleware.
+    This should be the first middleware so that the others are timed as well.
+    '''
+    def __init__(self):
+        server_timing = getattr(settings, 'SERVER_TIMING', {})
+        self.sample_rate = server_timing.get('sample_rate', 0.01)
+        self.send_header = server_timing.get('header', True)
+        timing.install_template_timing()
+
+    def process_request(self, request):
+        timing.stop()  # in case the previous request on this thread didn't finish
+        request.server_timing_sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        if not (request.server_timing_sampled or metrics.ENABLED):
+            return
+        for connection in connections.all():
+            timing.install_cursor_timing(connection)
+        timing.start()
+
+    def process_response(self, request, response):
+        timer = timing.stop()
+        if timer is None or not getattr(request, 'server_timing_sampled', False):
+            return response
+        if self.send_header:
+            response['Server-Timing'] = timer.header()
+        timer.log(method=request.method, path=request.path, status=response.status_code)
+        return response
+
+
+class SlowRequestProfilerMiddleware(object):
+    '''
+    Runs cProfile on a sample of requests and saves the ones slower than the threshold, with
+    their SQL statements, as a RequestProfile (see annotationsx.profiling). The statements
+    are recorded by the timer of ServerTimingMiddleware, which must come before this one.
+    '''
+    def process_request(self, request):
+        if not (profiling.SAMPLE_RATE > 0 and random.random() < profiling.SAMPLE_RATE):
+            return
+        timer = timing.current()
+        request.profiler_owns_timer = timer is None
+        if timer is None:
+            for connection in connections.all():
+                timing.install_cursor_timing(connection)
+            timer = timing.start()
+        request.profiler = profiling.RequestProfiler(timer)
+        request.profiler.start()
+
+    def process_response(self, request, response):
+        profiler = getattr(request, 'profiler', None)
+        if profiler is None:
+            return response
+        queries = profiler.stop()
+        if request.profiler_owns_timer:
+            timing.stop()
+        if profiler.elapsed * 1000 >= profiling.THRESHOLD_MS:
+            try:
+                with timing.suspended():
+                    profiling.save_profile(request, response, profiler, queries)
+            except Exception:
+                logger.exception("Could not save the profile of %s %s" % (request.method, request.path))
+        return response
+
+
+class MetricsMiddleware(object):
+    '''
+    Records the latency, status and SQL queries of each request by URL name, and the LTI
+    launches in progress, in annotationsx.metrics. The SQL queries are counted by the timer
+    of ServerTimingMiddleware, which must come before this one.
+    '''
+    def process_request(self, request):
+        if not metrics.ENABLED:
+            return
+        request.metrics_start = time.time()
+        # launches are form posts; other bodies (e.g. annotation JSON) are left for the view to read
+        is_form = request.META.get('CONTENT_TYPE', '').split(';')[0].strip().lower() == 'application/x-www-form-urlencoded'
+        request.metrics_lti_launch = request.method == 'POST' and is_form and \
+            request.POST.get('lti_message_type') == 'basic-lti-launch-request'
+        if request.metrics_lti_launch:
+            metrics.LTI_LAUNCHES_IN_PROGRESS.inc()
+
+    def process_response(self, request, response):
+        start = getattr(request, 'metrics_start', None)
+        if start is None:
+            return response
+        if request.metrics_lti_launch:
+            metrics.LTI_LAUNCHES_IN_PROGRESS.dec()
+        resolver_match = getattr(request, 'resolver_match', None)
+        view = resolver_match.view_name if resolver_match is not None else 'unmatched'
+        metrics.REQUEST_SECONDS.observe(time.time() - start, view=view)
+        metrics.REQUESTS.inc(view=view, status=response.status_code)
+        timer = timing.current()
+        if timer is not None:
+            queries, seconds = timer.phases.get('db', (0, 0.0))
+            metrics.DB_QUERIES.inc(queries, view=view)
+            metrics.DB_SECONDS.inc(seconds, view=view)
+        return response
@@ -0,0 +1,131 @@
+"""
+profiling.py
+
+Saves the profile of slow requests so they can be looked at in the admin (Request profiles
+under Annotation_Store). SlowRequestProfilerMiddleware runs cProfile on a sample of the
+requests, along with a list of the SQL statements they make; the ones that take longer
+than the threshold are saved as a RequestProfile with the cProfile report, each statement
+and its duration, and the query plans of the slowest statements. The parameters of the
+statements on the session and auth tables are left out.
+
+The PROFILER setting has:
+
+    sample_rate      share of requests that are profiled (default 0, off)
+    threshold_ms     requests that take less are not saved (default 1000)
+    explain_slowest  number of the slowest SELECT statements that are explained (default 3)
+    keep             number of profiles kept; older ones are deleted (default 500)
+
+Requests that are not sampled cost a call to random(). cProfile slows down the requests it
+runs on by up to a factor of two, so keep the sample rate low in production.
+"""
+from django.conf import settings
+from django.db import connections, transaction
+import cProfile
+import json
+import logging
+import pstats
+import re
+import StringIO
+import time
+
+logger = logging.getLogger(__name__)
+
+PROFILER_SETTINGS = getattr(settings, 'PROFILER', {})
+SAMPLE_RATE = PROFILER_SETTINGS.get('sample_rate', 0)
+THRESHOLD_MS = PROFILER_SETTINGS.get('threshold_ms', 1000)
+EXPLAIN_SLOWEST = PROFILER_SETTINGS.get('explain_slowest', 3)
+KEEP = PROFILER_SETTINGS.get('keep', 500)
+
+# functions in the cProfile report, by cumulative time
+PROFILE_LINES = 60
+# parameters longer than this are cut short in the saved statements
+MAX_PARAMS_LENGTH = 500
+# the parameters of statements on these tables (session data, password hashes) are not saved
+REDACTED_TABLES = re.compile(r'\b(django_session|auth_\w+)\b', re.IGNORECASE)
+
+
+class RequestProfiler(object):
+    '''
+    Profiles the code run in this thread between start() and stop(), and records the SQL
+    statements made in the request's timer (see annotationsx.timing).
+    '''
+    def __init__(self, timer):
+        self.timer = timer
+        self.profile = cProfile.Profile()
+        self.start_time = None
+        self.elapsed = None
+
+    def start(self):
+        self.timer.queries = []
+        self.start_time = time.time()
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        self.elapsed = time.time() - self.start_time
+        queries, self.timer.queries = self.timer.queries, None
+        return queries
+
+    def report(self):
+        out = StringIO.StringIO()
+        pstats.Stats(self.profile, stream=out).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        return out.getvalue()
+
+
+def _explain_prefix(connection):
+    return 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+
+
+def explain(queries, slowest=None, using='default'):
+    '''
+    Returns the query plans of the slowest SELECT statements of (sql, params, seconds).
+    '''
+    slowest = EXPLAIN_SLOWEST if slowest is None else slowest
+    selects = [q for q in queries if q[0].lstrip().upper().startswith('SELECT')]
+    selects.sort(key=lambda q: q[2], reverse=True)
+    connection = connections[using]
+    plans = []
+    for sql, params, seconds in selects[:slowest]:
+        try:
+            with transaction.atomic(using=using):
+                cursor = connection.cursor()
+                cursor.execute(_explain_prefix(connection) + sql, params)
+                plan = '\n'.join(' '.join(unicode(column) for column in row) for row in cursor.fetchall())
+        except Exception as e:
+            plan = 'Could not explain: %s' % e
+        plans.append({'sql': sql, 'ms': round(seconds * 1000, 2), 'plan': plan})
+    return plans
+
+
+def _format_params(sql, params):
+    if REDACTED_TABLES.search(sql):
+        return '(redacted)'
+    text = repr(params)
+    return text if len(text) <= MAX_PARAMS_LENGTH else text[:MAX_PARAMS_LENGTH] + '...'
+
+
+def save_profile(request, response, profiler, queries):
+    '''
+    Saves a RequestProfile and deletes the ones beyond the KEEP most recent.
+    '''
+    from annotation_store.models import RequestProfile
+
+    resolver_match = getattr(request, 'resolver_match', None)
+    profile = RequestProfile.objects.create(
+        method=request.method,
+        path=request.path[:1024],
+        view_name=resolver_match.view_name if resolver_match is not None else '',
+        status=response.status_code,
+        duration_ms=round(profiler.elapsed * 1000, 1),
+        query_count=len(queries),
+        query_ms=round(sum(q[2] for q in queries) * 1000, 1),
+        phases=json.dumps(profiler.timer.as_dict()['phases'], sort_keys=True),
+        profile=profiler.report(),
+        queries=json.dumps([{'sql': sql, 'params': _format_params(sql, params), 'ms': round(seconds * 1000, 2)}
+                            for sql, params, seconds in queries]),
+        explains=json.dumps(explain(queries)),
+    )
+    oldest_kept = RequestProfile.objects.order_by('-pk').values_list('pk', flat=True)[KEEP - 1:KEEP]
+    if len(oldest_kept):
+        RequestProfile.objects.filter(pk__lt=oldest_kept[0]).delete()
+    return profile
@@ -47,6 +47,9 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'annotationsx.middleware.ServerTimingMiddleware',
+    'annotationsx.middleware.MetricsMiddleware',
+    'annotationsx.middleware.SlowRequestProfilerMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'annotationsx.middleware.CookielessSessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -121,6 +124,26 @@ _DEFAULT_LOG_LEVEL = SECURE_SETTINGS.get('log_level', SECURE_SETTINGS.get('djang
 _LOG_QUERIES = SECURE_SETTINGS.get('log_queries', False)
 _LOG_ROOT = SECURE_SETTINGS.get('log_root', '')
 _LOG_FILENAME = SECURE_SETTINGS.get('log_filename', 'app.log')
+_LOG_ASYNC = SECURE_SETTINGS.get('log_async', True)
+_LOG_QUEUE_SIZE = SECURE_SETTINGS.get('log_queue_size', 10000)
+_LOG_QUEUE_DROP_POLICY = SECURE_SETTINGS.get('log_queue_drop_policy', 'drop_new') # drop_new, drop_oldest or block
+
+def _log_handler(handler_class, level, formatter, **kwargs):
+    """
+    Returns a handler config that writes through a background thread (see annotationsx.loghandlers)
+    unless async logging is disabled, in which case records are written on the calling thread.
+    """
+    if not _LOG_ASYNC:
+        return dict(kwargs, **{'class': handler_class, 'level': level, 'formatter': formatter})
+    return {
+        'class': 'annotationsx.loghandlers.QueueHandler',
+        'level': level,
+        'formatter': formatter,
+        'handler_class': handler_class,
+        'handler_kwargs': kwargs,
+        'maxsize': _LOG_QUEUE_SIZE,
+        'drop_policy': _LOG_QUEUE_DROP_POLICY,
+    }
 
 LOGGING = {
     'version': 1,
@@ -135,17 +158,13 @@ LOGGING = {
         },
     },
     'handlers': {
-        'console': {
-            'class': 'logging.StreamHandler',
-            'formatter': 'simple',
-            'level': 'DEBUG',
-        },
-        'default': {
-            'class': 'logging.handlers.WatchedFileHandler',
-            'level': _DEFAULT_LOG_LEVEL,
-            'formatter': 'verbose',
-            'filename': os.path.join(_LOG_ROOT, _LOG_FILENAME),
-        },
+        'console': _log_handler('logging.StreamHandler', 'DEBUG', 'simple'),
+        'default': _log_handler(
+            'logging.handlers.WatchedFileHandler',
+            _DEFAULT_LOG_LEVEL,
+            'verbose',
+            filename=os.path.join(_LOG_ROOT, _LOG_FILENAME),
+        ),
     },
     # This is the default logger for any apps or libraries that use the logger
     # package, but are not represented in the `loggers` dict below.  A level
@@ -201,6 +220,11 @@ LOGGING = {
             'handlers': ['default', 'console'],
             'propagate': False,
         },
+        'annotationsx.timing': {
+            'level': _DEFAULT_LOG_LEVEL,
+            'handlers': ['default', 'console'],
+            'propagate': False,
+        },
     },
 }
 
@@ -250,6 +274,21 @@ ANNOTATION_TRANSCRIPT_LINK_DEFAULT = SECURE_SETTINGS.get("annotation_transcript_
 ANNOTATION_HTTPS_ONLY = SECURE_SETTINGS.get("https_only", False)
 ANNOTATION_LOGGER_URL = SECURE_SETTINGS.get("annotation_logger_url", "")
 ANNOTATION_STORE = SECURE_SETTINGS.get("annotation_store", {})
+# Grades are queued and sent by "manage.py process_grade_passbacks" unless ANNOTATION_STORE['grade_passback'] is 'sync'
+LTI_GRADE_PASSBACK = SECURE_SETTINGS.get("lti_grade_passback", {}) # max_attempts, backoff_base, backoff_max, claim_timeout
+# Annotation transfers between courses are run by "manage.py process_annotation_transfers"
+ANNOTATION_TRANSFER = SECURE_SETTINGS.get("annotation_transfer", {}) # parallelism, batch_size, search_timeout, request_timeout, max_attempts, backoff_base, backoff_max, claim_timeout
+ANNOTATION_FETCH = SECURE_SETTINGS.get("annotation_fetch", {}) # page_size, parallelism, page_timeout for the instructor dashboard
+INSTRUCTOR_DASHBOARD = SECURE_SETTINGS.get("instructor_dashboard", {}) # page_size, reference_cache_timeout, panel_cache_timeout
+DASHBOARD_SNAPSHOT = SECURE_SETTINGS.get("dashboard_snapshot", {}) # max_age, full_refresh_interval, claim_timeout, page_size
+ANNOTATION_TOKEN_CACHE_SIZE = SECURE_SETTINGS.get("annotation_token_cache_size", 1000) # set to 0 to disable
+ANNOTATION_TOKEN_REFRESH_MARGIN = SECURE_SETTINGS.get("annotation_token_refresh_margin", 3600) # seconds before expiry to re-sign
+GZIP_MIN_LENGTH = SECURE_SETTINGS.get("gzip_min_length", 1024) # smaller search results and dashboard fragments are sent uncompressed
+IIIF_MANIFEST_MAX_AGE = SECURE_SETTINGS.get("iiif_manifest_max_age", 3600) # seconds before a cached IIIF manifest is revalidated
+SERVER_TIMING = SECURE_SETTINGS.get("server_timing", {}) # sample_rate (share of requests timed, default 0.01), header
+METRICS = SECURE_SETTINGS.get("metrics", {}) # enabled, multiprocess_dir, flush_interval, allowed_ips for the /metrics endpoint
+LTI_LAUNCH_CACHE_TIMEOUT = SECURE_SETTINGS.get("lti_launch_cache_timeout", 60) # seconds that courses, resource link configurations and assignment navigation are cached for launches
+PROFILER = SECURE_SETTINGS.get("profiler", {}) # sample_rate (default 0, off), threshold_ms, explain_slowest, keep for the slow request profiles
 
 if ANNOTATION_HTTPS_ONLY:
     SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
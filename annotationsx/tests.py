@@ -0,0 +1,350 @@
+import gzip
+import io
+import json
+import logging
+import mock
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from multiprocessing.pool import ThreadPool
+
+from django.contrib.auth.models import User
+from django.http import HttpResponse, StreamingHttpResponse
+from django.template import Context, Template
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from annotationsx.compression import compress_response, gzip_response
+from annotationsx.middleware import MetricsMiddleware, ServerTimingMiddleware, SlowRequestProfilerMiddleware
+from annotationsx import metrics, profiling, timing
+from annotation_store.admin import RequestProfileAdmin
+from annotation_store.models import RequestProfile
+from django.contrib import admin
+from annotationsx.loghandlers import QueueHandler, DROP_NEW, DROP_OLDEST
+
+
+class ListHandler(logging.Handler):
+    def __init__(self, gate=None):
+        logging.Handler.__init__(self)
+        self.records = []
+        self.gate = gate
+        self.emitting = threading.Event()
+
+    def emit(self, record):
+        self.emitting.set()
+        if self.gate is not None:
+            self.gate.wait()
+        self.records.append(self.format(record))
+
+
+class QueueHandlerTest(TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('annotationsx.tests.queue')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+
+    def tearDown(self):
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+            handler.close()
+
+    def _add_handler(self, **kwargs):
+        target = ListHandler(kwargs.pop('gate', None))
+        handler = QueueHandler(handler=target, **kwargs)
+        handler.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+        self.logger.addHandler(handler)
+        return handler, target
+
+    def test_records_written_by_listener(self):
+        handler, target = self._add_handler()
+        self.logger.info("hello %s", "world")
+        handler.flush()
+        self.assertEqual(['INFO hello world'], target.records)
+        self.assertNotEqual(threading.current_thread(), handler.listener._thread)
+
+    def test_message_formatted_when_logged(self):
+        handler, target = self._add_handler()
+        data = {'read': []}
+        self.logger.info("permissions: %s", data)
+        data['read'].append('changed')
+        handler.flush()
+        self.assertEqual(["INFO permissions: {'read': []}"], target.records)
+
+    def test_record_left_alone_for_other_handlers(self):
+        handler, target = self._add_handler()
+        after = []
+        after_handler = logging.Handler()
+        after_handler.emit = after.append
+        self.logger.addHandler(after_handler)
+        try:
+            raise ValueError("broken")
+        except ValueError:
+            self.logger.exception("failed %s", "here")
+        handler.flush()
+        self.assertTrue(target.records[0].startswith('ERROR failed here\nTraceback'))
+        # e.g. the admin email handler reads the traceback from exc_info
+        self.assertEqual(('failed %s', ('here',), ValueError), (after[0].msg, after[0].args, after[0].exc_info[0]))
+
+    def _fill_queue(self, drop_policy):
+        gate = threading.Event()
+        handler, target = self._add_handler(gate=gate, maxsize=2, drop_policy=drop_policy)
+        self.logger.info("blocking")  # taken by the listener, which waits on the gate
+        self.assertTrue(target.emitting.wait(5))
+        for i in range(4):
+            self.logger.info("message %d", i)
+        gate.set()
+        handler.flush()
+        return handler, target
+
+    def test_drop_new(self):
+        handler, target = self._fill_queue(DROP_NEW)
+        self.assertEqual(2, handler.dropped)
+        self.assertEqual(['INFO blocking', 'WARNING Log queue full: dropped 2 records', 'INFO message 0', 'INFO message 1'], target.records)
+
+    def test_drop_oldest(self):
+        handler, target = self._fill_queue(DROP_OLDEST)
+        self.assertEqual(2, handler.dropped)
+        self.assertIn('INFO message 3', target.records)
+        self.assertNotIn('INFO message 0', target.records)
+
+
+def gunzip(content):
+    return gzip.GzipFile(fileobj=io.BytesIO(content)).read()
+
+
+@override_settings(GZIP_MIN_LENGTH=100)
+class CompressResponseTest(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.content = '{"rows": [%s]}' % ', '.join(['{"text": "annotation"}'] * 50)
+
+    def test_compresses_large_response(self):
+        request = self.factory.get('/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        response = compress_response(request, HttpResponse(self.content))
+        self.assertEqual('gzip', response['Content-Encoding'])
+        self.assertEqual('Accept-Encoding', response['Vary'])
+        self.assertEqual(str(len(response.content)), response['Content-Length'])
+        self.assertEqual(self.content, gunzip(response.content))
+
+    def test_small_response_not_compressed(self):
+        request = self.factory.get('/', HTTP_ACCEPT_ENCODING='gzip')
+        response = compress_response(request, HttpResponse('{"rows": []}'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertFalse(response.has_header('Vary'))
+
+    def test_client_without_gzip_gets_vary(self):
+        request = self.factory.get('/', HTTP_ACCEPT_ENCODING='identity')
+        response = compress_response(request, HttpResponse(self.content))
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual('Accept-Encoding', response['Vary'])
+        self.assertEqual(self.content, response.content)
+
+    def test_existing_content_encoding_passed_through(self):
+        request = self.factory.get('/', HTTP_ACCEPT_ENCODING='gzip')
+        upstream = HttpResponse('x' * 200)
+        upstream['Content-Encoding'] = 'deflate'
+        upstream['Vary'] = 'Cookie'
+        response = compress_response(request, upstream)
+        self.assertEqual('deflate', response['Content-Encoding'])
+        self.assertEqual('x' * 200, response.content)
+        self.assertEqual('Cookie, Accept-Encoding', response['Vary'])
+
+    def test_small_passed_through_encoding_gets_vary(self):
+        request = self.factory.get('/', HTTP_ACCEPT_ENCODING='gzip')
+        upstream = HttpResponse('x' * 10)
+        upstream['Content-Encoding'] = 'gzip'
+        response = compress_response(request, upstream, min_length=1024)
+        self.assertEqual(('gzip', 'Accept-Encoding'), (response['Content-Encoding'], response['Vary']))
+
+    def test_streaming_response(self):
+        request = self.factory.get('/', HTTP_ACCEPT_ENCODING='gzip')
+        chunks = [self.content[i:i + 64] for i in range(0, len(self.content), 64)]
+        response = compress_response(request, StreamingHttpResponse(iter(chunks)))
+        self.assertEqual('gzip', response['Content-Encoding'])
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertEqual(self.content, gunzip(b''.join(response.streaming_content)))
+
+    def test_decorator(self):
+        view = gzip_response(lambda request: HttpResponse(self.content))
+        response = view(self.factory.get('/', HTTP_ACCEPT_ENCODING='gzip'))
+        self.assertEqual('gzip', response['Content-Encoding'])
+
+
+class ServerTimingMiddlewareTest(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.records = ListHandler()
+        timing.logger.addHandler(self.records)
+        self.addCleanup(timing.logger.removeHandler, self.records)
+
+    def _handle(self, view):
+        middleware = ServerTimingMiddleware()
+        request = self.factory.get('/dashboard')
+        middleware.process_request(request)
+        return middleware.process_response(request, view(request))
+
+    def _fetch(self, n):
+        with timing.phase('catch'):
+            return n
+
+    def _view(self, request):
+        User.objects.count()
+        User.objects.exists()
+        pool = ThreadPool(2)
+        pool.map(timing.bind(self._fetch), range(2))
+        pool.close()
+        pool.join()
+        return HttpResponse(Template('{% for x in xs %}{% include t %}{% endfor %}').render(
+            Context({'xs': range(3), 't': Template('{{ x }}')})))
+
+    @override_settings(SERVER_TIMING={'sample_rate': 1})
+    def test_phases_reported(self):
+        response = self._handle(self._view)
+        self.assertEqual('012', response.content)
+        metrics = dict((m.split(';')[0], m) for m in response['Server-Timing'].split(', '))
+        self.assertEqual(['catch', 'db', 'template', 'total'], sorted(metrics))
+        self.assertTrue(metrics['db'].endswith('desc="2 calls"'))
+        self.assertTrue(metrics['template'].endswith('desc="1 calls"'))
+
+        record = json.loads(self.records.records[-1])
+        self.assertEqual(('GET', '/dashboard', 200), (record['method'], record['path'], record['status']))
+        self.assertEqual({'catch': 2, 'db': 2, 'template': 1}, dict((k, v['count']) for k, v in record['phases'].items()))
+        self.assertIsNone(timing.current())
+
+    @override_settings(SERVER_TIMING={'sample_rate': 0})
+    def test_requests_not_sampled(self):
+        response = self._handle(self._view)
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual([], self.records.records)
+
+
+class SlowRequestProfilerTest(TestCase):
+    def setUp(self):
+        for attr, value in (('SAMPLE_RATE', 1), ('THRESHOLD_MS', 0), ('KEEP', 2)):
+            patcher = mock.patch.object(profiling, attr, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _handle(self, view):
+        middleware = [ServerTimingMiddleware(), SlowRequestProfilerMiddleware()]
+        request = RequestFactory().get('/lti_init/launch_lti/')
+        for m in middleware:
+            m.process_request(request)
+        response = view(request)
+        for m in reversed(middleware):
+            response = m.process_response(request, response)
+        return response
+
+    def _slow_view(self, request):
+        User.objects.filter(username='someone').exists()
+        User.objects.count()
+        return HttpResponse('done')
+
+    @override_settings(SERVER_TIMING={'sample_rate': 1})
+    def test_slow_request_is_saved(self):
+        response = self._handle(self._slow_view)
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('desc="2 calls"', [m for m in response['Server-Timing'].split(', ') if m.startswith('db;')][0])
+
+        profile = RequestProfile.objects.get()
+        self.assertEqual(('GET', '/lti_init/launch_lti/', 200, 2), (profile.method, profile.path, profile.status, profile.query_count))
+        queries = json.loads(profile.queries)
+        self.assertIn('"auth_user"."username" = %s', queries[0]['sql'])
+        self.assertEqual('(redacted)', queries[0]['params'])
+        self.assertEqual(2, len(json.loads(profile.explains)))
+        self.assertIn('auth_user', json.loads(profile.explains)[0]['plan'])
+        self.assertIn('_slow_view', profile.profile)
+        self.assertEqual({'db': 2}, dict((k, v['count']) for k, v in json.loads(profile.phases).items()))
+
+        model_admin = RequestProfileAdmin(RequestProfile, admin.site)
+        self.assertTrue(model_admin.all_queries(profile).startswith('<pre>'))
+        self.assertIn('&quot;auth_user&quot;', model_admin.slowest_queries(profile))
+
+    def test_params_of_session_and_auth_statements_are_redacted(self):
+        self.assertEqual("('course-1',)", profiling._format_params(
+            'SELECT "hx_lti_initializer_lticourse"."id" FROM "hx_lti_initializer_lticourse" WHERE "course_id" = %s', ('course-1',)))
+        for sql in ('UPDATE "django_session" SET "session_data" = %s WHERE "session_key" = %s',
+                    'INSERT INTO `auth_user` (`password`, `username`) VALUES (%s, %s)'):
+            self.assertEqual('(redacted)', profiling._format_params(sql, ('secret', 'key')))
+
+    @override_settings(SERVER_TIMING={'sample_rate': 0})
+    def test_only_recent_slow_sampled_requests_are_kept(self):
+        with mock.patch.object(metrics, 'ENABLED', False):  # the profiler times the request itself
+            for i in range(3):
+                self._handle(self._slow_view)
+        self.assertEqual([2, 2], list(RequestProfile.objects.values_list('query_count', flat=True)))
+        self.assertIsNone(timing.current())
+
+        with mock.patch.object(profiling, 'THRESHOLD_MS', 60000):
+            self._handle(self._slow_view)
+        with mock.patch.object(profiling, 'SAMPLE_RATE', 0):
+            self._handle(self._slow_view)
+        self.assertEqual(2, RequestProfile.objects.count())
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        for attr, value in (('values', {}), ('path', None), ('flusher', None)):
+            patcher = mock.patch.object(metrics.REGISTRY, attr, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_render(self):
+        metrics.CATCH_RESPONSES.inc(operation='search', status=200)
+        metrics.CATCH_RESPONSES.inc(operation='search', status=200)
+        metrics.CATCH_SECONDS.observe(0.02, operation='search')
+        metrics.CATCH_SECONDS.observe(60, operation='search')
+        lines = metrics.render().splitlines()
+        self.assertIn('# TYPE hxat_catch_request_duration_seconds histogram', lines)
+        self.assertIn('hxat_catch_responses_total{operation="search",status="200"} 2', lines)
+        self.assertIn('hxat_catch_request_duration_seconds_bucket{operation="search",le="0.01"} 0', lines)
+        self.assertIn('hxat_catch_request_duration_seconds_bucket{operation="search",le="0.025"} 1', lines)
+        self.assertIn('hxat_catch_request_duration_seconds_bucket{operation="search",le="+Inf"} 2', lines)
+        self.assertIn('hxat_catch_request_duration_seconds_count{operation="search"} 2', lines)
+        self.assertIn('hxat_catch_request_duration_seconds_sum{operation="search"} 60.02', lines)
+
+    def test_requests_counted_by_view(self):
+        self.client.get('/metrics')
+        response = self.client.get('/metrics')
+        self.assertEqual('text/plain; version=0.0.4; charset=utf-8', response['Content-Type'])
+        self.assertIn('hxat_requests_total{view="metrics",status="200"} 1', response.content.splitlines())
+        self.assertIn('hxat_request_duration_seconds_count{view="metrics"} 1', response.content.splitlines())
+        self.assertEqual(403, self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code)
+
+    def test_launches_in_progress_only_read_form_posts(self):
+        middleware = MetricsMiddleware()
+        launch = RequestFactory().post('/', 'lti_message_type=basic-lti-launch-request',
+                                       content_type='application/x-www-form-urlencoded; charset=utf-8')
+        with mock.patch.object(metrics, 'ENABLED', True):
+            middleware.process_request(launch)
+            self.assertTrue(launch.metrics_lti_launch)
+
+            request = RequestFactory().post('/', json.dumps({'lti_message_type': 'basic-lti-launch-request'}), content_type='application/json')
+            middleware.process_request(request)
+            self.assertFalse(request.metrics_lti_launch)
+            self.assertFalse(hasattr(request, '_post'))
+        self.assertEqual({(): 1}, metrics.REGISTRY.collect()['hxat_lti_launches_in_progress'])
+
+    def test_multiprocess_totals(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        def worker():
+            metrics.LTI_LAUNCHES.inc(result='valid')
+            metrics.LTI_LAUNCHES_IN_PROGRESS.inc()
+            metrics.REGISTRY.flush()
+
+        with mock.patch.object(metrics, 'MULTIPROCESS_DIR', directory):
+            process = multiprocessing.Process(target=worker)
+            process.start()
+            process.join()
+            metrics.LTI_LAUNCHES.inc(result='valid')
+            metrics.LTI_LAUNCHES_IN_PROGRESS.inc()
+            values = metrics.REGISTRY.collect()
+        self.assertEqual(2, len(os.listdir(directory)))
+        self.assertEqual({(u'valid',): 2}, values['hxat_lti_launches_total'])
+        # the worker has exited, so only this process's launch is still in progress
+        self.assertEqual({(): 1}, values['hxat_lti_launches_in_progress'])
@@ -0,0 +1,217 @@
+"""
+timing.py
+
+Per-request breakdown of where the time goes: SQL queries, requests to the annotation
+database, signing tokens and rendering templates. ServerTimingMiddleware starts a
+RequestTimer for a sample of requests, and the code on those paths reports its phases:
+
+    with timing.phase('catch'):
+        response = requests.get(...)
+
+Outside of a sampled request a phase costs a thread-local lookup. Phases nested in a phase
+of the same name (e.g. included templates) are only counted once. Work handed to a thread
+pool is attributed to the request by wrapping it with timing.bind().
+
+SQL queries are timed by wrapping the cursors of each connection (install_cursor_timing()),
+and templates by wrapping Template.render (install_template_timing()).
+"""
+from contextlib import contextmanager
+from functools import wraps
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class RequestTimer(object):
+    '''
+    The number of calls and seconds spent in each phase of a request.
+    '''
+    def __init__(self):
+        self.start = time.time()
+        self.end = None
+        self.phases = {}
+        self.queries = None  # a list to record each SQL statement in, see TimedCursorWrapper
+        self._lock = threading.Lock()  # phases may be added from a thread pool
+
+    def add(self, name, elapsed, calls=1):
+        with self._lock:
+            count, total = self.phases.get(name, (0, 0.0))
+            self.phases[name] = (count + calls, total + elapsed)
+
+    def stop(self):
+        self.end = time.time()
+
+    def total(self):
+        return (self.end or time.time()) - self.start
+
+    def header(self):
+        '''
+        Returns the phases as a Server-Timing header value, in milliseconds.
+        '''
+        metrics = ['%s;dur=%.1f;desc="%d calls"' % (name, total * 1000, count)
+                   for name, (count, total) in sorted(self.phases.iteritems())]
+        metrics.append('total;dur=%.1f' % (self.total() * 1000))
+        return ', '.join(metrics)
+
+    def as_dict(self):
+        return {
+            'total_ms': round(self.total() * 1000, 1),
+            'phases': dict((name, {'count': count, 'ms': round(total * 1000, 1)})
+                           for name, (count, total) in self.phases.iteritems()),
+        }
+
+    def log(self, **fields):
+        '''
+        Logs the timings as one line of JSON, along with the given fields.
+        '''
+        record = self.as_dict()
+        record.update(fields)
+        logger.info(json.dumps(record, sort_keys=True))
+
+
+def current():
+    '''
+    Returns the timer of the request being handled by this thread, or None.
+    '''
+    return getattr(_local, 'timer', None)
+
+
+def start():
+    _local.timer = RequestTimer()
+    _local.active = set()
+    return _local.timer
+
+
+def stop():
+    timer = current()
+    _local.timer = None
+    if timer is not None:
+        timer.stop()
+    return timer
+
+
+@contextmanager
+def phase(name, calls=1):
+    '''
+    Adds the time spent in the block to the current request's timer, if there is one. The
+    block counts as `calls` calls, e.g. 0 when it finishes reading a response timed before.
+    '''
+    timer = current()
+    if timer is None or name in _local.active:
+        yield
+        return
+    _local.active.add(name)
+    phase_start = time.time()
+    try:
+        yield
+    finally:
+        timer.add(name, time.time() - phase_start, calls)
+        _local.active.discard(name)
+
+
+@contextmanager
+def suspended():
+    '''
+    Leaves the block out of the current request's timer, e.g. for work done on the side.
+    '''
+    timer = current()
+    _local.timer = None
+    try:
+        yield
+    finally:
+        _local.timer = timer
+
+
+def bind(func):
+    '''
+    Returns func wrapped to report its phases to the timer of the calling thread's request
+    when it runs in another thread.
+    '''
+    timer = current()
+    if timer is None:
+        return func
+
+    @wraps(func)
+    def bound(*args, **kwargs):
+        previous = getattr(_local, 'timer', None), getattr(_local, 'active', None)
+        _local.timer, _local.active = timer, set()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.timer, _local.active = previous
+    return bound
+
+
+class TimedCursorWrapper(object):
+    '''
+    Wraps a database cursor to time its queries as the "db" phase. If the timer has a list of
+    queries, each statement is added to it as (sql, params, seconds).
+    '''
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return self.cursor.__exit__(type, value, traceback)
+
+    def _timed(self, method, sql, params):
+        timer = current()
+        query_start = time.time()
+        try:
+            with phase('db'):
+                return method(sql, params)
+        finally:
+            if timer is not None and timer.queries is not None:
+                timer.queries.append((sql, params, time.time() - query_start))
+
+    def callproc(self, procname, params=None):
+        return self._timed(self.cursor.callproc, procname, params)
+
+    def execute(self, sql, params=None):
+        return self._timed(self.cursor.execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self._timed(self.cursor.executemany, sql, param_list)
+
+
+def install_cursor_timing(connection):
+    '''
+    Wraps the cursors of a connection with TimedCursorWrapper. Connections are per thread,
+    so this is called for the connections of each request that is timed; it does nothing
+    if the connection is already wrapped.
+    '''
+    if getattr(connection, '_timed_cursor', False):
+        return
+    cursor = connection.cursor
+    connection.cursor = lambda: TimedCursorWrapper(cursor())
+    connection._timed_cursor = True
+
+
+def install_template_timing():
+    '''
+    Times the rendering of templates as the "template" phase.
+    '''
+    from django.template.base import Template
+    if getattr(Template.render, '_timed', False):
+        return
+    render = Template.render
+
+    @wraps(render)
+    def timed_render(self, context):
+        with phase('template'):
+            return render(self, context)
+    timed_render._timed = True
+    Template.render = timed_render
@@ -17,6 +17,7 @@ urlpatterns = patterns('',
     url(r'^accounts/profile/', TemplateView.as_view(template_name='index.html')),
     url(r'^500/', TemplateView.as_view(template_name="main/500.html")),
     url(r'^troubleshooting/', TemplateView.as_view(template_name="main/troubleshooting.html")),
+    url(r'^metrics$', 'annotationsx.views.metrics_view', name='metrics'),
     # TODO: Check to see if this works without enabling django_app_lti
     # Include the lti app's urls
     url(r'^lti/', include(django_app_lti.urls, namespace="lti")),
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse
+
+from annotationsx import metrics
+from annotationsx.middleware import ip_address
+
+
+def metrics_view(request):
+    '''
+    Returns the metrics of annotationsx.metrics in the Prometheus text format. Only the
+    addresses in `allowed_ips` of the METRICS setting (by default, the local host) may read them.
+    '''
+    if not metrics.ENABLED:
+        raise Http404
+    if ip_address(request) not in getattr(settings, 'METRICS', {}).get('allowed_ips', ['127.0.0.1']):
+        raise PermissionDenied
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,61 @@
+"""
+Microbenchmarks for hot paths in the tool.
+
+Each module in this package is a standalone script that configures django the same way
+as manage.py, so it can be run from the project root with the usual settings:
+
+    $ python -m benchmarks.token_cache
+
+Benchmarks do not touch the database unless noted in the module docstring.
+"""
+import datetime
+import os
+import random
+
+
+def setup_django():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "annotationsx.settings.aws")
+    import django
+    django.setup()
+
+
+def report(label, seconds, iterations):
+    per_call_us = (seconds / iterations) * 1e6
+    print "%-40s %10d calls %10.3f s %10.2f us/call" % (label, iterations, seconds, per_call_us)
+    return per_call_us
+
+
+def make_annotations(students=200, per_student=25, assignments=5, targets=10, seed=0):
+    """
+    Returns a list of CATCH-style annotation rows for a synthetic course, with roughly
+    one reply for every five annotations.
+    """
+    rng = random.Random(seed)
+    words = ('the', 'author', 'argues', 'that', 'this', 'passage', 'shows', 'a', 'turn', 'in',
+             'narrative', 'voice', 'compare', 'with', 'chapter', 'two', 'where', 'tone', 'shifts')
+    created = datetime.datetime(2016, 9, 1)
+    rows = []
+    for n in range(students * per_student):
+        user_id = 'student%04d' % (n % students)
+        row_id = n + 1
+        stamp = (created + datetime.timedelta(minutes=n)).strftime('%Y-%m-%dT%H:%M:%S.000000+00:00')
+        rows.append({
+            'id': row_id,
+            'contextId': 'course-v1:HarvardX+HDS3221.2x+2016',
+            'collectionId': 'assignment-%d' % (n % assignments),
+            'uri': str(n % targets + 1),
+            'media': 'text',
+            'user': {'id': user_id, 'name': 'Student Name %s' % user_id[-4:]},
+            'text': '<p>%s</p>' % ' '.join(rng.choice(words) for _ in range(rng.randint(10, 60))),
+            'quote': ' '.join(rng.choice(words) for _ in range(rng.randint(5, 30))),
+            'tags': [rng.choice(words) for _ in range(rng.randint(0, 3))],
+            'parent': str(rng.randint(1, row_id - 1)) if row_id > 1 and rng.random() < 0.2 else '0',
+            'ranges': [{'start': '/p[%d]' % (n % 40 + 1), 'end': '/p[%d]' % (n % 40 + 1), 'startOffset': 12, 'endOffset': 87}],
+            'permissions': {'read': [], 'admin': [user_id], 'update': [user_id], 'delete': [user_id]},
+            'created': stamp,
+            'updated': stamp,
+            'totalComments': 0,
+            'archived': False,
+            'deleted': False,
+        })
+    return rows
@@ -0,0 +1,230 @@
+"""
+End-to-end benchmark of the CATCH proxy: drives the annotation_store views with the catch
+backend against the stand-in database in benchmarks.catch_server, and reports latency
+percentiles and throughput.
+
+The stand-in runs in a child process so it doesn't compete with the proxy for the GIL.
+Each request goes through the view, AnnotationStore and CatchStoreBackend exactly as in
+production, including the HTTP round trip to the database. The LTI session is attached to
+the request directly, so the session and LTI middleware are not measured. Requests are
+made as a course admin without LTI outcome parameters, so create does not queue a grade
+and the benchmark does not touch the database.
+
+    $ python -m benchmarks.catch_proxy --operation search --concurrency 8 --requests 400
+    $ python -m benchmarks.catch_proxy --operation mixed --latency 20 --jitter 30 --failure-rate 0.01
+
+Use --catch-url to benchmark against an already running database (e.g. the stand-in
+started with python -m benchmarks.catch_server, or a staging CATCH) instead.
+"""
+from optparse import OptionParser
+import itertools
+import json
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from benchmarks import setup_django
+from benchmarks.catch_server import add_server_options, server_arguments
+
+CONTEXT_ID = 'course-v1:HarvardX+HDS3221.2x+2016'
+OPERATIONS = ('search', 'create', 'update', 'delete')
+
+
+def percentile(sorted_values, pct):
+    '''Nearest-rank percentile of an already sorted list.'''
+    if not sorted_values:
+        return 0.0
+    rank = int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1
+    return sorted_values[min(max(rank, 0), len(sorted_values) - 1)]
+
+
+class ProxyClient(object):
+    '''
+    Builds requests for the annotation_store views and calls the views directly.
+    '''
+    def __init__(self, search_limit):
+        from django.test.client import RequestFactory
+        from hx_lti_initializer.utils import retrieve_token
+        from annotation_store import views
+        self.views = views
+        self.factory = RequestFactory()
+        self.search_limit = search_limit
+        self.session = {
+            'hx_context_id': CONTEXT_ID,
+            'hx_user_id': 'benchmark-admin',
+            'hx_collection_id': 'assignment-0',
+            'hx_object_id': '1',
+            'is_staff': True,
+        }
+        self.token = retrieve_token('benchmark-admin', 'apikey', 'secret')
+        self.created = []
+        self.created_lock = threading.Lock()
+
+    def _request(self, method, path, data=None, params=None):
+        headers = {'HTTP_X_ANNOTATOR_AUTH_TOKEN': self.token, 'HTTP_ACCEPT_ENCODING': 'gzip, deflate'}
+        if method == 'get':
+            request = self.factory.get(path, data=params, **headers)
+        else:
+            request = getattr(self.factory, method)(path, data=json.dumps(data), content_type='application/json', **headers)
+        request.LTI = self.session
+        return request
+
+    def _annotation(self):
+        return {
+            'contextId': CONTEXT_ID,
+            'collectionId': 'assignment-0',
+            'uri': '1',
+            'media': 'text',
+            'user': {'id': 'benchmark-admin', 'name': 'Benchmark Admin'},
+            'text': '<p>benchmark annotation</p>',
+            'quote': 'quoted text',
+            'tags': ['benchmark'],
+            'parent': '0',
+            'permissions': {'read': [], 'admin': [], 'update': [], 'delete': []},
+            'ranges': [{'start': '/p[1]', 'end': '/p[1]', 'startOffset': 0, 'endOffset': 11}],
+        }
+
+    def _take_created(self):
+        with self.created_lock:
+            return self.created.pop() if self.created else None
+
+    def search(self):
+        params = {'contextId': CONTEXT_ID, 'limit': self.search_limit, 'offset': 0}
+        return self.views.search(self._request('get', '/annotation_store/api/search', params=params))
+
+    def create(self):
+        response = self.views.create(self._request('post', '/annotation_store/api/create', data=self._annotation()))
+        if response.status_code == 200:
+            with self.created_lock:
+                self.created.append(json.loads(response.content)['id'])
+        return response
+
+    def update(self):
+        annotation_id = self._take_created()
+        if annotation_id is None:
+            return self.create()
+        data = dict(self._annotation(), id=annotation_id, text='<p>updated</p>')
+        response = self.views.update(self._request('put', '/annotation_store/api/update/%s' % annotation_id, data=data), annotation_id)
+        with self.created_lock:
+            self.created.append(annotation_id)
+        return response
+
+    def delete(self):
+        annotation_id = self._take_created()
+        if annotation_id is None:
+            return self.create()
+        return self.views.delete(self._request('delete', '/annotation_store/api/delete/%s' % annotation_id), annotation_id)
+
+
+def start_server(options):
+    '''
+    Starts the stand-in database in a child process and waits until it accepts connections.
+    '''
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    process = subprocess.Popen([sys.executable, '-m', 'benchmarks.catch_server', '--port', str(port)] + server_arguments(options),
+                               stdout=subprocess.PIPE)
+    print process.stdout.readline().strip()
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, 'http://127.0.0.1:%d' % port
+        except socket.error:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("stand-in CATCH database did not start on port %d" % port)
+
+
+def run(client, operations, total, concurrency):
+    '''
+    Issues `total` requests from `concurrency` threads, cycling through `operations`.
+    Returns (wall seconds, {operation: [latency seconds]}, {status code: count}).
+    '''
+    counter = itertools.count()
+    latencies = dict((op, []) for op in operations)
+    statuses = {}
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            n = next(counter)
+            if n >= total:
+                return
+            op = operations[n % len(operations)]
+            start = time.time()
+            try:
+                status = getattr(client, op)().status_code
+            except Exception as e:
+                status = e.__class__.__name__
+            elapsed = time.time() - start
+            with lock:
+                latencies[op].append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - start, latencies, statuses
+
+
+def print_results(wall, latencies, statuses, concurrency):
+    print "%-10s %8s %10s %10s %10s %10s" % ('operation', 'requests', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms')
+    everything = []
+    for op, values in sorted(latencies.items()):
+        values.sort()
+        everything.extend(values)
+        if values:
+            print "%-10s %8d %10.2f %10.2f %10.2f %10.2f" % (op, len(values), percentile(values, 50) * 1000,
+                percentile(values, 95) * 1000, percentile(values, 99) * 1000, values[-1] * 1000)
+    everything.sort()
+    print "%-10s %8d %10.2f %10.2f %10.2f %10.2f" % ('all', len(everything), percentile(everything, 50) * 1000,
+        percentile(everything, 95) * 1000, percentile(everything, 99) * 1000, everything[-1] * 1000 if everything else 0)
+    print "concurrency %d: %.1f requests/s over %.2f s" % (concurrency, len(everything) / wall, wall)
+    print "responses: %s" % ', '.join('%s=%d' % item for item in sorted(statuses.items()))
+
+
+def main():
+    parser = add_server_options(OptionParser(usage='python -m benchmarks.catch_proxy [options]'))
+    parser.add_option('--catch-url', default=None, help='use this database instead of starting the stand-in')
+    parser.add_option('--operation', default='search', choices=OPERATIONS + ('mixed',),
+                      help='search, create, update, delete, or mixed (all four in turn)')
+    parser.add_option('--requests', type='int', default=400, help='total requests to send')
+    parser.add_option('--concurrency', type='int', default=8, help='requests in flight at once')
+    parser.add_option('--search-limit', type='int', default=20, help='limit sent with each search (-1 for all rows)')
+    parser.add_option('--warmup', type='int', default=20, help='requests to send before measuring')
+    options, args = parser.parse_args()
+
+    setup_django()
+    from annotation_store import store
+    from annotation_store.store import AnnotationStore
+
+    process = None
+    if options.catch_url:
+        store.ANNOTATION_DB_URL = options.catch_url
+    else:
+        process, store.ANNOTATION_DB_URL = start_server(options)
+    AnnotationStore.update_settings(dict(AnnotationStore.SETTINGS, backend='catch'))
+
+    operations = OPERATIONS if options.operation == 'mixed' else (options.operation,)
+    client = ProxyClient(options.search_limit)
+    try:
+        if options.warmup:
+            run(client, operations, options.warmup, options.concurrency)
+        wall, latencies, statuses = run(client, operations, options.requests, options.concurrency)
+        print_results(wall, latencies, statuses, options.concurrency)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
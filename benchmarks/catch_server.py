@@ -0,0 +1,348 @@
+"""
+A stand-in for the CATCH annotation database, for exercising CatchStoreBackend locally.
+
+Implements the endpoints the tool uses with the same JSON shapes as CATCH:
+
+    GET    /search           -> {"total": n, "limit": l, "offset": o, "size": k, "rows": [...]}
+    GET    /read/<id>        -> the annotation
+    POST   /create           -> the created annotation, with "id", "created" and "updated" set
+    POST   /update/<id>      -> the updated annotation (PUT is also accepted)
+    DELETE /delete/<id>      -> 204 No Content
+
+Annotations are kept in memory. Requests without an x-annotator-auth-token header are
+rejected with 401. Search supports the filters the tool sends (contextId, collectionId, uri,
+media, userid, username, parentid, tag, text, quote) plus limit and offset, where limit=-1
+returns every match. Search results are gzipped when the client accepts it, like CATCH
+behind its web server.
+
+Latency and failures can be injected on every request:
+
+    --latency MS        base delay added to each response
+    --jitter MS         extra random delay, uniformly distributed in [0, MS]
+    --row-latency MS    extra delay for each row a search returns, standing in for the time
+                        CATCH spends querying and serializing annotations
+    --failure-rate P    fraction of requests that get a 500 response
+    --stall-rate P      fraction of requests that are delayed by --stall seconds, which is
+                        longer than the proxy's request timeout by default
+
+Run it on its own and point annotation_database_url at it:
+
+    $ python -m benchmarks.catch_server --port 8001 --rows 5000 --latency 20 --jitter 30
+
+or start it in-process with CatchServer(...).start(). benchmarks.catch_proxy runs it in a
+separate process so that it doesn't compete with the proxy for the GIL.
+"""
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from optparse import OptionParser
+import collections
+import datetime
+import gzip
+import io
+import itertools
+import json
+import random
+import re
+import sys
+import threading
+import time
+import urlparse
+
+from benchmarks import make_annotations
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f+00:00'
+
+
+def now():
+    return datetime.datetime.utcnow().strftime(DATE_FORMAT)
+
+
+class AnnotationDatabase(object):
+    '''
+    Thread-safe in-memory annotation storage that answers CATCH-style queries.
+    '''
+    filters = {
+        'contextId': lambda row, value: row.get('contextId') == value,
+        'collectionId': lambda row, value: row.get('collectionId') == value,
+        'uri': lambda row, value: row.get('uri') == value,
+        'media': lambda row, value: row.get('media') == value,
+        'userid': lambda row, value: row.get('user', {}).get('id') == value,
+        'username': lambda row, value: value.lower() in row.get('user', {}).get('name', '').lower(),
+        'parentid': lambda row, value: row.get('parent', '0') == value,
+        'tag': lambda row, value: value.lower() in [tag.lower() for tag in row.get('tags', [])],
+        'text': lambda row, value: value.lower() in row.get('text', '').lower(),
+        'quote': lambda row, value: value.lower() in row.get('quote', '').lower(),
+        # dates are given as "%Y-%m-%dT%H:%M:%S %Z", which compare as strings with the rows' ISO dates
+        'dateCreatedOnOrAfter': lambda row, value: row.get('created', '')[:19] >= value[:19],
+        'dateCreatedOnOrBefore': lambda row, value: row.get('created', '')[:19] <= value[:19],
+    }
+
+    indexed = {
+        'contextId': lambda row: row.get('contextId'),
+        'collectionId': lambda row: row.get('collectionId'),
+        'uri': lambda row: row.get('uri'),
+        'userid': lambda row: row.get('user', {}).get('id'),
+    }
+
+    def __init__(self, rows=None):
+        self.lock = threading.Lock()
+        self.rows = collections.OrderedDict() # in id order, so search can return newest first without sorting
+        self.indexes = dict((name, {}) for name in self.indexed)
+        self.next_id = 1
+        for row in sorted(rows or [], key=lambda row: row['id']):
+            self._add(row)
+            self.next_id = max(self.next_id, row['id'] + 1)
+
+    def _add(self, row):
+        self.rows[row['id']] = row
+        for name, key in self.indexed.iteritems():
+            self.indexes[name].setdefault(key(row), collections.OrderedDict())[row['id']] = row
+
+    def _remove(self, row):
+        for name, key in self.indexed.iteritems():
+            self.indexes[name].get(key(row), {}).pop(row['id'], None)
+        return self.rows.pop(row['id'])
+
+    def search(self, params):
+        limit = int(params.get('limit', 20))
+        offset = int(params.get('offset', 0))
+        params = dict((name, value) for name, value in params.items() if name in self.filters and value != '')
+
+        with self.lock:
+            # Start from the smallest index bucket among the equality filters, so that the common
+            # contextId/collectionId/uri searches don't scan every annotation.
+            candidates, indexed_by = self.rows, None
+            for name in params:
+                if name in self.indexes:
+                    bucket = self.indexes[name].get(params[name], {})
+                    if len(bucket) < len(candidates) or indexed_by is None:
+                        candidates, indexed_by = bucket, name
+            matchers = [(self.filters[name], value) for name, value in params.items() if name != indexed_by]
+            newest_first = (candidates[row_id] for row_id in reversed(candidates))
+            if matchers:
+                rows = [row for row in newest_first if all(match(row, value) for match, value in matchers)]
+                total = len(rows)
+                selected = rows[offset:] if limit < 0 else rows[offset:offset + limit]
+            else:
+                total = len(candidates)
+                selected = list(itertools.islice(newest_first, offset, None if limit < 0 else offset + limit))
+
+        return {'total': total, 'limit': limit, 'offset': offset, 'size': len(selected), 'rows': selected}
+
+    def create(self, data):
+        with self.lock:
+            data['id'] = self.next_id
+            self.next_id += 1
+            data['created'] = data['updated'] = now()
+            data.setdefault('totalComments', 0)
+            self._add(data)
+        return data
+
+    def read(self, annotation_id):
+        with self.lock:
+            return self.rows.get(annotation_id)
+
+    def update(self, annotation_id, data):
+        with self.lock:
+            if annotation_id not in self.rows:
+                return None
+            row = self._remove(self.rows[annotation_id])
+            row.update(data)
+            row['id'] = annotation_id
+            row['updated'] = now()
+            self._add(row)
+        return row
+
+    def delete(self, annotation_id):
+        with self.lock:
+            if annotation_id not in self.rows:
+                return None
+            return self._remove(self.rows[annotation_id])
+
+
+class CatchRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    routes = (
+        ('GET', re.compile(r'^/search/?$'), 'search'),
+        ('GET', re.compile(r'^/read/(\d+)/?$'), 'read'),
+        ('POST', re.compile(r'^/create/?$'), 'create'),
+        ('POST', re.compile(r'^/update/(\d+)/?$'), 'update'),
+        ('PUT', re.compile(r'^/update/(\d+)/?$'), 'update'),
+        ('DELETE', re.compile(r'^/delete/(\d+)/?$'), 'delete'),
+    )
+
+    def do_GET(self):
+        self.dispatch()
+
+    def do_POST(self):
+        self.dispatch()
+
+    def do_PUT(self):
+        self.dispatch()
+
+    def do_DELETE(self):
+        self.dispatch()
+
+    def dispatch(self):
+        url = urlparse.urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get('content-length', 0) or 0))
+        self.server.inject_latency()
+        if self.server.inject_failure():
+            return self.respond(500, {'error': 'injected failure'})
+        if not self.headers.get('x-annotator-auth-token'):
+            return self.respond(401, {'error': 'missing x-annotator-auth-token'})
+
+        for method, pattern, action in self.routes:
+            match = pattern.match(url.path)
+            if method == self.command and match:
+                break
+        else:
+            return self.respond(404, {'error': 'not found'})
+
+        db = self.server.db
+        if action == 'search':
+            params = dict(urlparse.parse_qsl(url.query))
+            results = db.search(params)
+            if self.server.row_latency:
+                time.sleep(self.server.row_latency * results['size'])
+            return self.respond(200, results, compress=True)
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            return self.respond(400, {'error': 'invalid json'})
+        if action == 'create':
+            return self.respond(200, db.create(data))
+
+        annotation_id = int(match.group(1))
+        if action == 'read':
+            result = db.read(annotation_id)
+        elif action == 'update':
+            result = db.update(annotation_id, data)
+        else:
+            result = db.delete(annotation_id)
+        if result is None:
+            return self.respond(404, {'error': 'annotation %s not found' % annotation_id})
+        if action == 'delete':
+            return self.respond(204, None)
+        return self.respond(200, result)
+
+    def respond(self, status, data, compress=False):
+        content = json.dumps(data) if data is not None else ''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if compress and self.server.gzip and 'gzip' in self.headers.get('accept-encoding', ''):
+            buf = io.BytesIO()
+            with gzip.GzipFile(mode='wb', compresslevel=6, fileobj=buf) as f:
+                f.write(content)
+            content = buf.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class CatchServer(ThreadingMixIn, HTTPServer):
+    '''
+    Threaded HTTP server for the stand-in database. Use port 0 to pick a free port.
+    '''
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128 # the default of 5 drops connections under concurrent load
+
+    def __init__(self, host='127.0.0.1', port=0, rows=None, latency=0, jitter=0, failure_rate=0.0,
+                 stall_rate=0.0, stall=11.0, gzip=True, verbose=False, seed=None, row_latency=0):
+        HTTPServer.__init__(self, (host, port), CatchRequestHandler)
+        self.db = AnnotationDatabase(rows)
+        self.latency = latency / 1000.0
+        self.jitter = jitter / 1000.0
+        self.row_latency = row_latency / 1000.0
+        self.failure_rate = failure_rate
+        self.stall_rate = stall_rate
+        self.stall = stall
+        self.gzip = gzip
+        self.verbose = verbose
+        self.random = random.Random(seed)
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def inject_latency(self):
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if self.stall_rate and self.random.random() < self.stall_rate:
+            delay = self.stall
+        if delay > 0:
+            time.sleep(delay)
+
+    def inject_failure(self):
+        return self.failure_rate > 0 and self.random.random() < self.failure_rate
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.05}, name='catch-server')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+
+def add_server_options(parser):
+    parser.add_option('--rows', type='int', default=5000, help='annotations to preload (200 students, 25 each by default)')
+    parser.add_option('--latency', type='float', default=0, help='milliseconds added to every response')
+    parser.add_option('--jitter', type='float', default=0, help='up to this many random milliseconds added to every response')
+    parser.add_option('--row-latency', type='float', default=0, help='milliseconds added to a search for each row it returns')
+    parser.add_option('--failure-rate', type='float', default=0.0, help='fraction of requests answered with a 500')
+    parser.add_option('--stall-rate', type='float', default=0.0, help='fraction of requests delayed by --stall seconds')
+    parser.add_option('--stall', type='float', default=11.0, help='seconds to delay stalled requests')
+    parser.add_option('--no-gzip', action='store_false', dest='gzip', default=True, help='never compress search results')
+    parser.add_option('--seed', type='int', default=None, help='random seed for latency and failure injection')
+    return parser
+
+
+def server_arguments(options):
+    '''Returns the command line arguments that reproduce the server options.'''
+    args = ['--rows', options.rows, '--latency', options.latency, '--jitter', options.jitter, '--row-latency', options.row_latency,
+            '--failure-rate', options.failure_rate, '--stall-rate', options.stall_rate, '--stall', options.stall]
+    if not options.gzip:
+        args.append('--no-gzip')
+    if options.seed is not None:
+        args.extend(['--seed', options.seed])
+    return [str(arg) for arg in args]
+
+
+def server_from_options(options, **kwargs):
+    students = 200
+    rows = make_annotations(students=students, per_student=max(1, options.rows // students)) if options.rows else []
+    return CatchServer(rows=rows, latency=options.latency, jitter=options.jitter, failure_rate=options.failure_rate,
+                       stall_rate=options.stall_rate, stall=options.stall, gzip=options.gzip, seed=options.seed,
+                       row_latency=options.row_latency, **kwargs)
+
+
+def main():
+    parser = add_server_options(OptionParser(usage='python -m benchmarks.catch_server [options]'))
+    parser.add_option('--host', default='127.0.0.1')
+    parser.add_option('--port', type='int', default=8001)
+    parser.add_option('--verbose', action='store_true', default=False, help='log every request')
+    options, args = parser.parse_args()
+
+    server = server_from_options(options, host=options.host, port=options.port, verbose=options.verbose)
+    print "Stand-in CATCH database with %d annotations listening on %s" % (len(server.db.rows), server.url)
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
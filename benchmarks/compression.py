@@ -0,0 +1,79 @@
+"""
+Measures gzip on a course-sized annotation search result and instructor dashboard fragment.
+
+The search payload is what the annotation_store search view returns for a course with
+200 students and 25 annotations each; the fragment is dashboard_student_list_view.html
+rendered for the same annotations. Also compares passing a gzipped CATCH response through
+with decoding it and compressing it again.
+
+    $ python -m benchmarks.compression [iterations]
+"""
+import sys
+import timeit
+import zlib
+
+from benchmarks import setup_django, report, make_annotations
+
+
+def sizes(label, content, compressed):
+    print "%-40s %10d bytes -> %8d bytes gzipped (%.1f%%)" % (
+        label, len(content), len(compressed), 100.0 * len(compressed) / len(content))
+
+
+def main(iterations=20):
+    setup_django()
+    import json
+    from django.http import HttpResponse
+    from django.template.loader import render_to_string
+    from django.test.client import RequestFactory
+    from django.utils.text import compress_string
+    from annotationsx.compression import compress_response
+    from hx_lti_initializer.utils import DashboardAnnotation, format_dashboard_date
+
+    rows = make_annotations()
+    search_content = json.dumps({'total': len(rows), 'limit': -1, 'offset': 0, 'rows': rows})
+
+    users = {}
+    for row in rows:
+        user = users.setdefault(row['user']['id'], {'id': row['user']['id'], 'name': row['user']['name'], 'annotations': []})
+        annotation = DashboardAnnotation(
+            row,
+            date=format_dashboard_date(row['updated']),
+            assignment_name='Assignment %s' % row['collectionId'],
+            target_object_name='Target object %s' % row['uri'],
+            target_preview_url='/lti_init/launch_lti/annotation/%s/%s' % (row['collectionId'], row['uri']),
+        )
+        if annotation.parent_id:
+            annotation.set_parent_text('parent annotation text')
+        user['annotations'].append(annotation)
+    for user in users.values():
+        user['total_annotations'] = len(user['annotations'])
+    fragment_content = render_to_string('hx_lti_initializer/dashboard_student_list_view.html', {
+        'user_annotations': sorted(users.values(), key=lambda u: u['id']),
+        'fetch_annotations_time': 0.5,
+    }).encode('utf-8')
+
+    request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+    for label, content in (('search results (%d rows)' % len(rows), search_content), ('dashboard fragment', fragment_content)):
+        sizes(label, content, compress_string(content))
+        seconds = timeit.timeit(lambda: compress_response(request, HttpResponse(content)), number=iterations)
+        report('compress_response: %s' % label.split(' (')[0], seconds, iterations)
+
+    # Passing through an already-gzipped CATCH response vs. decoding and compressing it again.
+    upstream = compress_string(search_content)
+
+    def recompress():
+        compress_response(request, HttpResponse(zlib.decompress(upstream, 16 + zlib.MAX_WBITS)))
+
+    def passthrough():
+        response = HttpResponse(upstream)
+        response['Content-Encoding'] = 'gzip'
+        compress_response(request, response)
+
+    recompress_us = report('catch search: decode + recompress', timeit.timeit(recompress, number=iterations), iterations)
+    passthrough_us = report('catch search: pass through', timeit.timeit(passthrough, number=iterations), iterations)
+    print "saved per search: %.2f ms" % ((recompress_us - passthrough_us) / 1000.0)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
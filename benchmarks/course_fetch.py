@@ -0,0 +1,63 @@
+"""
+Benchmark of fetching a whole course's annotations for the instructor dashboard: one
+limit=-1 search against paged searches with fetch_annotation_pages(), against the stand-in
+database in benchmarks.catch_server running in a child process.
+
+    $ python -m benchmarks.course_fetch --rows 20000 --latency 50 --row-latency 0.1
+    $ python -m benchmarks.course_fetch --page-size 250 --parallelism 8
+    $ python -m benchmarks.course_fetch --filter collectionId=assignment-1 --filter uri=2
+
+Times are wall clock and include decoding the JSON.
+"""
+from optparse import OptionParser
+import time
+
+from benchmarks import setup_django
+from benchmarks.catch_server import add_server_options
+from benchmarks.catch_proxy import CONTEXT_ID, start_server
+
+
+def timed(func, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = add_server_options(OptionParser(usage='python -m benchmarks.course_fetch [options]'))
+    parser.add_option('--catch-url', default=None, help='use this database instead of starting the stand-in')
+    parser.add_option('--page-size', type='int', action='append', default=[], help='page sizes to try (repeatable)')
+    parser.add_option('--parallelism', type='int', default=4, help='page requests in flight at once')
+    parser.add_option('--repeat', type='int', default=3, help='runs of each fetch, the best is reported')
+    parser.add_option('--filter', action='append', default=[], help='name=value search filter for the paged fetches (repeatable)')
+    options, args = parser.parse_args()
+    filters = dict(f.split('=', 1) for f in options.filter)
+
+    setup_django()
+    from hx_lti_initializer.utils import _fetch_annotations_by_course, fetch_annotation_pages
+
+    process, url = None, options.catch_url
+    if url is None:
+        process, url = start_server(options)
+    try:
+        seconds, page = timed(lambda: _fetch_annotations_by_course(CONTEXT_ID, url, 'token', limit=-1, timeout=60), options.repeat)
+        print "%-28s %8d rows %8.3f s" % ('limit=-1, one request', len(page.rows), seconds)
+        for page_size in options.page_size or [100, 500, 1000]:
+            seconds, results = timed(lambda: fetch_annotation_pages(CONTEXT_ID, [(url, 'token')], page_size=page_size,
+                                                                    parallelism=options.parallelism, filters=filters), options.repeat)
+            elapsed = [page.elapsed for page in results['pages']]
+            print "%-28s %8d rows %8.3f s %4d pages, slowest %.3f s, %d failed" % (
+                'page_size=%d, parallelism=%d' % (page_size, options.parallelism), len(results['rows']), seconds,
+                len(elapsed), max(elapsed), results['errors'])
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
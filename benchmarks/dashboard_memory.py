@@ -0,0 +1,133 @@
+"""
+Compares the memory held by the instructor dashboard for a course's annotations: the
+per-row dicts it used to build (the rows, a dict keyed by id, per-user lists and a view
+dict copying each annotation as "data") against the DashboardAnnotation records that
+DashboardAnnotations builds now, once the rows are released.
+
+    $ python -m benchmarks.dashboard_memory --rows 200000
+
+Each representation is built in a child process from the same decoded search response.
+"held" is the size of everything reachable from what the template renders (including the
+rows while they are still referenced), and "peak rss" is the child's peak resident size.
+This benchmark creates a throwaway test database for the course's assignments and targets.
+"""
+from multiprocessing import Process, Queue
+from optparse import OptionParser
+import gc
+import json
+import resource
+import sys
+import time
+
+from benchmarks import setup_django, make_annotations
+from benchmarks.catch_proxy import CONTEXT_ID
+
+
+def deep_size(root):
+    seen, stack, total = set(), [root], 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.iterkeys())
+            stack.extend(obj.itervalues())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif hasattr(obj, '__slots__'):
+            stack.extend(getattr(obj, name) for name in obj.__slots__ if hasattr(obj, name))
+        elif hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+    return total
+
+
+def dict_per_row(rows, dashboard):
+    """
+    The structures the dashboard used to keep: the rows, the rows keyed by id and by user,
+    and a view dict for each row that refers to the whole annotation.
+    """
+    annotation_by_id = dict((r['id'], r) for r in rows)
+    annotations_by_user = {}
+    for r in rows:
+        annotations_by_user.setdefault(r['user']['id'], []).append(r)
+    users = []
+    for user_id, user_rows in sorted(annotations_by_user.iteritems()):
+        annotations = []
+        for r in user_rows:
+            parent = annotation_by_id.get(int(r['parent'])) if r['parent'] != '0' else None
+            annotations.append({
+                'data': r,
+                'assignment_name': dashboard.get_assignment_name(r),
+                'target_preview_url': dashboard.get_target_preview_url(r),
+                'target_object_name': dashboard.get_target_object_name(r),
+                'parent_text': parent['text'] if parent else None,
+            })
+        users.append({'id': user_id, 'name': user_rows[0]['user']['name'], 'annotations': annotations,
+                      'total_annotations': len(annotations)})
+    return {'rows': rows, 'annotation_by_id': annotation_by_id, 'annotations_by_user': annotations_by_user, 'users': users}
+
+
+def measure(representation, payload, results):
+    from hx_lti_initializer.utils import DashboardAnnotations
+    course_annotations = json.loads(payload)
+    gc.collect()
+    start = time.time()
+    if representation == 'dict per row':
+        held = dict_per_row(course_annotations['rows'], DashboardAnnotations({'rows': []}, CONTEXT_ID))
+    else:
+        held = DashboardAnnotations(course_annotations, CONTEXT_ID).get_annotations_by_user()
+    elapsed = time.time() - start
+    del course_annotations
+    gc.collect()
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((representation, elapsed, deep_size(held), peak_kb))
+
+
+def main():
+    parser = OptionParser(usage='python -m benchmarks.dashboard_memory [options]')
+    parser.add_option('--rows', type='int', default=50000, help='annotations in the course')
+    parser.add_option('--students', type='int', default=500, help='students in the course')
+    options, args = parser.parse_args()
+
+    setup_django()
+    from django.db import connection
+    from django.contrib.auth.models import User
+    from hx_lti_initializer.models import LTICourse, LTIProfile
+    from hx_lti_assignment.models import Assignment, AssignmentTargets
+    from target_object_database.models import TargetObject
+
+    test_database = connection.creation.create_test_db(verbosity=0)
+    try:
+        user = User.objects.create(username='instructor')
+        course = LTICourse.create_course(CONTEXT_ID, LTIProfile.objects.create(user=user, anon_id='instructor', name='Prof'))
+        targets = [TargetObject.objects.create(target_title='Source %d' % n, target_author='Author', target_content='Text ' * 1000,
+                                               target_type='tx') for n in range(10)]
+        for n in range(5):
+            assignment = Assignment.objects.create(assignment_id='assignment-%d' % n, assignment_name='Assignment %d' % n,
+                                                   pagination_limit=10, course=course)
+            for order, target in enumerate(targets):
+                AssignmentTargets.objects.create(assignment=assignment, target_object=target, order=order)
+
+        rows = make_annotations(students=options.students, per_student=max(1, options.rows // options.students))
+        for row in rows:
+            row['uri'] = targets[int(row['uri']) - 1].id
+        payload = json.dumps({'rows': rows, 'totalCount': len(rows)})
+        del rows
+
+        print "%d annotations, %d bytes of JSON" % (options.rows, len(payload))
+        for representation in ('dict per row', 'records'):
+            results = Queue()
+            process = Process(target=measure, args=(representation, payload, results))
+            process.start()
+            representation, elapsed, held, peak_kb = results.get()
+            process.join()
+            print "%-14s built in %6.3f s, held %8.1f MB, peak rss %8.1f MB" % (
+                representation, elapsed, held / 1048576.0, peak_kb / 1024.0)
+    finally:
+        connection.creation.destroy_test_db(test_database, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Times building and rendering the instructor dashboard's student list for a synthetic
+course: DashboardAnnotations over the rows, then dashboard_student_list_view.html.
+
+    $ python -m benchmarks.dashboard_render --rows 50000
+
+This benchmark creates a throwaway test database for the course's assignments and targets.
+"""
+from optparse import OptionParser
+import time
+
+from benchmarks import setup_django, make_annotations
+from benchmarks.catch_proxy import CONTEXT_ID
+
+
+def best_of(func, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = OptionParser(usage='python -m benchmarks.dashboard_render [options]')
+    parser.add_option('--rows', type='int', default=50000, help='annotations in the course')
+    parser.add_option('--students', type='int', default=500, help='students in the course')
+    parser.add_option('--repeat', type='int', default=3, help='runs of each step, the best is reported')
+    options, args = parser.parse_args()
+
+    setup_django()
+    from django.db import connection
+    from django.contrib.auth.models import User
+    from django.template.loader import render_to_string
+    from hx_lti_initializer.models import LTICourse, LTIProfile
+    from hx_lti_initializer.utils import DashboardAnnotations
+    from hx_lti_assignment.models import Assignment, AssignmentTargets
+    from target_object_database.models import TargetObject
+
+    test_database = connection.creation.create_test_db(verbosity=0)
+    try:
+        user = User.objects.create(username='instructor')
+        course = LTICourse.create_course(CONTEXT_ID, LTIProfile.objects.create(user=user, anon_id='instructor', name='Prof'))
+        targets = [TargetObject.objects.create(target_title='Source %d' % n, target_author='Author', target_content='Text',
+                                               target_type='tx') for n in range(10)]
+        for n in range(5):
+            assignment = Assignment.objects.create(assignment_id='assignment-%d' % n, assignment_name='Assignment %d' % n,
+                                                   pagination_limit=10, course=course)
+            for order, target in enumerate(targets):
+                AssignmentTargets.objects.create(assignment=assignment, target_object=target, order=order)
+
+        rows = make_annotations(students=options.students, per_student=max(1, options.rows // options.students))
+        for row in rows:
+            row['uri'] = targets[int(row['uri']) - 1].id
+        course_annotations = {'rows': rows, 'totalCount': len(rows)}
+
+        build_seconds, users = best_of(lambda: DashboardAnnotations(course_annotations, CONTEXT_ID).get_annotations_by_user(),
+                                       options.repeat)
+        context = {'user_annotations': users, 'fetch_annotations_time': 0, 'fetch_annotations_pages': 1,
+                   'fetch_annotations_slowest_page': 0, 'fetch_annotations_errors': 0}
+        render_seconds, content = best_of(lambda: render_to_string('hx_lti_initializer/dashboard_student_list_view.html', context),
+                                          options.repeat)
+        print "%d annotations of %d students" % (len(rows), options.students)
+        print "%-24s %8.3f s" % ('DashboardAnnotations', build_seconds)
+        print "%-24s %8.3f s %10d bytes" % ('render student list', render_seconds, len(content))
+        print "%-24s %8.3f s" % ('total', build_seconds + render_seconds)
+    finally:
+        connection.creation.destroy_test_db(test_database, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
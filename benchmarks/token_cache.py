@@ -0,0 +1,40 @@
+"""
+Compares signing a new annotation database token on every request with reusing a cached token.
+
+This is the cost paid by access_annotation_target on every page render, by the admin
+before_search() on every search, and once per credential when fetching course annotations.
+
+    $ python -m benchmarks.token_cache [iterations]
+"""
+import sys
+import timeit
+
+from benchmarks import setup_django, report
+
+
+def main(iterations=20000):
+    setup_django()
+    from hx_lti_initializer.utils import retrieve_token, TokenCache
+    import hx_lti_initializer.utils as utils
+
+    apikey, secret = '49a70e80-3c06-11e7-a919-92ebcb67fe33', 'bd79cd1c-3c06-11e7-a919-92ebcb67fe33'
+    users = ['user%d' % i for i in range(100)]
+
+    def uncached():
+        for user_id in users:
+            retrieve_token(user_id, apikey, secret, use_cache=False)
+
+    def cached():
+        for user_id in users:
+            retrieve_token(user_id, apikey, secret)
+
+    utils.token_cache = TokenCache(max_size=len(users))
+    loops = max(1, iterations // len(users))
+    uncached_us = report('retrieve_token (sign every call)', timeit.timeit(uncached, number=loops), loops * len(users))
+    cached_us = report('retrieve_token (token cache)', timeit.timeit(cached, number=loops), loops * len(users))
+    print "saved per request: %.2f us (%.1fx faster), cache hits=%d misses=%d" % (
+        uncached_us - cached_us, uncached_us / cached_us, utils.token_cache.hits, utils.token_cache.misses)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -1,6 +1,12 @@
+from django.core.cache import cache
 from django.db import models
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
 from target_object_database.models import TargetObject
-from hx_lti_initializer.models import LTICourse
+from hx_lti_initializer.models import LAUNCH_CACHE_TIMEOUT, LTICourse
+from annotationsx import metrics
+import hashlib
+import time
 import uuid
 import sys
 
@@ -55,59 +61,55 @@ class AssignmentTargets(models.Model):
             return []
         return self.target_external_options.split(',')    
 
-    def get_view_type_for_mirador(self):
+    @property
+    def config(self):
         """
+        The target_external_options, parsed once per instance.
         """
-        options = self.get_target_external_options_list()
-        if len(options) == 1:
-            return "ImageView"
-        else:
-            return options[0] if options[0] != '' else "ImageView"
+        if getattr(self, '_config', None) is None:
+            self._config = TargetConfig(self.target_external_options)
+        return self._config
+
+    def get_view_type_for_mirador(self):
+        return self.config.view_type
 
     def get_canvas_id_for_mirador(self):
-        """
-        """
-        options = self.get_target_external_options_list()
-        if len(options) == 1:
-            return None
-        else:
-            return options[1] if options[1] != '' else None
+        return self.config.canvas_id
 
     def get_dashboard_hidden(self):
-        """
-        """
-        options = self.get_target_external_options_list()
-        if len(options) < 3:
-            return "false"
-        else:
-            return options[2] if options[2] != '' else "false"
+        return self.config.dashboard_hidden
 
     def get_transcript_hidden(self):
-        """
-        """
-        options = self.get_target_external_options_list()
-        if len(options) < 4:
-            return "false"
-        else:
-            return options[3] if options[3] != '' else "false"
+        return self.config.transcript_hidden
 
     def get_transcript_download(self):
-        """
-        """
-        options = self.get_target_external_options_list()
-        if len(options) < 5:
-            return "false"
-        else:
-            return options[4] if options[4] != '' else "false"
+        return self.config.transcript_download
 
     def get_video_download(self):
-        """
-        """
-        options = self.get_target_external_options_list()
-        if len(options) < 6:
-            return "false"
-        else:
-            return options[5] if options[5] != '' else "false"
+        return self.config.video_download
+
+
+class TargetConfig(object):
+    """
+    The settings of a source in an assignment, saved in target_external_options as
+    "view type,canvas id,dashboard hidden,transcript hidden,transcript download,video download".
+    Missing or empty values take their default; the flags stay the "true"/"false" strings
+    that the templates pass on to the javascript.
+    """
+    def __init__(self, target_external_options):
+        options = (target_external_options or '').split(',')
+
+        def option(index, default):
+            return options[index] if len(options) > index and options[index] != '' else default
+
+        # a single value is not a view type, but the options of a text or video
+        self.view_type = option(0, "ImageView") if len(options) > 1 else "ImageView"
+        self.canvas_id = option(1, None)
+        self.dashboard_hidden = option(2, "false")
+        self.transcript_hidden = option(3, "false")
+        self.transcript_download = option(4, "false")
+        self.video_download = option(5, "false")
+
 
 class Assignment(models.Model):
     """
@@ -191,45 +193,38 @@ class Assignment(models.Model):
     def __unicode__(self):
         return u"%s" % self.assignment_name
 
+    def navigation(self):
+        """
+        Returns the AssignmentNavigation of this assignment's sources, from the cache when
+        it's there. Editing the assignment's sources drops it from the cache, but other workers
+        only see the edit once their copy expires unless CACHES is a shared backend, which is
+        why LAUNCH_CACHE_TIMEOUT defaults to a minute.
+        """
+        key = _assignment_navigation_key(self.pk)
+        navigation = cache.get(key)
+        metrics.CACHE_REQUESTS.inc(cache='assignment_navigation', result='miss' if navigation is None else 'hit')
+        if navigation is None:
+            navigation = AssignmentNavigation(
+                AssignmentTargets.objects.filter(assignment=self).order_by('order', 'id').values_list('target_object_id', flat=True)
+            )
+            cache.set(key, navigation, LAUNCH_CACHE_TIMEOUT)
+        return navigation
+
     def object_before(self, id):
-        if len(self.assignment_objects.all()) > 1:
-            try:
-                obj = TargetObject.objects.get(pk=id)
-                assignment_target = AssignmentTargets.objects.get(
-                    assignment=self,
-                    target_object=obj
-                )
-                if assignment_target.order == 1:
-                    return None
-                else:
-                    new_order = assignment_target.order-1
-                    return AssignmentTargets.objects.get(
-                        assignment=self,
-                        order=new_order
-                    )
-            except:
-                return None
-        return None
+        return self._object_at_offset(id, -1)
 
     def object_after(self, id):
-        if len(self.assignment_objects.all()) > 1:
-            try:
-                obj = TargetObject.objects.get(pk=id)
-                assignment_target = AssignmentTargets.objects.get(
-                    assignment=self,
-                    target_object=obj
-                )
-                if assignment_target.order == len(self.assignment_objects.all()):  # noqa
-                    return None
-                else:
-                    new_order = assignment_target.order+1
-                    return AssignmentTargets.objects.get(
-                        assignment=self,
-                        order=new_order
-                    )
-            except:
-                return None
-        return None
+        return self._object_at_offset(id, 1)
+
+    def _object_at_offset(self, id, offset):
+        """
+        Returns the AssignmentTargets that comes offset places after the source with the
+        given id in this assignment, with its source, or None.
+        """
+        object_id = self.navigation().neighbour(id, offset)
+        if object_id is None:
+            return None
+        return AssignmentTargets.objects.select_related('target_object').filter(assignment=self, target_object_id=object_id).first()
 
     def array_of_tags(self):
         def getColorValues(color):
@@ -279,3 +274,96 @@ class Assignment(models.Model):
                     res = col.split(';')
                 result.append((res[0], getColorValues(res[1])))
             return result
+
+
+class AssignmentNavigation(object):
+    """
+    The ids of an assignment's sources in order, to find where a source is and which
+    ones come before and after it without going to the database.
+    """
+    def __init__(self, object_ids):
+        self.object_ids = list(object_ids)
+        self.positions = dict((object_id, index) for index, object_id in reversed(list(enumerate(self.object_ids))))
+
+    def __len__(self):
+        return len(self.object_ids)
+
+    def _index(self, object_id):
+        try:
+            return self.positions.get(int(object_id))
+        except (TypeError, ValueError):
+            return None
+
+    def position(self, object_id):
+        """
+        Returns the position of the source in the assignment, counting from 1, or None.
+        """
+        index = self._index(object_id)
+        return None if index is None else index + 1
+
+    def neighbour(self, object_id, offset):
+        """
+        Returns the id of the source offset places after the given one, or None.
+        """
+        index = self._index(object_id)
+        if index is None or not 0 <= index + offset < len(self.object_ids):
+            return None
+        return self.object_ids[index + offset]
+
+    def previous(self, object_id):
+        return self.neighbour(object_id, -1)
+
+    def next(self, object_id):
+        return self.neighbour(object_id, 1)
+
+
+def _assignment_navigation_key(assignment_pk):
+    return 'assignment_navigation:%s' % assignment_pk
+
+
+def invalidate_assignment_navigation(assignment_pks):
+    cache.delete_many([_assignment_navigation_key(pk) for pk in set(assignment_pks)])
+
+
+def _course_reference_version_key(course_id):
+    return 'course_reference_version:%s' % hashlib.md5(course_id.encode('utf-8')).hexdigest()
+
+
+def course_reference_version(course_id):
+    """
+    Returns the version of the assignment and source names cached for a course, which
+    changes whenever one of its assignments or sources is edited. The first version is
+    taken from the clock so that it doesn't reuse the key of an entry that was evicted.
+    """
+    key = _course_reference_version_key(course_id)
+    cache.add(key, int(time.time() * 1000))
+    return cache.get(key)
+
+
+def invalidate_course_reference(course_ids):
+    for course_id in set(course_ids):
+        try:
+            cache.incr(_course_reference_version_key(course_id))
+        except ValueError:
+            pass  # nothing has been cached for the course
+
+
+@receiver(post_save, sender=Assignment)
+@receiver(post_delete, sender=Assignment)
+def assignment_changed(sender, instance, **kwargs):
+    invalidate_assignment_navigation([instance.pk])
+    invalidate_course_reference(LTICourse.objects.filter(pk=instance.course_id).values_list('course_id', flat=True))
+
+
+@receiver(post_save, sender=AssignmentTargets)
+@receiver(post_delete, sender=AssignmentTargets)
+def assignment_target_changed(sender, instance, **kwargs):
+    invalidate_assignment_navigation([instance.assignment_id])
+    invalidate_course_reference(Assignment.objects.filter(pk=instance.assignment_id).values_list('course__course_id', flat=True))
+
+
+@receiver(post_save, sender=TargetObject)
+@receiver(pre_delete, sender=TargetObject)
+def target_object_changed(sender, instance, **kwargs):
+    # pre_delete, since the source's links to its assignments are deleted along with it
+    invalidate_course_reference(Assignment.objects.filter(assignment_objects=instance).values_list('course__course_id', flat=True))
@@ -1,5 +1,9 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
-from hx_lti_assignment.models import Assignment
+from hx_lti_assignment.models import Assignment, AssignmentTargets, TargetConfig
+from hx_lti_initializer.models import LTICourse, LTIProfile
+from target_object_database.models import TargetObject
 
 
 class AssignmentTests(TestCase):
@@ -28,3 +32,47 @@ class AssignmentTests(TestCase):
         self.assertEqual(self.assignment.assignment_name, "Assignment One")
         self.assertEqual(self.assignment.__str__(), "Assignment One")
         self.assertEqual(self.assignment.assignment_name, self.assignment.__str__())  # noqa
+
+
+class AssignmentNavigationTests(TestCase):
+    """
+    """
+    def setUp(self):
+        cache.clear()
+        profile = LTIProfile.objects.create(user=User.objects.create(username='instructor'), anon_id='instructor')
+        course = LTICourse.create_course('course', profile)
+        self.assignment = Assignment.objects.create(assignment_name='Assignment', pagination_limit=10, course=course)
+        self.targets = [
+            TargetObject.objects.create(target_title='Source %d' % i, target_author='Author', target_content='Content', target_type='tx')
+            for i in range(3)
+        ]
+        for order, target in enumerate(self.targets):
+            AssignmentTargets.objects.create(assignment=self.assignment, target_object=target, order=order + 1)
+
+    def test_target_config(self):
+        config = TargetConfig('ImageView,canvas-1,true,,false')
+        self.assertEqual(('ImageView', 'canvas-1', 'true', 'false', 'false', 'false'),
+                         (config.view_type, config.canvas_id, config.dashboard_hidden, config.transcript_hidden,
+                          config.transcript_download, config.video_download))
+        for options in (None, '', 'BookView'):
+            config = TargetConfig(options)
+            self.assertEqual(('ImageView', None, 'false'), (config.view_type, config.canvas_id, config.dashboard_hidden))
+        self.assertEqual('BookView', TargetConfig('BookView,').view_type)
+        self.assertEqual('true', AssignmentTargets(target_external_options=',,,,,true').get_video_download())
+
+    def test_navigation_is_cached_and_invalidated(self):
+        first, second, third = [target.pk for target in self.targets]
+        navigation = self.assignment.navigation()
+        self.assertEqual((3, 2, first, third), (len(navigation), navigation.position(second), navigation.previous(second), navigation.next(second)))
+        self.assertEqual((None, None, None), (navigation.previous(first), navigation.next(third), navigation.position(0)))
+        with self.assertNumQueries(0):
+            self.assertEqual([first, second, third], self.assignment.navigation().object_ids)
+
+        AssignmentTargets.objects.get(target_object_id=first).delete()
+        self.assertEqual([second, third], self.assignment.navigation().object_ids)
+        link = AssignmentTargets.objects.get(target_object_id=third)
+        link.order = 0
+        link.save()
+        self.assertEqual([third, second], self.assignment.navigation().object_ids)
+        self.assertEqual(third, self.assignment.object_before(second).target_object.pk)
+        self.assertIsNone(self.assignment.object_after(second))
@@ -1,5 +1,5 @@
 from hx_lti_assignment.forms import AssignmentForm, AssignmentTargetsForm, AssignmentTargetsFormSet, DeleteAssignmentForm  # noqa
-from hx_lti_assignment.models import Assignment, AssignmentTargets
+from hx_lti_assignment.models import Assignment, AssignmentTargets, invalidate_assignment_navigation, invalidate_course_reference
 from hx_lti_initializer.utils import debug_printer
 from hx_lti_initializer.models import LTICourse
 from django.contrib.auth.decorators import login_required
@@ -271,8 +271,11 @@ def moving_assignment(request, old_course_id, new_course_id, assignment_id):
         for at in aTargets:
             at.pk = None
             at.assignment = assignment
-            at.save()
-            pks.append(str(at.target_object.pk))
+            pks.append(str(at.target_object_id))
+        AssignmentTargets.objects.bulk_create(aTargets)
+        # bulk_create() doesn't send post_save
+        invalidate_course_reference([new_course.course_id])
+        invalidate_assignment_navigation([assignment.pk])
         result.update({'object_ids': pks, 'result': 200})
         data = json.dumps(result)
         return HttpResponse(data, content_type='application/json')
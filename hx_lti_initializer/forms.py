@@ -12,7 +12,10 @@ class CourseForm(forms.ModelForm):
         self.fields['course_admins'].queryset = self.get_course_admins()
 
     def get_course_admins(self):
+        # only the current admins are posted back; others are added by username, see edit_course
         queryset = LTIProfile.objects.all()
+        if self.instance.pk:
+            queryset = queryset.filter(course_admin_user_profiles=self.instance)
         if self._user_scope:
             queryset = queryset.filter(Q(scope=self._user_scope)|Q(scope__isnull=True))
         return queryset.select_related('user').order_by('name', 'user__username')
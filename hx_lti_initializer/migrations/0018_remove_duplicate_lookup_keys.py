@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def merge_duplicate_courses(apps, schema_editor):
+    """
+    Moves the assignments, sources, admins and users of the courses that share a
+    course_id to the oldest of them, and deletes the others, so that course_id can be
+    made unique.
+    """
+    LTICourse = apps.get_model('hx_lti_initializer', 'LTICourse')
+    Assignment = apps.get_model('hx_lti_assignment', 'Assignment')
+    TargetObject = apps.get_model('target_object_database', 'TargetObject')
+    duplicated = (LTICourse.objects.values('course_id').annotate(count=models.Count('id'), first=models.Min('id'))
+                  .filter(count__gt=1))
+    for row in duplicated:
+        keep = LTICourse.objects.get(pk=row['first'])
+        others = list(LTICourse.objects.filter(course_id=row['course_id']).exclude(pk=keep.pk))
+        Assignment.objects.filter(course__in=others).update(course=keep)
+        keep.course_admins.add(*LTICourse.course_admins.through.objects.filter(lticourse__in=others).values_list('ltiprofile_id', flat=True))
+        keep.course_users.add(*LTICourse.course_users.through.objects.filter(lticourse__in=others).values_list('ltiprofile_id', flat=True))
+        for target_object in TargetObject.objects.filter(target_courses__in=others).distinct():
+            target_object.target_courses.add(keep)
+        LTICourse.objects.filter(pk__in=[other.pk for other in others]).delete()
+
+
+def remove_duplicate_resource_link_configs(apps, schema_editor):
+    """
+    Keeps the most recent configuration of each resource link.
+    """
+    LTIResourceLinkConfig = apps.get_model('hx_lti_initializer', 'LTIResourceLinkConfig')
+    duplicated = (LTIResourceLinkConfig.objects.values('resource_link_id').annotate(count=models.Count('id'), last=models.Max('id'))
+                  .filter(count__gt=1))
+    for row in duplicated:
+        LTIResourceLinkConfig.objects.filter(resource_link_id=row['resource_link_id']).exclude(pk=row['last']).delete()
+
+
+def remove_duplicates(apps, schema_editor):
+    merge_duplicate_courses(apps, schema_editor)
+    remove_duplicate_resource_link_configs(apps, schema_editor)
+
+
+def keep_merged(apps, schema_editor):
+    pass  # the duplicates are not recreated
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hx_lti_initializer', '0017_ltiresourcelinkconfig'),
+        ('hx_lti_assignment', '0010_auto_20161011_1552'),
+        ('target_object_database', '0005_iiifmanifest'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, keep_merged),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hx_lti_initializer', '0018_remove_duplicate_lookup_keys'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='lticourse',
+            name='course_id',
+            field=models.CharField(default='No Course ID', unique=True, max_length=255),
+            preserve_default=True,
+        ),
+        migrations.AlterField(
+            model_name='lticourseadmin',
+            name='new_admin_course_id',
+            field=models.CharField(max_length=255, db_index=True),
+            preserve_default=True,
+        ),
+        migrations.AlterField(
+            model_name='ltiprofile',
+            name='anon_id',
+            field=models.CharField(db_index=True, max_length=255, null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AlterField(
+            model_name='ltiresourcelinkconfig',
+            name='resource_link_id',
+            field=models.CharField(unique=True, max_length=255),
+            preserve_default=True,
+        ),
+    ]
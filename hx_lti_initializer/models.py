@@ -6,10 +6,25 @@ Django. It sets up the attributes for the model and any functions related to
 saving/retrieving data from the database.
 """
 
+from django.conf import settings
+from django.core.cache import cache
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.encoding import force_bytes
 from django.utils.translation import ugettext_lazy as _
+from annotationsx import metrics
+import hashlib
+
+# seconds that the courses and resource link configurations looked up by LTI launches are
+# cached; they are also dropped from the cache when they are saved or deleted, but only in
+# the worker that saved them unless CACHES is a shared backend, so the default is short
+LAUNCH_CACHE_TIMEOUT = getattr(settings, 'LTI_LAUNCH_CACHE_TIMEOUT', 60)
+
+
+def _launch_cache_key(kind, key):
+    return 'lti_launch_%s:%s' % (kind, hashlib.md5(force_bytes(key)).hexdigest())
 
 
 class LTIProfile(models.Model):
@@ -37,7 +52,7 @@ class LTIProfile(models.Model):
 
     # saves the anonymous id for research purposes
     anon_id = models.CharField(
-        max_length=255, blank=True, null=True
+        max_length=255, blank=True, null=True, db_index=True
     )
 
     # saves the name for display purposes
@@ -76,6 +91,7 @@ class LTICourse(models.Model):
     course_id = models.CharField(
         max_length=255,
         default=_('No Course ID'),
+        unique=True,
     )
 
     # this is used for usability purposes only, course_id is the unique value
@@ -140,6 +156,19 @@ class LTICourse(models.Model):
         """
         return LTICourse.objects.get(course_id=course_id)
 
+    @staticmethod
+    def get_cached_course_by_id(course_id):
+        """
+        Like get_course_by_id, but from the cache when it's there.
+        """
+        key = _launch_cache_key('course', course_id)
+        course_object = cache.get(key)
+        metrics.CACHE_REQUESTS.inc(cache='lti_course', result='miss' if course_object is None else 'hit')
+        if course_object is None:
+            course_object = LTICourse.get_course_by_id(course_id)
+            cache.set(key, course_object, LAUNCH_CACHE_TIMEOUT)
+        return course_object
+
     @staticmethod
     def create_course(course_id, lti_profile, **kwargs):
         """
@@ -158,20 +187,16 @@ class LTICourse(models.Model):
         """
         Given an lti_profile, adds a user to the course_admins of an LTICourse if not already there
         """
-        current_profiles = self.course_admins.all()
-        if lti_profile and lti_profile not in current_profiles:
+        if lti_profile and not self.course_admins.filter(pk=lti_profile.pk).exists():
             self.course_admins.add(lti_profile)
-            self.save()
         return self
     
     def add_user(self, lti_profile):
         """
         Given an lti_profile, adds a user to the course_users of an LTICourse if not already there
         """
-        current_profiles = self.course_users.all()
-        if lti_profile and lti_profile not in current_profiles:
+        if lti_profile and not self.course_users.filter(pk=lti_profile.pk).exists():
             self.course_users.add(lti_profile)
-            self.save()
         return self
 
 
@@ -182,7 +207,8 @@ class LTICourseAdmin(models.Model):
     )
 
     new_admin_course_id = models.CharField(
-        max_length=255
+        max_length=255,
+        db_index=True,
     )
 
     class Meta:
@@ -201,6 +227,35 @@ class LTICourseAdmin(models.Model):
 
 
 class LTIResourceLinkConfig(models.Model):
-    resource_link_id = models.CharField(max_length=255)
+    resource_link_id = models.CharField(max_length=255, unique=True)
     object_id = models.CharField(max_length=255)
     collection_id = models.CharField(max_length=255)
+
+    @staticmethod
+    def get_cached(resource_link_id):
+        """
+        Returns the configuration of a resource link, or None if it has none, from the cache
+        when it's there.
+        """
+        key = _launch_cache_key('config', resource_link_id)
+        config = cache.get(key)
+        metrics.CACHE_REQUESTS.inc(cache='lti_resource_link_config', result='miss' if config is None else 'hit')
+        if config is None:
+            try:
+                config = LTIResourceLinkConfig.objects.get(resource_link_id=resource_link_id)
+            except LTIResourceLinkConfig.DoesNotExist:
+                config = False  # cached, since most links have no configuration
+            cache.set(key, config, LAUNCH_CACHE_TIMEOUT)
+        return config or None
+
+
+@receiver(post_save, sender=LTICourse)
+@receiver(post_delete, sender=LTICourse)
+def course_changed(sender, instance, **kwargs):
+    cache.delete(_launch_cache_key('course', instance.course_id))
+
+
+@receiver(post_save, sender=LTIResourceLinkConfig)
+@receiver(post_delete, sender=LTIResourceLinkConfig)
+def resource_link_config_changed(sender, instance, **kwargs):
+    cache.delete(_launch_cache_key('config', instance.resource_link_id))
@@ -1,15 +1,12 @@
 from django.template.defaulttags import register
 from django.utils.safestring import mark_safe
 from django.conf import settings
-from datetime import datetime
-from dateutil import tz
 from django import template
 from django.template.defaultfilters import stringfilter
 from django.contrib.staticfiles.templatetags.staticfiles import static
-from re import sub
 
 from hx_lti_assignment.models import Assignment
-from hx_lti_initializer.utils import debug_printer
+from hx_lti_initializer.utils import debug_printer, format_dashboard_date, DASHBOARD_TIME_ZONE, UTC
 from abstract_base_classes.target_object_database_api import TOD_Implementation
 from target_object_database.models import TargetObject
 import re
@@ -18,12 +15,10 @@ def convert_tz(datetimeobj):
 	'''
 		Converts a datetimeobj from UTC to the local timezone
 	'''
-	from_zone = tz.tzutc()
-	to_zone = tz.gettz('America/New_York')
 	# Tell datetime object it's in UTC
-	utc = datetimeobj.replace(tzinfo=from_zone)
+	utc = datetimeobj.replace(tzinfo=UTC)
 	# Convert to local time
-	local = utc.astimezone(to_zone)
+	local = utc.astimezone(DASHBOARD_TIME_ZONE)
 
 	return local
 
@@ -32,23 +27,7 @@ def format_date(str):
 	'''
 		Converts a date string into a more readable format
 	'''
-
-	# Check for None case
-	if str is None:
-		return ""
-
-	# Clean string by stripping all non numeric characters
-	cleaned = sub("[^0-9]", "", str)
-
-	try:
-		# Store formatted date as datetimeobject and convert timezone
-		dformatted = convert_tz(datetime.strptime(cleaned, "%Y%m%d%H%M%S"))
-		# Date string in format for display on webpage
-		date = dformatted.strftime('%b %d')
-	except ValueError:
-		date = str
-
-	return date
+	return format_dashboard_date(str)
 
 @register.filter
 def format_tags(tagslist):
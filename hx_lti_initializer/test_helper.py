@@ -2,6 +2,9 @@
 Originally found here:
 https://github.com/tophatmonocle/ims_lti_py/blob/develop/tests/test_helper.py
 """
+import collections
+import re
+
 from ims_lti_py import ToolProvider
 from ims_lti_py import ToolConsumer
 
@@ -76,3 +79,123 @@ def create_test_tc(params=None):
         }
 
     return tc
+
+
+# data sizes at which the query budget tests run each view
+QUERY_BUDGET_SCALES = (1, 100, 1000)
+
+
+def normalize_sql(sql):
+    '''
+    Returns the statement with its literal values replaced by "?", so that the same query
+    made for different rows reads the same.
+    '''
+    # the sqlite backend records the statement and its parameters separately
+    match = re.match(r"QUERY = u?'(.*)' - PARAMS = ", sql, re.S)
+    if match:
+        sql = match.group(1)
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r'\b\d+(\.\d+)?\b', '?', sql)
+    sql = re.sub(r'%s', '?', sql)
+    sql = re.sub(r'( UNION ALL SELECT (\?, )*\?)+', ' UNION ALL ...', sql)
+    return re.sub(r'\((\?, )+\?\)', '(...)', sql)
+
+
+class QueryBudgetMixin(object):
+    '''
+    TestCase mixin to check that a view makes the same number of queries however much data
+    there is.
+    '''
+    scales = QUERY_BUDGET_SCALES
+
+    def assertQueryBudget(self, func, grow, budget=None, scales=None):
+        '''
+        Calls grow(n) for each of the scales, to bring the data up to that size, and then
+        func(). Fails if func() makes more queries at a scale than at the first one, or more
+        than budget, listing the statements that were made more often.
+        '''
+        from django.core.cache import cache
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        scales = scales or self.scales
+        first = None
+        for n in scales:
+            grow(n)
+            cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                func()
+            counts = collections.Counter()
+            previous = None
+            for query in context.captured_queries:
+                sql = normalize_sql(query['sql'])
+                # sqlite splits a bulk_create() into batches of the same statement
+                if not (sql == previous and sql.startswith('INSERT')):
+                    counts[sql] += 1
+                previous = sql
+            total = sum(counts.values())
+            if first is None:
+                first = counts
+                limit = total if budget is None else budget
+            if total > limit:
+                grown = sorted((count - first[sql], count, sql) for sql, count in counts.iteritems() if count > first[sql])
+                self.fail('%d queries at scale %d, over the budget of %d (%d at scale %d). Queries made more often:\n%s' % (
+                    total, n, limit, sum(first.values()), scales[0],
+                    '\n'.join('  %5d x %s' % (count, sql) for _, count, sql in reversed(grown))))
+
+
+class CourseData(object):
+    '''
+    A course with as many assignments, sources and profiles as the scale it was last grown
+    to. The first assignment has all of the sources; each of the others has one.
+    '''
+    def __init__(self, course_id='course-v1:HarvardX+Scale+2016'):
+        from django.contrib.auth.models import User
+        from hx_lti_initializer.models import LTICourse, LTIProfile
+
+        user = User.objects.create(username='instructor')
+        self.profile = LTIProfile.objects.create(user=user, anon_id='instructor', name='Instructor')
+        self.course = LTICourse.create_course(course_id, self.profile)
+        self.assignments = []
+        self.targets = []
+        self.profiles = [self.profile]
+
+    def grow(self, n):
+        from django.contrib.auth.models import User
+        from hx_lti_assignment.models import Assignment, AssignmentTargets, invalidate_assignment_navigation
+        from hx_lti_initializer.models import LTIProfile
+        from target_object_database.models import TargetObject
+
+        start = len(self.targets)
+        if n <= start:
+            return
+        new = range(start, n)
+        User.objects.bulk_create([User(username='user%04d' % i) for i in new])
+        users = User.objects.filter(username__in=['user%04d' % i for i in new])
+        LTIProfile.objects.bulk_create([LTIProfile(user=user, anon_id='anon-' + user.username, name=user.username) for user in users])
+        profiles = list(LTIProfile.objects.filter(user__in=users))
+        self.course.course_admins.add(*profiles[:len(profiles) // 10])
+        self.profiles.extend(profiles)
+
+        TargetObject.objects.bulk_create([
+            TargetObject(target_title='Source %d' % i, target_author='Author', target_content='Content %d' % i, target_type='tx')
+            for i in new])
+        targets = list(TargetObject.objects.filter(target_title__in=['Source %d' % i for i in new]).order_by('id'))
+        TargetObject.target_courses.through.objects.bulk_create([
+            TargetObject.target_courses.through(targetobject=target, lticourse=self.course) for target in targets])
+        self.targets.extend(targets)
+
+        Assignment.objects.bulk_create([
+            Assignment(assignment_id='scale-%d' % i, assignment_name='Assignment %d' % i, course=self.course,
+                       annotation_database_url='http://localhost/catch', annotation_database_apikey='key',
+                       annotation_database_secret_token='secret', pagination_limit=10, is_published=i % 2 == 0)
+            for i in new])
+        assignments = list(Assignment.objects.filter(assignment_id__in=['scale-%d' % i for i in new]).order_by('id'))
+        self.assignments.extend(assignments)
+        links = [AssignmentTargets(assignment=self.assignments[0], target_object=target, order=i + 1)
+                 for i, target in zip(new, targets)]
+        links.extend(AssignmentTargets(assignment=assignment, target_object=target, order=1)
+                     for assignment, target in zip(assignments, targets) if assignment != self.assignments[0])
+        AssignmentTargets.objects.bulk_create(links)
+        # bulk_create() doesn't send post_save
+        invalidate_assignment_navigation([self.assignments[0].pk])
@@ -21,14 +21,20 @@ Corner Cases Found:
     4. User tries to view "Share" page while not logged in.
 """
 import sys
-from utils import create_new_user
+import calendar
+import csv
+import datetime
+import jwt
+from utils import (create_new_user, retrieve_token, simple_utc, TokenCache, fetch_annotation_pages, get_course_reference, DashboardAnnotations,
+    fetch_annotations_by_course, get_dashboard_filters, format_dashboard_date,
+    invalidate_student_panel, student_panel_stats)
 from views import *
-from test_helper import (create_test_tc, TEST_CONSUMER_KEY, TEST_SECRET_KEY)
+from test_helper import (create_test_tc, TEST_CONSUMER_KEY, TEST_SECRET_KEY, QueryBudgetMixin, CourseData)
 from django.utils import six
 from cStringIO import StringIO
 from contextlib import contextmanager
-from models import LTICourse, LTIProfile
-from django.contrib.auth.models import User
+from models import LTICourse, LTIProfile, LTICourseAdmin, LTIResourceLinkConfig
+from django.contrib.auth.models import AnonymousUser, User
 from django.core.urlresolvers import resolve
 from django.test.client import RequestFactory
 from django.test import TestCase, override_settings
@@ -36,6 +42,20 @@ from django.core.exceptions import PermissionDenied
 from ims_lti_py.tool_provider import DjangoToolProvider
 from django.core.servers.basehttp import get_internal_wsgi_application
 from mock import patch
+from benchmarks import make_annotations
+from benchmarks.catch_server import CatchServer
+from annotation_store.models import DashboardUserSummary
+from django.db.models import F
+from django.contrib.sessions.backends.cache import SessionStore
+from annotationsx.middleware import LTILaunchSession
+from hx_lti_assignment.models import Assignment, AssignmentTargets
+from hx_lti_assignment.views import moving_assignment
+from django.core.cache import cache
+from django.db import connection
+from django.http import QueryDict
+from django.contrib.messages.storage.fallback import FallbackStorage
+from annotationsx.profiling import explain
+from target_object_database.models import TargetObject
 
 from hx_lti_initializer.forms import CourseForm
 from hx_lti_initializer.models import LTICourse
@@ -397,3 +417,456 @@ class LTIInitializerCourseFormTests(TestCase):
 
         self.assertEqual(len(expected_names), len(actual_names))
         self.assertEqual(expected_names, actual_names)
+
+
+class LTIInitializerTokenCacheTests(TestCase):
+    """
+    Focuses on the annotation database token cache in hx_lti_initializer/utils.py
+    """
+
+    def setUp(self):
+        self.issued_at = datetime.datetime(2017, 1, 1, tzinfo=simple_utc())
+        self.issued_ts = calendar.timegm(self.issued_at.utctimetuple())
+        self.cache = TokenCache(max_size=2, ttl=100, refresh_margin=10)
+
+    def test_reuses_token_until_near_expiry(self):
+        self.cache.set('user1', 'apikey', 'secret', 'token1', self.issued_at)
+        self.assertEqual('token1', self.cache.get('user1', 'apikey', 'secret', now=self.issued_ts + 1))
+        self.assertEqual('token1', self.cache.get('user1', 'apikey', 'secret', now=self.issued_ts + 89))
+        self.assertIsNone(self.cache.get('user1', 'apikey', 'secret', now=self.issued_ts + 90))
+
+    def test_secret_change_is_a_miss(self):
+        self.cache.set('user1', 'apikey', 'secret', 'token1', self.issued_at)
+        self.assertIsNone(self.cache.get('user1', 'apikey', 'rotated', now=self.issued_ts))
+
+    def test_evicts_least_recently_used(self):
+        self.cache.set('user1', 'apikey', 'secret', 'token1', self.issued_at)
+        self.cache.set('user2', 'apikey', 'secret', 'token2', self.issued_at)
+        self.cache.get('user1', 'apikey', 'secret', now=self.issued_ts)
+        self.cache.set('user3', 'apikey', 'secret', 'token3', self.issued_at)
+        self.assertEqual(2, len(self.cache))
+        self.assertIsNone(self.cache.get('user2', 'apikey', 'secret', now=self.issued_ts))
+        self.assertEqual('token1', self.cache.get('user1', 'apikey', 'secret', now=self.issued_ts))
+        self.assertEqual('token3', self.cache.get('user3', 'apikey', 'secret', now=self.issued_ts))
+
+    def test_retrieve_token_uses_cache(self):
+        with patch('hx_lti_initializer.utils.token_cache', TokenCache(max_size=10)):
+            token = retrieve_token('user1', 'apikey', 'secret')
+            self.assertEqual(token, retrieve_token('user1', 'apikey', 'secret'))
+            self.assertNotEqual(token, retrieve_token('user2', 'apikey', 'secret'))
+            payload = jwt.decode(token, 'secret')
+            self.assertEqual('user1', payload['userId'])
+            self.assertEqual('apikey', payload['consumerKey'])
+
+
+class LTIInitializerFetchAnnotationsTests(TestCase):
+    """
+    Focuses on the paged course annotation fetch in hx_lti_initializer/utils.py, against
+    the stand-in CATCH database.
+    """
+    context_id = 'course-v1:HarvardX+HDS3221.2x+2016'
+
+    def setUp(self):
+        self.servers = [
+            CatchServer(rows=make_annotations(students=10, per_student=11)).start(),
+            CatchServer(rows=make_annotations(students=5, per_student=3)).start(),
+        ]
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+
+    def test_fetches_every_page_of_every_database(self):
+        databases = [(server.url, 'token') for server in self.servers]
+        results = fetch_annotation_pages(self.context_id, databases, page_size=25, parallelism=3)
+        self.assertEqual(125, results['totalCount'])
+        self.assertEqual(0, results['errors'])
+        self.assertEqual(5 + 1, len(results['pages']))
+        expected = [row['id'] for row in self.servers[0].db.search({'limit': -1})['rows']]
+        expected += [row['id'] for row in self.servers[1].db.search({'limit': -1})['rows']]
+        self.assertEqual(expected, [row['id'] for row in results['rows']])
+
+    def test_page_timeout_only_fails_that_page(self):
+        self.servers[1].stall_rate, self.servers[1].stall = 1.0, 1.0
+        databases = [(server.url, 'token') for server in self.servers]
+        results = fetch_annotation_pages(self.context_id, databases, page_size=50, parallelism=4, timeout=0.2)
+        self.assertEqual(1, results['errors'])
+        self.assertEqual(110, len(results['rows']))
+        failed = [page for page in results['pages'] if page.error is not None]
+        self.assertTrue(failed[0].url.startswith(self.servers[1].url))
+        self.assertLess(failed[0].elapsed, 1.0)
+
+
+class LTIInitializerDashboardTests(TestCase):
+    """
+    Focuses on the paged student list and per-student annotations of the instructor
+    dashboard, against the stand-in CATCH database.
+    """
+    context_id = 'course-v1:HarvardX+HDS3221.2x+2016'
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create(username='instructor')
+        self.profile = LTIProfile.objects.create(user=user, anon_id='instructor', name='Prof')
+        course = LTICourse.create_course(self.context_id, self.profile)
+        self.server = CatchServer().start()
+        self.assignment = assignment = Assignment.objects.create(
+            assignment_id='assignment-0', assignment_name='Assignment', pagination_limit=10, course=course,
+            annotation_database_url=self.server.url, annotation_database_apikey='key', annotation_database_secret_token='secret')
+        self.target = target = TargetObject.objects.create(target_title='Text', target_author='Author', target_content='Content', target_type='tx')
+        AssignmentTargets.objects.create(assignment=assignment, target_object=target, order=1)
+        for row in make_annotations(students=12, per_student=3, assignments=1, targets=1):
+            del row['id']
+            row.update(uri=target.id, parent='0')
+            self.server.db.create(row)
+        root = self.server.db.create(dict(row, user={'id': 'teacher', 'name': 'Teacher'}, text='<p>root by teacher</p>'))
+        self.server.db.create(dict(row, parent=str(root['id']), text='<p>reply by student</p>'))
+        self.student_id = row['user']['id']
+
+        # get_annotation_db_credentials_by_course() uses DISTINCT ON, which sqlite doesn't support
+        credentials = [{'annotation_database_url': self.server.url, 'annotation_database_apikey': 'key', 'annotation_database_secret_token': 'secret'}]
+        patcher = patch('hx_lti_initializer.utils.get_annotation_db_credentials_by_course', return_value=credentials)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _get(self, view, **params):
+        request = RequestFactory().get('/', params)
+        request.session = SessionStore()
+        request.session['LTI_LAUNCH'] = {'link': {'is_staff': True, 'hx_context_id': self.context_id, 'resource_link_id': 'link',
+                                                  'hx_user_id': 'instructor', 'hx_user_name': 'Prof'}}
+        request.LTI = LTILaunchSession(request.session, 'link')
+        return view(request)
+
+    def test_students_are_paged_with_counts(self):
+        data = json.loads(self._get(instructor_dashboard_students_view, page=2, page_size=5).content)
+        self.assertEqual(13, data['total_students'])
+        self.assertEqual(3, data['num_pages'])
+        self.assertEqual(38, data['total_annotations'])
+        self.assertEqual(5, len(data['students']))
+
+        data = json.loads(self._get(instructor_dashboard_students_view, name='teach').content)
+        self.assertEqual([('teacher', 'Teacher', 1)], [(s['id'], s['name'], s['total_annotations']) for s in data['students']])
+
+    def test_student_annotations_resolve_parent_text(self):
+        response = self._get(instructor_dashboard_student_annotations_view, user_id=self.student_id)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(4, response.content.count('<tr>') - 1)
+        self.assertIn('Reply To:</b> "&lt;p&gt;root by teacher&lt;/p&gt;"', response.content)
+
+    def test_student_panel_is_cached_until_invalidated(self):
+        response = self._get(instructor_dashboard_student_annotations_view, user_id=self.student_id)
+        self.assertEqual('miss', response['X-Panel-Cache'])
+        row = dict(self.server.db.rows.values()[0], user={'id': self.student_id, 'name': 'Student'}, text='<p>new</p>')
+        del row['id']
+        self.server.db.create(row)
+
+        response = self._get(instructor_dashboard_student_annotations_view, user_id=self.student_id)
+        self.assertEqual(('hit', 4), (response['X-Panel-Cache'], response.content.count('<tr>') - 1))
+        self.assertEqual('miss', self._get(instructor_dashboard_student_annotations_view, user_id=self.student_id,
+                                           tag='the')['X-Panel-Cache'])
+
+        invalidate_student_panel(self.context_id, self.student_id)
+        response = self._get(instructor_dashboard_student_annotations_view, user_id=self.student_id)
+        self.assertEqual(('miss', 5), (response['X-Panel-Cache'], response.content.count('<tr>') - 1))
+        self.assertEqual({'hits': 1, 'misses': 3, 'hit_rate': 0.25}, student_panel_stats(self.context_id))
+
+    def test_student_panel_is_rebuilt_when_the_snapshot_changes(self):
+        self._get(instructor_dashboard_students_view)
+        self.assertEqual('miss', self._get(instructor_dashboard_student_annotations_view, user_id=self.student_id)['X-Panel-Cache'])
+        self.assertEqual('hit', self._get(instructor_dashboard_student_annotations_view, user_id=self.student_id)['X-Panel-Cache'])
+
+        # a deletion picked up by the snapshot in another worker, whose panel versions this one doesn't see
+        DashboardUserSummary.objects.filter(user_id=self.student_id).update(total_annotations=F('total_annotations') - 1)
+        self.assertEqual('miss', self._get(instructor_dashboard_student_annotations_view, user_id=self.student_id)['X-Panel-Cache'])
+
+    def test_filters_are_passed_to_the_search(self):
+        self.assertEqual({'collectionId': 'assignment-0', 'dateCreatedOnOrBefore': '2016-09-01T23:59:59 UTC'},
+                         get_dashboard_filters({'collectionId': 'assignment-0', 'dateCreatedOnOrBefore': '2016-09-01', 'tag': ' '}))
+        self.assertRaises(ValueError, get_dashboard_filters, {'dateCreatedOnOrAfter': '09/01/2016'})
+
+        tagged = [row for row in self.server.db.rows.values() if 'the' in row.get('tags', [])]
+        results = fetch_annotations_by_course(self.context_id, 'instructor', filters={'tag': 'the'})
+        self.assertEqual(sorted(row['id'] for row in tagged), sorted(row['id'] for row in results['rows']))
+        self.assertEqual(len(tagged), results['totalCount'])
+
+        response = self._get(instructor_dashboard_student_list_view, dateCreatedOnOrBefore='2000-01-01')
+        self.assertIn('No annotations to display', response.content)
+        response = self._get(instructor_dashboard_student_list_view, dateCreatedOnOrAfter='<script>')
+        self.assertEqual((400, 'text/plain', 'Invalid filter: dates must be given as YYYY-MM-DD'),
+                         (response.status_code, response['Content-Type'], response.content))
+
+    @patch('hx_lti_initializer.utils.FETCH_PAGE_SIZE', 5)
+    def test_export_streams_csv_and_ndjson(self):
+        response = self._get(instructor_dashboard_export_view, format='csv')
+        self.assertTrue(response.streaming)
+        self.assertTrue(response['Content-Disposition'].startswith('attachment; filename="annotations-course-v1_HarvardX_HDS3221.2x_2016-'))
+        lines = ''.join(response.streaming_content).splitlines()
+        self.assertEqual(1 + 38, len(lines))
+        self.assertTrue(lines[0].startswith('id,created,updated,user_id,user_name,assignment_id,assignment_name'))
+
+        response = self._get(instructor_dashboard_export_view, format='ndjson')
+        annotations = [json.loads(line) for line in ''.join(response.streaming_content).splitlines()]
+        self.assertEqual(38, len(set(a['id'] for a in annotations)))
+        self.assertEqual(set([('Assignment', 'Text')]), set((a['assignment_name'], a['object_name']) for a in annotations))
+        response = self._get(instructor_dashboard_export_view, format='<script>')
+        self.assertEqual((400, 'text/plain', 'Unknown format, expected one of: csv, ndjson'),
+                         (response.status_code, response['Content-Type'], response.content))
+
+    def test_export_csv_quotes_formulas(self):
+        row = dict(self.server.db.rows.values()[0], text='=1+1', tags=['@tag', 'plain'])
+        del row['id']
+        self.server.db.create(row)
+        response = self._get(instructor_dashboard_export_view, format='csv')
+        exported = list(csv.DictReader(StringIO(''.join(response.streaming_content))))
+        self.assertIn(("'=1+1", "'@tag, plain"), [(a['text'], a['tags']) for a in exported])
+
+        response = self._get(instructor_dashboard_export_view, format='ndjson')
+        self.assertIn('=1+1', [json.loads(line)['text'] for line in ''.join(response.streaming_content).splitlines()])
+
+    def test_annotations_are_grouped_by_user(self):
+        row = {'contextId': self.context_id, 'collectionId': 'assignment-0', 'uri': self.target.id, 'media': 'text', 'parent': '0'}
+        rows = [
+            dict(row, id=4, user={'id': 'b', 'name': 'bob'}, parent='1', text='reply to an older annotation'),
+            dict(row, id=3, user={'id': 'c', 'name': 'Carol'}, collectionId='other-assignment', text='not in the course'),
+            dict(row, id=2, user={'id': 'a', 'name': 'Alice'}, text='by alice', quote='quoted', tags=['tag'],
+                 updated='2016-09-01T02:30:00.000000+00:00'),
+            dict(row, id=1, user={'id': 'b', 'name': 'Bob'}, text='root'),
+        ]
+        users = DashboardAnnotations({'rows': rows}, self.context_id).get_annotations_by_user()
+        self.assertEqual([('a', 'Alice', 1), ('b', 'bob', 2)], [(u['id'], u['name'], u['total_annotations']) for u in users])
+        alice, reply = users[0]['annotations'][0], users[1]['annotations'][0]
+        self.assertEqual(('Aug 31', '"quoted"', 'tag', None, 'Assignment', 'Text'),
+                         (alice.date, alice.excerpt, alice.tags, alice.parent_id, alice.assignment_name, alice.target_object_name))
+        self.assertEqual('Sep 01', format_dashboard_date('2016-09-01T12:00:00 UTC'))
+        self.assertEqual('not a date', format_dashboard_date('not a date'))
+        self.assertEqual((1, '<b>Reply To:</b> "root"'), (reply.parent_id, reply.excerpt))
+        self.assertTrue(reply.target_preview_url.endswith('?focus_on_id=4'))
+
+    def test_course_reference_is_scoped_and_invalidated(self):
+        other_course = LTICourse.create_course('other-course', self.profile)
+        other_assignment = Assignment.objects.create(assignment_id='other', pagination_limit=10, course=other_course)
+        image = TargetObject.objects.create(target_title='Image', target_author='Author', target_content=' https://iiif.example.edu/m1\n', target_type='ig')
+        other_target = TargetObject.objects.create(target_title='Other', target_author='Author', target_content='Other', target_type='tx')
+        AssignmentTargets.objects.create(assignment=self.assignment, target_object=image, order=2)
+        AssignmentTargets.objects.create(assignment=other_assignment, target_object=other_target, order=1)
+
+        reference = get_course_reference(self.context_id)
+        self.assertEqual({'assignment-0': 'Assignment'}, reference['assignments'])
+        self.assertEqual([(self.target.id, 'Text', ''), (image.id, 'Image', 'https://iiif.example.edu/m1')],
+                         sorted((x['id'], x['target_title'], x['manifest_url']) for x in reference['targets']))
+        with self.assertNumQueries(0):
+            self.assertEqual(reference, get_course_reference(self.context_id))
+
+        self.assignment.assignment_name = 'Renamed'
+        self.assignment.save()
+        self.assertEqual({'assignment-0': 'Renamed'}, get_course_reference(self.context_id)['assignments'])
+        image.delete()
+        self.assertEqual([self.target.id], [x['id'] for x in get_course_reference(self.context_id)['targets']])
+        other_target.target_title = 'Edited'
+        other_target.save()
+        with self.assertNumQueries(0):
+            get_course_reference(self.context_id)
+
+
+class LTIInitializerQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """
+    Checks that the course pages make as many queries for a course with 1000 assignments,
+    sources and users as for one with a single one of each.
+    """
+    def setUp(self):
+        cache.clear()
+        self.data = CourseData()
+        self.other_course = LTICourse.create_course('other-course', self.data.profile)
+
+    def _request(self, is_staff=True):
+        request = RequestFactory().get('/', {'resource_link_id': 'link'})
+        request.session = SessionStore()
+        request.session['LTI_LAUNCH'] = {'link': {
+            'is_staff': is_staff, 'hx_context_id': self.data.course.course_id, 'resource_link_id': 'link',
+            'hx_user_id': 'instructor', 'hx_user_name': 'Instructor', 'hx_roles': ['Instructor'],
+        }}
+        request.LTI = LTILaunchSession(request.session, 'link')
+        request.user = self.data.profile.user
+        request._messages = None
+        return request
+
+    def _post(self, data):
+        request = self._request()
+        request.method = 'POST'
+        request._messages = FallbackStorage(request)
+        request.POST = QueryDict('', mutable=True)
+        for key, values in data.iteritems():
+            request.POST.setlist(key, values)
+        return request
+
+    def _launch(self, roles, user_id='instructor'):
+        request = RequestFactory().post('/lti_init/launch_lti/')
+        request.session = SessionStore()
+        request.session['LTI_LAUNCH'] = {'link': {'resource_link_id': 'link', 'launch_params': {
+            'user_id': user_id, 'context_id': self.data.course.course_id, 'resource_link_id': 'link', 'roles': roles,
+            'lis_person_sourcedid': user_id, 'lis_person_name_full': user_id.title(), 'tool_consumer_instance_guid': 'lms',
+            'context_title': 'Scale',
+        }}}
+        request.LTI = LTILaunchSession(request.session, 'link')
+        request.user = AnonymousUser()
+        response = launch_lti(request)
+        self.assertEqual(200, response.status_code)
+        return response
+
+    def test_launch_lti(self):
+        def add_config(n):
+            self.data.grow(n)
+            LTIResourceLinkConfig.objects.get_or_create(resource_link_id='link', collection_id='scale-0', object_id=str(self.data.targets[1].pk))
+
+        # the course and the link's configuration come from the cache after the first launch
+        self.assertQueryBudget(lambda: self._launch([]), add_config, budget=5, scales=(3, 100, 1000))
+        with self.assertNumQueries(2):
+            self._launch([])
+        # instructors are logged in and checked for a pending admin invitation
+        self.assertQueryBudget(lambda: self._launch(list(settings.ADMIN_ROLES)), add_config, budget=8, scales=(3, 100, 1000))
+
+    def test_launch_lookups_are_invalidated(self):
+        self.assertIsNone(LTIResourceLinkConfig.get_cached('link'))
+        config = LTIResourceLinkConfig.objects.create(resource_link_id='link', collection_id='a', object_id='1')
+        self.assertEqual('a', LTIResourceLinkConfig.get_cached('link').collection_id)
+        config.delete()
+        self.assertIsNone(LTIResourceLinkConfig.get_cached('link'))
+
+        self.assertEqual('No Default Name', LTICourse.get_cached_course_by_id(self.data.course.course_id).course_name)
+        self.data.course.course_name = 'Renamed'
+        self.data.course.save()
+        with self.assertNumQueries(1):
+            self.assertEqual('Renamed', LTICourse.get_cached_course_by_id(self.data.course.course_id).course_name)
+            LTICourse.get_cached_course_by_id(self.data.course.course_id)
+
+    def test_launch_adds_pending_admin(self):
+        self.data.grow(1)
+        instructor = User.objects.create(username='newinstructor')
+        LTICourseAdmin.objects.create(admin_unique_identifier='newinstructor', new_admin_course_id=self.data.course.course_id)
+        LTIProfile.objects.create(user=instructor, anon_id='newinstructor')
+        response = self._launch(list(settings.ADMIN_ROLES), user_id='newinstructor')
+        self.assertIn('Edit course settings', response.content)
+        self.assertTrue(self.data.course.course_admins.filter(anon_id='newinstructor').exists())
+        self.assertFalse(LTICourseAdmin.objects.exists())
+
+    def test_course_admin_hub(self):
+        self.assertQueryBudget(lambda: course_admin_hub(self._request()), self.data.grow)
+        self.assertQueryBudget(lambda: course_admin_hub(self._request(is_staff=False)), self.data.grow)
+        content = course_admin_hub(self._request(is_staff=False)).content
+        self.assertEqual((500, 1499), (content.count("class='assignment-title'"), content.count('/preview/?')))
+
+    def test_budget_failure_lists_the_queries(self):
+        def one_query_per_profile():
+            for profile in LTIProfile.objects.all():
+                profile.user
+        with self.assertRaises(AssertionError) as raised:
+            self.assertQueryBudget(one_query_per_profile, self.data.grow, scales=(1, 10))
+        self.assertIn('12 queries at scale 10, over the budget of 3 (3 at scale 1)', str(raised.exception))
+        self.assertIn('   11 x SELECT "auth_user"."id"', str(raised.exception))
+
+    def test_edit_course(self):
+        self.assertQueryBudget(lambda: edit_course(self._request(), self.data.course.pk), self.data.grow)
+        content = edit_course(self._request(), self.data.course.pk).content
+        # only the 100 current admins are listed, in the picker and in the form's field; the
+        # others are looked up as the instructor types
+        self.assertEqual((100, 200), (content.count('" selected>'), content.count('<option value="')))
+
+    def test_edit_course_updates_admins(self):
+        self.data.grow(20)
+        kept, removed, added = self.data.profiles[1], self.data.profiles[2], self.data.profiles[5]
+        self.assertEqual(3, self.data.course.course_admins.filter(pk__in=[self.data.profile.pk, kept.pk, removed.pk]).count())
+        LTICourseAdmin.objects.create(admin_unique_identifier='pending', new_admin_course_id=self.data.course.course_id)
+        post = lambda: self._post({
+            'course_name': ['Renamed'],
+            'course_admins': [str(profile.pk) for profile in self.data.course.course_admins.all()],
+            'select_existing_user': ['instructor', kept.user.username, added.user.username],
+            'new_admin_list': [' newperson,pending,'],
+        })
+        self.assertEqual(302, edit_course(post(), self.data.course.pk).status_code)
+        self.assertEqual(['instructor', kept.user.username],
+                         sorted(self.data.course.course_admins.values_list('user__username', flat=True)))
+        self.assertEqual(sorted([added.user.username, 'newperson', 'pending']),
+                         sorted(LTICourseAdmin.objects.values_list('admin_unique_identifier', flat=True)))
+
+        def post_as_course_grows(n):
+            # with admins to remove at every scale
+            self.data.grow(n)
+            self.data.course.course_admins.add(*self.data.profiles[1:max(n // 10, 3)])
+        self.assertQueryBudget(lambda: edit_course(post(), self.data.course.pk), post_as_course_grows)
+
+    def test_course_admin_candidates(self):
+        def candidates(**params):
+            request = self._request()
+            request.GET = request.GET.copy()
+            request.GET.update(params)
+            return json.loads(course_admin_candidates(request, self.data.course.pk).content)
+        self.assertQueryBudget(lambda: candidates(q='user'), self.data.grow)
+        create_new_user(anon_id='preview', username='preview:%s' % self.data.course.pk, display_name='Preview', roles=['student'])
+
+        first_page = candidates(q='user')
+        self.assertEqual((20, True), (len(first_page['users']), first_page['has_more']))
+        self.assertEqual(['user%04d' % i for i in range(20)], [user['username'] for user in first_page['users']])
+        self.assertEqual([True] * 10, [user['is_admin'] for user in candidates(q='user018')['users']])
+        self.assertEqual([False] * 10, [user['is_admin'] for user in candidates(q='user019')['users']])
+        last_page = candidates(q='user', page='50')
+        self.assertEqual(('user0999', False), (last_page['users'][-1]['username'], last_page['has_more']))
+        self.assertEqual(['instructor'], [user['username'] for user in candidates(q='i')['users']])
+        self.assertEqual([], candidates(q='preview')['users'])
+        self.assertEqual('user0000', candidates()['users'][1]['username'])
+        request = self._request(is_staff=False)
+        self.assertRaises(PermissionDenied, course_admin_candidates, request, self.data.course.pk)
+
+    def test_access_annotation_target(self):
+        def access():
+            assignment, target = self.data.assignments[0], self.data.targets[len(self.data.targets) // 2]
+            access_annotation_target(self._request(), self.data.course.course_id, assignment.assignment_id, target.pk)
+        # from 3 sources up, the one in the middle has both a previous and a next one
+        self.assertQueryBudget(access, self.data.grow, budget=4, scales=(3, 100, 1000))
+        # the source and its assignment, and the course admins, once the navigation is cached
+        with self.assertNumQueries(2):
+            access()
+
+    def test_moving_assignment(self):
+        def move():
+            response = moving_assignment(self._request(), self.data.course.pk, self.other_course.pk, self.data.assignments[0].pk)
+            self.assertEqual(len(self.data.targets), len(json.loads(response.content)['object_ids']))
+        self.assertQueryBudget(move, self.data.grow)
+
+
+class LTIInitializerIndexTests(TestCase):
+    """
+    Checks that the lookups made on every launch are answered from an index rather than
+    by reading the whole table. The plans are taken after ANALYZE on 1000 profiles: the
+    planner's choice between an index and a scan only depends on the table's statistics,
+    and filling a million rows would take minutes of every test run.
+    """
+    def setUp(self):
+        self.data = CourseData()
+        self.data.grow(1000)
+        LTIResourceLinkConfig.objects.bulk_create([
+            LTIResourceLinkConfig(resource_link_id='link-%d' % i, collection_id='scale-0', object_id=str(i)) for i in range(1000)])
+        LTICourseAdmin.objects.bulk_create([
+            LTICourseAdmin(admin_unique_identifier='admin-%d' % i, new_admin_course_id='course-%d' % (i % 100)) for i in range(1000)])
+        connection.cursor().execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        plan = explain([(sql, params, 0)])[0]['plan']
+        if connection.vendor == 'sqlite':
+            # e.g. "SEARCH TABLE hx_lti_initializer_ltiprofile USING INDEX ..._anon_id (anon_id=?)"
+            steps = [line for line in plan.splitlines() if 'TEMP B-TREE' not in line]
+            self.assertTrue(steps and all('SEARCH' in line and 'USING' in line for line in steps), plan)
+        else:
+            self.assertNotIn('Seq Scan', plan)
+
+    def test_lookups_use_indexes(self):
+        course_id = self.data.course.course_id
+        self.assertUsesIndex(LTIProfile.objects.select_related('user').filter(anon_id='anon-user0500'))
+        self.assertUsesIndex(LTICourse.objects.filter(course_id=course_id))
+        self.assertUsesIndex(LTIResourceLinkConfig.objects.filter(resource_link_id='link-500'))
+        self.assertUsesIndex(LTICourseAdmin.objects.filter(new_admin_course_id='course-50'))
+        # the join of get_annotation_db_credentials_by_course, without its DISTINCT ON
+        self.assertUsesIndex(Assignment.objects.filter(course__course_id=course_id).values('annotation_database_url'))
@@ -15,6 +15,11 @@ urlpatterns = patterns(
         'hx_lti_initializer.views.edit_course',
         name="edit_course",
     ),
+    url(
+        r'^course/(?P<id>[0-9]+)/admin_candidates/$',
+        'hx_lti_initializer.views.course_admin_candidates',
+        name="course_admin_candidates",
+    ),
     url(
         r'^launch_lti/$',
         'hx_lti_initializer.views.launch_lti',
@@ -33,6 +38,9 @@ urlpatterns = patterns(
     # using a wildcard for the middle of the url, so lti_init/instructor_dashboard and lti_init/admin_hub/instructor_dashboard will both work
     url(r'\w/instructor_dashboard_view$', 'hx_lti_initializer.views.instructor_dashboard_view', name='instructor_dashboard_view'),
     url(r'\w/instructor_dashboard_view/student_list$', 'hx_lti_initializer.views.instructor_dashboard_student_list_view', name='instructor_dashboard_student_list_view'),
+    url(r'\w/instructor_dashboard_view/students$', 'hx_lti_initializer.views.instructor_dashboard_students_view', name='instructor_dashboard_students_view'),
+    url(r'\w/instructor_dashboard_view/student_annotations$', 'hx_lti_initializer.views.instructor_dashboard_student_annotations_view', name='instructor_dashboard_student_annotations_view'),
+    url(r'\w/instructor_dashboard_view/export$', 'hx_lti_initializer.views.instructor_dashboard_export_view', name='instructor_dashboard_export_view'),
     url(
         r'^delete_assignment/$',
         'hx_lti_initializer.views.delete_assignment',
@@ -13,7 +13,13 @@ from django.core.urlresolvers import reverse
 from ims_lti_py.tool_provider import DjangoToolProvider
 from os.path import splitext, basename
 import base64
+import hashlib
+import calendar
+import collections
+import csv
+import json
 import sys
+import threading
 import time
 import datetime
 import jwt
@@ -21,13 +27,34 @@ import requests
 import urllib
 import re
 import logging
+from multiprocessing.pool import ThreadPool
+from dateutil import tz
+from django.utils.encoding import force_text
+from django.utils.safestring import mark_safe
+from annotationsx import metrics, timing
 
 # import Sample Target Object Model
-from hx_lti_assignment.models import Assignment
+from hx_lti_assignment.models import Assignment, course_reference_version
+from django.core.cache import cache
 from target_object_database.models import TargetObject
+from target_object_database.iiif import targets_by_canvas
 
 logger = logging.getLogger(__name__)
 
+TOKEN_TTL = 86400
+
+FETCH_SETTINGS = getattr(settings, 'ANNOTATION_FETCH', {})
+FETCH_PAGE_SIZE = FETCH_SETTINGS.get('page_size', 500)          # annotations per search request
+FETCH_PARALLELISM = FETCH_SETTINGS.get('parallelism', 4)        # search requests in flight per course
+FETCH_PAGE_TIMEOUT = FETCH_SETTINGS.get('page_timeout', 15)     # seconds, for each search request
+
+DASHBOARD_SETTINGS = getattr(settings, 'INSTRUCTOR_DASHBOARD', {})
+DASHBOARD_PAGE_SIZE = DASHBOARD_SETTINGS.get('page_size', 50)  # students per page of the student list
+DASHBOARD_REFERENCE_TIMEOUT = DASHBOARD_SETTINGS.get('reference_cache_timeout', 3600)  # seconds a course's names are cached
+DASHBOARD_PANEL_TIMEOUT = DASHBOARD_SETTINGS.get('panel_cache_timeout', 3600)  # seconds a student's rendered panel is cached
+DASHBOARD_TIME_ZONE = tz.gettz('America/New_York')
+UTC = tz.tzutc()
+
 
 @transaction.atomic
 def create_new_user(anon_id=None, username=None, display_name=None, roles=None, scope=None):
@@ -106,32 +133,101 @@ def debug_printer(debug_text):
     if settings.LTI_DEBUG:
         logger.debug(str(debug_text))
 
-def retrieve_token(userid, apikey, secret):
+def retrieve_token(userid, apikey, secret, use_cache=True):
     '''
     Return a token for the backend of annotations.
     It uses the course id to retrieve a variable that contains the secret
     token found in inheritance.py. It also contains information of when
     the token was issued. This will be stored with the user along with
     the id for identification purposes in the backend.
-    '''
-    apikey = apikey
-    secret = secret
-    # the following five lines of code allows you to include the
-    # defaulttimezone in the iso format
-    # noqa for more information: http://stackoverflow.com/questions/3401428/how-to-get-an-isoformat-datetime-string-including-the-default-timezone
 
-    def _now():
-        return datetime.datetime.utcnow().replace(tzinfo=simple_utc()).replace(microsecond=0).isoformat()  # noqa
+    Tokens are valid for TOKEN_TTL seconds, so a previously signed token is
+    reused from the token cache until it is close to expiring.
+    '''
+    if use_cache:
+        token = token_cache.get(userid, apikey, secret)
+        if token is not None:
+            return token
 
-    token = jwt.encode({
-      'consumerKey': apikey,
-      'userId': userid,
-      'issuedAt': _now(),
-      'ttl': 86400
-    }, secret)
+    issued_at = datetime.datetime.utcnow().replace(tzinfo=simple_utc()).replace(microsecond=0)
+    token = _sign_token(userid, apikey, secret, issued_at)
 
+    if use_cache:
+        token_cache.set(userid, apikey, secret, token, issued_at)
     return token
 
+def _sign_token(userid, apikey, secret, issued_at):
+    '''
+    Signs a new JWT for the annotation database. The issued_at datetime must be
+    timezone aware so that the iso format includes the timezone.
+    noqa for more information: http://stackoverflow.com/questions/3401428/how-to-get-an-isoformat-datetime-string-including-the-default-timezone
+    '''
+    with timing.phase('jwt'):
+        return jwt.encode({
+          'consumerKey': apikey,
+          'userId': userid,
+          'issuedAt': issued_at.isoformat(),
+          'ttl': TOKEN_TTL
+        }, secret)
+
+class TokenCache(object):
+    '''
+    Bounded LRU cache of signed annotation database tokens keyed by (userId, consumerKey).
+
+    Signing a token is cheap on its own, but it happens on every page render, search and
+    dashboard request, while the token itself is good for a day. Entries are reused until
+    they are within refresh_margin seconds of expiring, and the least recently used entry
+    is evicted once max_size is reached. The secret is stored with each entry so that a
+    rotated secret is treated as a miss rather than handing out a token signed with the
+    old secret.
+
+    The cache is per-process; each worker keeps its own copy.
+    '''
+    def __init__(self, max_size=1000, ttl=None, refresh_margin=3600):
+        self.max_size = max_size
+        self.ttl = TOKEN_TTL if ttl is None else ttl
+        self.refresh_margin = refresh_margin
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, userid, apikey, secret, now=None):
+        if self.max_size <= 0:
+            return None
+        now = time.time() if now is None else now
+        key = (userid, apikey)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] != secret or now >= entry[2] - self.refresh_margin:
+                self.misses += 1
+                metrics.CACHE_REQUESTS.inc(cache='token', result='miss')
+                return None
+            self._entries[key] = entry  # re-insert to mark as most recently used
+            self.hits += 1
+            metrics.CACHE_REQUESTS.inc(cache='token', result='hit')
+            return entry[1]
+
+    def set(self, userid, apikey, secret, token, issued_at):
+        if self.max_size <= 0:
+            return
+        expires_at = calendar.timegm(issued_at.utctimetuple()) + self.ttl
+        key = (userid, apikey)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (secret, token, expires_at)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
 def get_admin_ids(context_id):
     """
         Returns a set of the user ids of all users with an admin role
@@ -149,6 +245,11 @@ class simple_utc(datetime.tzinfo):
     def utcoffset(self, dt):
         return datetime.timedelta(0)
 
+token_cache = TokenCache(
+    max_size=getattr(settings, 'ANNOTATION_TOKEN_CACHE_SIZE', 1000),
+    refresh_margin=getattr(settings, 'ANNOTATION_TOKEN_REFRESH_MARGIN', 3600),
+)
+
 def get_annotation_db_credentials_by_course(context_id):
     '''
     Returns the distinct set of annotation database credentials (url, api key, secret token)
@@ -186,7 +287,7 @@ def get_annotation_db_credentials_by_course(context_id):
 
     return values_by_url.values()
 
-def fetch_annotations_by_course(context_id, user_id):
+def fetch_annotations_by_course(context_id, user_id, filters=None):
     '''
     Fetches annotations for all assignments in a course as given by the LTI context ID.
     
@@ -196,65 +297,263 @@ def fetch_annotations_by_course(context_id, user_id):
     course will have one annotation database setting used across assignments (URL, API KEY, SECRET),
     but it's possible that this assumption could change by the simple fact that the settings
     are saved on assignment models, and not on course models.
+
+    The annotations are fetched in pages, see fetch_annotation_pages(). Filters, such as
+    those of get_dashboard_filters(), are passed on to the search.
     
-    Returns: [{"rows": [], "totalCount": 0 }]
+    Returns: {"rows": [], "totalCount": 0, "pages": [], "errors": 0}
+    '''
+    return fetch_annotation_pages(context_id, get_annotation_databases(context_id, user_id), filters=filters)
+
+def fetch_annotations_by_student(context_id, user_id, student_id, filters=None):
     '''
-    annotation_db_credentials = get_annotation_db_credentials_by_course(context_id)
+    Fetches the annotations of one student in a course, plus the annotations that they
+    reply to, which are looked up together with fetch_annotations_by_id().
 
-    results = {'rows': [], 'totalCount': 0}
-    for credential in annotation_db_credentials:
+    Returns: {"rows": [], "totalCount": 0, "pages": [], "errors": 0, "parents": [] }
+    '''
+    databases = get_annotation_databases(context_id, user_id)
+    results = fetch_annotation_pages(context_id, databases, filters=dict(filters or {}, userid=student_id))
+    own_ids = set(row['id'] for row in results['rows'])
+    parent_ids = set(int(row['parent']) for row in results['rows'] if str(row.get('parent') or '0') != '0') - own_ids
+    results['parents'] = fetch_annotations_by_id(databases, parent_ids).values()
+    return results
+
+DASHBOARD_FILTERS = ('collectionId', 'uri', 'tag', 'dateCreatedOnOrAfter', 'dateCreatedOnOrBefore')
+
+def get_dashboard_filters(params):
+    '''
+    Returns the search filters chosen with the instructor dashboard's filter controls,
+    from request parameters of the same names. Dates are given as YYYY-MM-DD and include
+    the whole day (in UTC), and are passed on in the annotation store's date format.
+    Raises ValueError if a date can't be parsed.
+    '''
+    filters = {}
+    for name in DASHBOARD_FILTERS:
+        value = params.get(name, '').strip()
+        if not value:
+            continue
+        if name.startswith('date'):
+            day = datetime.datetime.strptime(value, '%Y-%m-%d')
+            if name == 'dateCreatedOnOrBefore':
+                day = day.replace(hour=23, minute=59, second=59)
+            value = day.strftime('%Y-%m-%dT%H:%M:%S UTC')
+        filters[name] = value
+    return filters
+
+def get_annotation_databases(context_id, user_id):
+    '''
+    Returns a list of (annotation_db_url, annotator_auth_token) for the annotation databases
+    used by the assignments of a course, with tokens issued to user_id.
+    '''
+    databases = []
+    for credential in get_annotation_db_credentials_by_course(context_id):
         db_url = credential['annotation_database_url'].strip()
         db_apikey = credential['annotation_database_apikey']
         db_secret = credential['annotation_database_secret_token']
-        annotator_auth_token = retrieve_token(user_id, db_apikey, db_secret)
-        logger.debug("Fetching annotations with context_id=%s database_url=%s" % (context_id, db_url))
-        data = _fetch_annotations_by_course(context_id, db_url, annotator_auth_token)
-        #logger.debug("Annotations fetched: %s" % data)
-        if 'rows' in data:
-            results['rows'] += data['rows']
-        if 'totalCount' in data:
-            results['totalCount'] += int(data['totalCount'])
+        databases.append((db_url, retrieve_token(user_id, db_apikey, db_secret)))
+    return databases
+
+AnnotationPage = collections.namedtuple('AnnotationPage', ['url', 'offset', 'limit', 'rows', 'total', 'status', 'elapsed', 'error'])
+
+class AnnotationFetchError(Exception):
+    pass
+
+def fetch_annotation_pages(context_id, databases, page_size=None, parallelism=None, timeout=None, filters=None):
+    '''
+    Fetches the annotations of a course from each (annotation_db_url, annotator_auth_token)
+    in databases, one page of `page_size` annotations per request. Extra search parameters
+    such as userid may be given in `filters`.
+
+    The first page of every database is fetched at once, which gives the total number of
+    annotations. The remaining pages of all databases are then fetched concurrently, with at
+    most `parallelism` requests in flight. Each page request has its own `timeout`, so a
+    slow page fails on its own instead of the whole course. Failed pages are logged and
+    counted in "errors", and the annotations of the other pages are still returned.
 
+    Rows are returned in database and page order whatever order the pages arrive in.
+    Annotations that show up on two pages because they were created while paging are only
+    returned once.
+
+    Returns: {"rows": [], "totalCount": 0, "pages": [AnnotationPage], "errors": 0}
+    '''
+    page_size = page_size or FETCH_PAGE_SIZE
+    parallelism = parallelism or FETCH_PARALLELISM
+    timeout = timeout or FETCH_PAGE_TIMEOUT
+    fetch_start_time = time.time()
+
+    def fetch(job):
+        n, offset, limit = job
+        db_url, token = databases[n]
+        return n, _fetch_annotations_by_course(context_id, db_url, token, limit=limit, offset=offset, timeout=timeout, filters=filters)
+
+    pages = {}
+    if databases:
+        fetch = timing.bind(fetch)
+        pool = ThreadPool(parallelism)
+        try:
+            jobs = []
+            for n, page in pool.map(fetch, [(n, 0, page_size) for n in range(len(databases))]):
+                pages[(n, 0)] = page
+                # the database may cap the page size, so step by what it actually returned
+                step = len(page.rows) if 0 < len(page.rows) < page_size else page_size
+                if page.total is not None:
+                    jobs.extend((n, offset, step) for offset in range(step, page.total, step))
+            for n, page in pool.imap_unordered(fetch, jobs):
+                pages[(n, page.offset)] = page
+        finally:
+            pool.close()
+            pool.join()
+
+        # databases that don't report a total are paged one request at a time until a short page
+        for n, (db_url, token) in enumerate(databases):
+            page = pages[(n, 0)]
+            while page.total is None and page.error is None and len(page.rows) == page.limit:
+                page = _fetch_annotations_by_course(context_id, db_url, token, limit=page_size, offset=page.offset + page.limit, timeout=timeout, filters=filters)
+                pages[(n, page.offset)] = page
+
+    results = {'rows': [], 'totalCount': 0, 'pages': [], 'errors': 0}
+    seen = set()
+    for key in sorted(pages):
+        page = pages[key]
+        results['pages'].append(page)
+        if page.error is not None:
+            results['errors'] += 1
+        if page.offset == 0 and page.total is not None:
+            results['totalCount'] += page.total
+        db_url = databases[key[0]][0]
+        for row in page.rows:
+            row_key = (db_url, row.get('id'))
+            if row_key not in seen:
+                seen.add(row_key)
+                results['rows'].append(row)
+
+    elapsed = [page.elapsed for page in results['pages']]
+    logger.info("fetch_annotation_pages(): context_id=%s databases=%s pages=%s errors=%s rows=%s elapsed=%.3fs slowest_page=%.3fs" % (
+        context_id, len(databases), len(elapsed), results['errors'], len(results['rows']), time.time() - fetch_start_time, max(elapsed or [0])))
     return results
 
+def iter_annotation_pages(context_id, databases, page_size=None, timeout=None, filters=None):
+    '''
+    Yields the pages of a course's annotations in order, one database after another, and
+    fetches the next page while the caller works through the current one. At most two
+    pages are held at once, so a course of any size can be streamed.
+
+    Annotations that were shifted onto the next page by ones created while paging are
+    left out of it. A page that can't be fetched raises AnnotationFetchError, since
+    skipping it would silently leave a gap.
+    '''
+    page_size = page_size or FETCH_PAGE_SIZE
+    kwargs = {'limit': page_size, 'timeout': timeout or FETCH_PAGE_TIMEOUT, 'filters': filters}
+    pool = ThreadPool(1)
+    try:
+        for db_url, token in databases:
+            fetch = lambda offset: pool.apply_async(timing.bind(_fetch_annotations_by_course), (context_id, db_url, token), dict(kwargs, offset=offset))
+            pending, previous_ids = fetch(0), set()
+            while pending is not None:
+                page = pending.get()
+                if page.error is not None:
+                    raise AnnotationFetchError(page.error)
+                next_offset = page.offset + len(page.rows)
+                # the database may cap the page size, so rely on the total when it has one
+                more = len(page.rows) > 0 and (next_offset < page.total if page.total is not None else len(page.rows) >= page_size)
+                pending = fetch(next_offset) if more else None
+                rows = [r for r in page.rows if r['id'] not in previous_ids]
+                previous_ids = set(r['id'] for r in page.rows)
+                yield page._replace(rows=rows)
+    finally:
+        pool.terminate()
+        pool.join()
+
 def _fetch_annotations_by_course(context_id, annotation_db_url, annotator_auth_token, **kwargs):
     '''
-    Fetches the annotations of a given course from the CATCH database
+    Fetches one page of the annotations of a given course from the CATCH database.
+    Returns an AnnotationPage. Errors are logged and returned in its "error" field, with
+    no rows.
     '''
     # build request
     headers = {
         "x-annotator-auth-token": annotator_auth_token,
         "Content-Type":"application/json"
     }
-    limit = kwargs.get('limit', -1) # Note: -1 means get everything there is
-    encoded_context_id = urllib.quote_plus(context_id)
-    request_url = "%s/search?contextId=%s&limit=%s" % (annotation_db_url, encoded_context_id, limit)
+    limit = kwargs.get('limit', FETCH_PAGE_SIZE) # Note: -1 means get everything there is
+    offset = kwargs.get('offset', 0)
+    timeout = kwargs.get('timeout', FETCH_PAGE_TIMEOUT)
+    filters = sorted((kwargs.get('filters') or {}).items())
+    query = urllib.urlencode([('contextId', context_id)] + filters + [('limit', limit), ('offset', offset)])
+    request_url = "%s/search?%s" % (annotation_db_url, query)
 
     logger.debug("fetch_annotations_by_course(): url: %s" % request_url)
 
-    # make request
-    request_start_time = time.clock()
-    r = requests.get(request_url, headers=headers)
-    request_end_time = time.clock()
-    request_elapsed_time = request_end_time - request_start_time
-
-    logger.debug("fetch_annotations_by_course(): annotation database response code: %s" % r.status_code)
-    logger.debug("fetch_annotations_by_course(): request time elapsed: %s seconds" % (request_elapsed_time))
-
+    # make request, timed by the wall clock since most of it is spent waiting on the database
+    rows, total, status, error = [], None, None, None
+    request_start_time = time.time()
     try:
-        # this gets the whole request, including such things as 'count'
+        with timing.phase('catch'):
+            r = requests.get(request_url, headers=headers, timeout=timeout)
+        status = r.status_code
+        r.raise_for_status()
+        # this gets the whole request, including such things as 'total'
         # however, that also means that the annotations come in as an object called 'rows,'
         # where each row represents an annotation object.
-        # if more convenient, we could cut the top level and just return flat annotations.
         annotations = r.json()
-        
-    except:
-        # If there are no annotations, the database should return a dictionary with empty rows,
-        # but in the event of another exception such as an authentication error, fail
-        # gracefully by manually passing in that empty response
-        annotations = {'rows':[], 'totalCount': 0}
+        rows = annotations.get('rows', [])
+        total = annotations.get('total', annotations.get('totalCount'))
+        total = int(total) if total is not None else None
+    except (requests.exceptions.RequestException, ValueError, AttributeError) as e:
+        # In the event of an error such as an authentication error or a timeout, fail
+        # gracefully with an empty page
+        error = "%s: %s" % (e.__class__.__name__, e)
+    request_elapsed_time = time.time() - request_start_time
+    metrics.observe_catch('fetch_page', request_elapsed_time, status or 'error')
+
+    logger.debug("fetch_annotations_by_course(): annotation database response code: %s" % status)
+    logger.debug("fetch_annotations_by_course(): request time elapsed: %s seconds" % (request_elapsed_time))
+    if error is not None:
+        logger.warning("fetch_annotations_by_course(): could not fetch %s after %.3f seconds: %s" % (request_url, request_elapsed_time, error))
 
-    return annotations
+    return AnnotationPage(request_url, offset, limit, rows, total, status, request_elapsed_time, error)
+
+def fetch_annotations_by_id(databases, annotation_ids, parallelism=None, timeout=None):
+    '''
+    Looks up annotations by id in a single batch of concurrent requests, with at most
+    `parallelism` in flight. The search API can't filter by id, so each annotation is read on
+    its own, from the first database in databases that has it. Annotations that can't be
+    read are logged and left out.
+
+    Returns: {annotation_id: annotation}
+    '''
+    parallelism = parallelism or FETCH_PARALLELISM
+    timeout = timeout or FETCH_PAGE_TIMEOUT
+    annotation_ids = sorted(set(annotation_ids))
+    if not annotation_ids or not databases:
+        return {}
+
+    def read(annotation_id):
+        for db_url, token in databases:
+            request_url = "%s/read/%s" % (db_url, annotation_id)
+            try:
+                request_start_time, status = time.time(), 'error'
+                try:
+                    with timing.phase('catch'):
+                        r = requests.get(request_url, headers={"x-annotator-auth-token": token}, timeout=timeout)
+                    status = r.status_code
+                finally:
+                    metrics.observe_catch('read', time.time() - request_start_time, status)
+                if r.status_code == 404:
+                    continue
+                r.raise_for_status()
+                return annotation_id, r.json()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logger.warning("fetch_annotations_by_id(): could not fetch %s: %s: %s" % (request_url, e.__class__.__name__, e))
+        return annotation_id, None
+
+    pool = ThreadPool(min(parallelism, len(annotation_ids)))
+    try:
+        return dict((annotation_id, annotation) for annotation_id, annotation in pool.map(timing.bind(read), annotation_ids) if annotation is not None)
+    finally:
+        pool.close()
+        pool.join()
 
 def get_distinct_users_from_annotations(annotations, sort_key=None):
     '''
@@ -324,6 +623,185 @@ def get_annotations_keyed_by_annotation_id(annotations):
     return dict([(r['id'], r) for r in rows])
 
 
+def get_course_reference(context_id):
+    '''
+    Returns the names of a course's assignments, keyed by assignment_id, and the id,
+    title, type and manifest URL (for images) of the target objects in them, as
+    {'assignments': {...}, 'targets': [...]}.
+
+    The result is cached under the course's reference version, which edits to its
+    assignments and target objects change (see hx_lti_assignment.models). With a
+    per-process cache backend, other workers see an edit once their copy expires.
+    '''
+    key = 'course_reference:%s:%s' % (hashlib.md5(context_id.encode('utf-8')).hexdigest(),
+                                      course_reference_version(context_id))
+    reference = cache.get(key)
+    metrics.CACHE_REQUESTS.inc(cache='course_reference', result='miss' if reference is None else 'hit')
+    if reference is not None:
+        return reference
+
+    assignments = dict(Assignment.objects.filter(course__course_id=context_id).values_list('assignment_id', 'assignment_name'))
+    targets = list(TargetObject.objects.filter(assignment__course__course_id=context_id).distinct().values(
+        'id', 'target_title', 'target_type', 'iiif_manifest__url'))
+    # the manifest of an image target that hasn't been cached yet is its content
+    uncached_images = [x['id'] for x in targets if x['target_type'] == 'ig' and not x['iiif_manifest__url']]
+    manifest_url_of = dict(TargetObject.objects.filter(id__in=uncached_images).values_list('id', 'target_content')) if uncached_images else {}
+    for x in targets:
+        x['manifest_url'] = (x.pop('iiif_manifest__url') or manifest_url_of.get(x['id'], '')).strip()
+
+    reference = {'assignments': assignments, 'targets': targets}
+    cache.set(key, reference, DASHBOARD_REFERENCE_TIMEOUT)
+    return reference
+
+
+def _student_panel_key(kind, context_id, user_id=''):
+    return 'student_panel_%s:%s:%s' % (kind, hashlib.md5(context_id.encode('utf-8')).hexdigest(),
+                                       hashlib.md5(user_id.encode('utf-8')).hexdigest() if user_id else '')
+
+
+def student_panel_version(context_id, user_id):
+    '''
+    Returns the version of the dashboard panel cached for a student, which changes when
+    invalidate_student_panel() is called for the student or for the whole course. As with
+    course_reference_version(), the first versions are taken from the clock.
+    '''
+    keys = [_student_panel_key('version', context_id), _student_panel_key('version', context_id, user_id)]
+    for key in keys:
+        cache.add(key, int(time.time() * 1000))
+    versions = cache.get_many(keys)
+    return '%s.%s' % tuple(versions.get(key) for key in keys)
+
+
+def invalidate_student_panel(context_id, user_id=None):
+    '''
+    Drops the cached dashboard panel of a student, or of every student in the course if
+    user_id is None (e.g. when the owner of a deleted annotation isn't known). Unless CACHES
+    is a shared backend, this only reaches the current worker; the others rebuild the panel
+    once the change reaches the student's counts in the dashboard snapshot.
+    '''
+    try:
+        cache.incr(_student_panel_key('version', context_id, user_id or ''))
+    except ValueError:
+        pass  # nothing has been cached for the student
+
+
+def student_panel_cache_key(context_id, user_id, total_annotations, latest_activity, filters=None):
+    '''
+    Returns the key of a student's rendered dashboard panel. It changes with the student's
+    annotation count and latest annotation timestamp in the dashboard snapshot, which every
+    worker sees, as well as their panel version, the course's assignment and source names
+    and the dashboard filters, so a stale panel is never served.
+    '''
+    filter_items = sorted((filters or {}).items())
+    return 'student_panel:%s' % hashlib.md5(json.dumps([
+        context_id, user_id, total_annotations, latest_activity.isoformat() if latest_activity else None,
+        student_panel_version(context_id, user_id), course_reference_version(context_id), filter_items,
+    ])).hexdigest()
+
+
+def count_student_panel(context_id, hit):
+    '''
+    Counts a hit or miss of the course's panel cache, for student_panel_stats().
+    '''
+    metrics.CACHE_REQUESTS.inc(cache='student_panel', result='hit' if hit else 'miss')
+    key = _student_panel_key('hits' if hit else 'misses', context_id)
+    if cache.add(key, 1, None):
+        return
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def student_panel_stats(context_id):
+    '''
+    Returns the hits, misses and hit rate of the course's panel cache since the counts
+    were last evicted.
+    '''
+    hits_key, misses_key = _student_panel_key('hits', context_id), _student_panel_key('misses', context_id)
+    counts = cache.get_many([hits_key, misses_key])
+    hits, misses = counts.get(hits_key, 0), counts.get(misses_key, 0)
+    return {'hits': hits, 'misses': misses, 'hit_rate': float(hits) / (hits + misses) if hits + misses else None}
+
+
+def format_dashboard_date(value):
+    '''
+    Formats an annotation's date, such as "2016-09-01T15:04:05.000000+00:00", as its
+    day in the dashboard's time zone, e.g. "Sep 01". Dates are taken to be in UTC.
+    Dates that can't be parsed are returned unchanged.
+    '''
+    if value is None:
+        return ""
+    digits = re.sub("[^0-9]", "", value)[:14]
+    try:
+        utc = datetime.datetime.strptime(digits, "%Y%m%d%H%M%S").replace(tzinfo=UTC)
+    except ValueError:
+        return value
+    return utc.astimezone(DASHBOARD_TIME_ZONE).strftime('%b %d')
+
+
+def escape_html(value):
+    '''
+    Escapes a value for HTML like django.utils.html.escape() and marks it safe, so that
+    the template prints it as it is. Without the lazy string handling of escape(), it is
+    several times faster when called for every annotation of a course.
+    '''
+    if value is None:
+        value = u''
+    elif not isinstance(value, unicode):
+        value = force_text(value)
+    return mark_safe(value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+                          .replace('"', '&quot;').replace("'", '&#39;'))
+
+
+class DashboardAnnotation(object):
+    '''
+    An annotation as the instructor dashboard shows it, with its date, excerpt and tags
+    formatted and escaped and its assignment and target object resolved, so that the
+    template only has to print them. A large course has hundreds of thousands of these,
+    so they use slots and keep only what the dashboard shows rather than the whole
+    annotation.
+    '''
+    __slots__ = ('id', 'date', 'excerpt', 'text', 'tags', 'parent_id',
+                 'assignment_name', 'target_object_name', 'target_preview_url')
+
+    def __init__(self, row, date, assignment_name, target_object_name, target_preview_url):
+        self.id = row['id']
+        self.date = date
+        self.text = row.get('text')
+        self.tags = escape_html(', '.join(row.get('tags') or []))
+        self.parent_id = get_parent_id(row)
+        if self.parent_id is not None:
+            self.excerpt = None # set with set_parent_text()
+        elif row.get('media') == 'text':
+            self.excerpt = mark_safe(u'"%s"' % escape_html(row.get('quote')))
+        else:
+            range_position = row.get('rangePosition') or {}
+            self.excerpt = mark_safe(
+                u'<img class="lazy" data-original="%s" width="%s" height="%s" style="max-width:150px; max-height:150px;" />' % (
+                    escape_html(row.get('thumb')), escape_html(range_position.get('width')), escape_html(range_position.get('height'))))
+        self.assignment_name = assignment_name
+        self.target_object_name = target_object_name
+        self.target_preview_url = target_preview_url
+
+    def set_parent_text(self, parent_text):
+        self.excerpt = mark_safe(u'<b>Reply To:</b> "%s"' % escape_html(parent_text))
+
+
+def get_parent_id(row):
+    '''
+    Returns the id of the annotation that a reply responds to, or None if the
+    annotation isn't a reply.
+    '''
+    parent = row.get('parent')
+    if not parent or parent == '0':
+        return None
+    try:
+        return int(parent)
+    except (TypeError, ValueError):
+        return None
+
+
 class DashboardAnnotations(object):
     '''
     This class is used to transform annotations retrieved from the CATCH DB into
@@ -336,73 +814,132 @@ class DashboardAnnotations(object):
     
     Example usage:
     
-        user_annotations = DashboardAnnotations(course_annotations).get_annotations_by_user()
+        user_annotations = DashboardAnnotations(course_annotations, context_id).get_annotations_by_user()
     
     Notes:
 
     This class is designed to minimize database hits by loading data up front.
-    The assumption is that the number of assignments and target objects in the tool
-    is going to be small compared to the number of annotations, so the memory use
-    should be negligible.
-    '''
-    def __init__(self, annotations):
-        self.annotations = annotations
-        self.annotation_by_id = self.get_annotations_by_id()
-        self.distinct_users = self.get_distinct_users()
-        self.assignment_name_of = self.get_assignments_dict()
-        self.target_objects_list = self.get_target_objects_list()
-        self.target_objects_by_id = {x['id']: x for x in self.target_objects_list}
+    The names of the course's assignments and target objects come from
+    get_course_reference(), which caches them between requests.
+
+    The rows are read once, into a DashboardAnnotation for each annotation that belongs
+    to one of the course's assignments, grouped by user. Nothing else refers to the rows
+    afterwards, so the caller can let go of them before rendering.
+    '''
+    def __init__(self, annotations, context_id, parent_annotations=None):
+        reference = get_course_reference(context_id)
+        self.assignment_name_of = reference['assignments']
+        self.target_objects_by_id = {x['id']: x for x in reference['targets']}
+        # escaped once here rather than by the template for every annotation
+        self.assignment_label_of = dict((k, escape_html(v)) for k, v in self.assignment_name_of.iteritems())
+        self.target_label_of = dict((x['id'], escape_html(x['target_title'])) for x in reference['targets'])
         self.target_objects_by_content = {
-            x.get('target_content', '').strip(): x
-            for x in self.target_objects_list
+            x['manifest_url']: x
+            for x in reference['targets']
             if x['target_type'] == 'ig'
         }
+        rows = annotations['rows']
+        self.target_id_by_canvas = {}
+        self.index_canvases(rows)
         self.preview_url_cache = {}
+        self.preview_url_html_cache = {}
+        self.date_label_cache = {}
+        self.user_annotations = self.group_annotations_by_user(rows, parent_annotations or [])
 
-    def get_annotations_by_id(self):
-        return get_annotations_keyed_by_annotation_id(self.annotations)
+    def group_annotations_by_user(self, rows, parent_annotations):
+        '''
+        Returns a dict mapping each user ID to the user's name (the first one seen) and
+        list of DashboardAnnotations, with the text of the annotations that replies
+        respond to filled in, from the rows or from parent_annotations, which are only
+        needed for that.
+        '''
+        parent_ids = set(parent_id for parent_id in (get_parent_id(r) for r in rows) if parent_id is not None)
+        text_of = dict((p['id'], p.get('text')) for p in parent_annotations if p['id'] in parent_ids)
+        replies = []
+        user_annotations = {}
+        for r in rows:
+            if r['id'] in parent_ids:
+                text_of[r['id']] = r.get('text')
+            annotation = self.get_dashboard_annotation(r)
+            if annotation is None:
+                continue
+            if annotation.parent_id is not None:
+                replies.append(annotation)
+            user = r['user']
+            if user['id'] not in user_annotations:
+                user_annotations[user['id']] = (user.get('name', ''), [])
+            user_annotations[user['id']][1].append(annotation)
+        for annotation in replies:
+            annotation.set_parent_text(text_of.get(annotation.parent_id))
+        return user_annotations
 
-    def get_distinct_users(self):
-        sort_key = lambda user: user.get('name', '').strip().lower()
-        return get_distinct_users_from_annotations(self.annotations, sort_key)
+    def get_dashboard_annotation(self, annotation):
+        '''
+        Returns the DashboardAnnotation for an annotation row, or None if it doesn't
+        belong to one of the course's assignments and target objects.
+        '''
+        collection_id = annotation['collectionId']
+        if collection_id not in self.assignment_name_of:
+            return None
+        target_id = self.get_target_id(annotation.get('media', None), annotation['uri'])
+        if not target_id:
+            return None
+        return DashboardAnnotation(
+            annotation,
+            date=self.get_date_label(annotation.get('updated')),
+            assignment_name=self.assignment_label_of[collection_id],
+            target_object_name=self.target_label_of.get(target_id, ''),
+            target_preview_url=self.get_preview_url_html(annotation['contextId'], collection_id, target_id, annotation['id']),
+        )
 
-    def get_assignments_dict(self, ):
-        return dict(Assignment.objects.values_list('assignment_id', 'assignment_name'))
+    def get_date_label(self, value):
+        '''
+        Returns format_dashboard_date(value), escaped. The day in the dashboard's time
+        zone only changes on the hour, so each hour's label is only formatted once.
+        '''
+        if not value:
+            return ''
+        hour = value[:13]
+        if hour in self.date_label_cache:
+            return self.date_label_cache[hour]
+        label = format_dashboard_date(value)
+        if label == value:
+            return escape_html(label) # not a date
+        label = self.date_label_cache[hour] = escape_html(label)
+        return label
 
-    def get_target_objects_list(self):
-        return TargetObject.objects.values('id', 'target_title', 'target_content', 'target_type')
+    def iter_annotations_by_user(self):
+        sort_key = lambda user_id: self.user_annotations[user_id][0].strip().lower()
+        for user_id in sorted(self.user_annotations, key=sort_key):
+            user_name, annotations = self.user_annotations[user_id]
+            yield {
+                'id': user_id,
+                'name': user_name,
+                'annotations': annotations,
+                'total_annotations': len(annotations),
+            }
 
     def get_annotations_by_user(self):
-        annotations_by_user = get_annotations_keyed_by_user_id(self.annotations)
-        users = []
-        for user in self.distinct_users:
-            user_id = user['id']
-            user_name = user['name']
-            annotations = []
-            for annotation in annotations_by_user[user_id]:
-                if self.assignment_object_exists(annotation):
-                    annotations.append({
-                        'data': annotation,
-                        'assignment_name': self.get_assignment_name(annotation),
-                        'target_preview_url': self.get_target_preview_url(annotation),
-                        'target_object_name': self.get_target_object_name(annotation),
-                        'parent_text': self.get_annotation_parent_value(annotation, 'text'),
-                    })
-            if len(annotations) > 0:
-                users.append({
-                    'id': user_id,
-                    'name': user_name,
-                    'annotations': annotations,
-                    'total_annotations': len(annotations),
-                })
-        return users
+        return list(self.iter_annotations_by_user())
+
+    def index_canvases(self, rows):
+        '''
+        Looks up the image targets for every canvas annotated in rows that hasn't been
+        looked up yet, with one query against the IIIF manifest cache.
+        '''
+        canvas_ids = set(r['uri'] for r in rows if r.get('media') == 'image' and r['uri'] not in self.target_id_by_canvas)
+        self.target_id_by_canvas.update(targets_by_canvas(canvas_ids))
 
     def get_target_id(self, media_type, object_id):
         target_id = ''
         if media_type == 'image':
+            if object_id in self.target_id_by_canvas:
+                return self.target_id_by_canvas[object_id]
+            # the target's manifest hasn't been cached yet, so guess the manifest URL from the canvas id
             trimmed_object_id = object_id[0:object_id.find('/canvas/')] # only use regex if absolutely necessary
             if trimmed_object_id in self.target_objects_by_content:
                 target_id = self.target_objects_by_content[trimmed_object_id]['id']
+            self.target_id_by_canvas[object_id] = target_id
         else:
             if object_id in self.target_objects_by_id:
                 target_id = object_id
@@ -423,34 +960,39 @@ class DashboardAnnotations(object):
         return ''
 
     def get_target_preview_url(self, annotation):
-        annotation_id = annotation['id']
         media_type = annotation.get('media', None)
-        context_id = annotation['contextId']
-        collection_id = annotation['collectionId']
-        url_format = "%s?focus_on_id=%s"
-        preview_url = ''
-
         if media_type == 'image':
             target_id = self.get_target_id(media_type, annotation['uri'])
         else:
             target_id = annotation['uri']
+        return self.get_preview_url(annotation['contextId'], annotation['collectionId'], target_id, annotation['id'])
 
-        if target_id:
-            url_cache_key = "%s%s%s" % (context_id, collection_id, target_id)
-            if url_cache_key in self.preview_url_cache:
-                preview_url = self.preview_url_cache[url_cache_key]
-            else:
-                preview_url = reverse('hx_lti_initializer:access_annotation_target', kwargs={
-                    "course_id": context_id,
-                    "assignment_id": collection_id,
-                    "object_id": target_id,
-                })
-                self.preview_url_cache[url_cache_key] = preview_url
-
-        if preview_url:
-            preview_url = url_format % (preview_url, annotation_id)
-
-        return preview_url
+    def get_preview_url(self, context_id, collection_id, target_id, annotation_id):
+        '''
+        Returns the URL that opens the target object at the annotation. The URL is only
+        resolved once for each assignment and target object; the annotation id is
+        appended to it.
+        '''
+        if not target_id:
+            return ''
+        url_cache_key = (context_id, collection_id, target_id)
+        url_prefix = self.preview_url_cache.get(url_cache_key)
+        if url_prefix is None:
+            url_prefix = reverse('hx_lti_initializer:access_annotation_target', kwargs={
+                "course_id": context_id,
+                "assignment_id": collection_id,
+                "object_id": target_id,
+            }) + "?focus_on_id="
+            self.preview_url_cache[url_cache_key] = url_prefix
+        return "%s%s" % (url_prefix, annotation_id)
+
+    def get_preview_url_html(self, context_id, collection_id, target_id, annotation_id):
+        url_cache_key = (context_id, collection_id, target_id)
+        url_prefix = self.preview_url_html_cache.get(url_cache_key)
+        if url_prefix is None:
+            url_prefix = self.preview_url_html_cache[url_cache_key] = escape_html(
+                self.get_preview_url(context_id, collection_id, target_id, ''))
+        return mark_safe(u"%s%s" % (url_prefix, annotation_id))
     
     def assignment_object_exists(self, annotation):
         media_type = annotation.get('media', None)
@@ -459,17 +1001,88 @@ class DashboardAnnotations(object):
         target_id = self.get_target_id(media_type, object_id)
         return (collection_id in self.assignment_name_of) and target_id
 
-    def get_annotation_parent_value(self, annotation, attr):
-        parent_value = None
-        if 'parent' in annotation and annotation['parent']:
-            parent_id = annotation['parent']
-            parent_annotation = self.get_annotation_by_id(parent_id)
-            if parent_annotation is not None and attr in parent_annotation:
-                parent_value = parent_annotation[attr]
-        return parent_value
-
-    def get_annotation_by_id(self, annotation_id):
-        annotation_id = int(annotation_id)
-        if annotation_id in self.annotation_by_id:
-            return self.annotation_by_id[annotation_id]
-        return None
+
+EXPORT_FIELDS = ('id', 'created', 'updated', 'user_id', 'user_name', 'assignment_id', 'assignment_name', 'object_id',
+                 'object_name', 'media', 'parent_id', 'quote', 'text', 'tags', 'url')
+
+def iter_course_export(context_id, user_id, filters=None):
+    '''
+    Yields a dict of EXPORT_FIELDS for each annotation of a course that belongs to one of
+    its assignments, with the names the instructor dashboard shows, as the pages arrive
+    from the annotation databases.
+    '''
+    dashboard = DashboardAnnotations({'rows': []}, context_id)
+    for page in iter_annotation_pages(context_id, get_annotation_databases(context_id, user_id), filters=filters):
+        dashboard.index_canvases(page.rows)
+        for row in page.rows:
+            if not dashboard.assignment_object_exists(row):
+                continue
+            user = row.get('user') or {}
+            yield {
+                'id': row['id'],
+                'created': row.get('created'),
+                'updated': row.get('updated'),
+                'user_id': user.get('id'),
+                'user_name': user.get('name'),
+                'assignment_id': row['collectionId'],
+                'assignment_name': dashboard.get_assignment_name(row),
+                'object_id': dashboard.get_target_id(row.get('media'), row['uri']),
+                'object_name': dashboard.get_target_object_name(row),
+                'media': row.get('media'),
+                'parent_id': get_parent_id(row),
+                'quote': row.get('quote'),
+                'text': row.get('text'),
+                'tags': row.get('tags') or [],
+                'url': dashboard.get_target_preview_url(row),
+            }
+
+def _join_chunks(lines, chunk_size=65536):
+    '''
+    Joins lines into chunks of about chunk_size bytes, so that a streamed response
+    isn't written (and gzipped) a line at a time.
+    '''
+    chunk, length = [], 0
+    for line in lines:
+        chunk.append(line)
+        length += len(line)
+        if length >= chunk_size:
+            yield ''.join(chunk)
+            chunk, length = [], 0
+    if chunk:
+        yield ''.join(chunk)
+
+class _Echo(object):
+    '''
+    File-like object that returns what is written to it, so csv.writer can format
+    one row at a time.
+    '''
+    def write(self, value):
+        return value
+
+# cells starting with these are run as formulas by spreadsheets
+CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+def _csv_cell(value):
+    '''
+    Encodes a value for the CSV export, quoting text that a spreadsheet would take for a
+    formula (e.g. an annotation starting with =HYPERLINK) so that it is shown as written.
+    '''
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        value = "'" + value
+    return value
+
+def iter_export_csv(annotations):
+    writer = csv.writer(_Echo())
+    tags = EXPORT_FIELDS.index('tags')
+    def lines():
+        yield writer.writerow(EXPORT_FIELDS)
+        for annotation in annotations:
+            values = [annotation[field] for field in EXPORT_FIELDS]
+            values[tags] = ', '.join(values[tags])
+            yield writer.writerow([_csv_cell(v) for v in values])
+    return _join_chunks(lines())
+
+def iter_export_ndjson(annotations):
+    return _join_chunks(json.dumps(annotation) + '\n' for annotation in annotations)
@@ -6,7 +6,7 @@ It will set up the tool provider, create/retrive the user and pass along any
 other information that will be rendered to the access/init screen to the user.
 """
 
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.core.exceptions import PermissionDenied
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
@@ -15,27 +15,38 @@ from django.shortcuts import get_object_or_404, redirect, render
 from django.core.urlresolvers import reverse
 from django.contrib.auth import login
 from django.contrib import messages
+from django.db.models import Prefetch, Q
 
 from annotationsx.exceptions import AnnotationTargetDoesNotExist
+from annotationsx.compression import gzip_response
 from target_object_database.models import TargetObject
 from hx_lti_initializer.models import LTIProfile, LTICourse, LTICourseAdmin, LTIResourceLinkConfig
 from hx_lti_assignment.models import Assignment, AssignmentTargets
 from hx_lti_initializer.forms import CourseForm
-from hx_lti_initializer.utils import (debug_printer, retrieve_token, save_session, create_new_user, fetch_annotations_by_course, DashboardAnnotations)
+from hx_lti_initializer.utils import (debug_printer, retrieve_token, save_session, create_new_user, fetch_annotations_by_course,
+    fetch_annotations_by_student, DashboardAnnotations, DASHBOARD_PAGE_SIZE, iter_course_export, iter_export_csv, iter_export_ndjson,
+    get_course_reference, get_dashboard_filters, student_panel_cache_key, count_student_panel, student_panel_stats,
+    DASHBOARD_PANEL_TIMEOUT)
+from django.core.cache import cache
+from annotation_store import snapshot as dashboard_snapshot
 from hx_lti_initializer import annotation_database
 from django.conf import settings
-from abstract_base_classes.target_object_database_api import TOD_Implementation
 from django.contrib.sites.models import get_current_site
 from ims_lti_py.tool_provider import DjangoToolProvider
 
 from urlparse import urlparse
+import datetime
 import json
+import re
 import time
 import os.path
 import logging
 
 logger = logging.getLogger(__name__)
 
+# usernames per page of the course admin picker
+ADMIN_CANDIDATES_PAGE_SIZE = 20
+
 @csrf_exempt
 def launch_lti(request):
     """
@@ -70,9 +81,6 @@ def launch_lti(request):
             user_scope = "consumer:%s" % tool_consumer_instance_guid
     logger.debug("DEBUG - user scope is: %s" % user_scope)
 
-    # default to student
-    save_session(request, is_staff=False)
-
     # this is where canvas will tell us what level individual is coming into
     # the tool the 'roles' field usually consists of just 'Instructor'
     # or 'Learner'
@@ -91,9 +99,10 @@ def launch_lti(request):
     external_user_id = request.LTI['launch_params'].get('lis_person_sourcedid', '')
 
     # This handles the rare case in which we have neither display name nor external user id
+    lti_profile = None
     if not (display_name or external_user_id):
         try:
-            lti_profile = LTIProfile.objects.get(anon_id=str(course))
+            lti_profile = LTIProfile.objects.select_related('user').get(anon_id=str(course))
             roles = ['student']
             display_name = lti_profile.user.username
             messages.warning(request, "edX still has not fixed issue with no user_id in studio.")
@@ -104,10 +113,11 @@ def launch_lti(request):
     logger.debug("DEBUG - user name: " + display_name)
 
     # Check whether user is a admin, instructor or teaching assistant
-    if set(roles) & set(settings.ADMIN_ROLES):
+    is_admin = bool(set(roles) & set(settings.ADMIN_ROLES))
+    if is_admin:
         try:
             # See if the user already has a profile, and use it if so.
-            lti_profile = LTIProfile.objects.get(anon_id=user_id)
+            lti_profile = LTIProfile.objects.select_related('user').get(anon_id=user_id)
             logger.debug('DEBUG - LTI Profile was found via anonymous id.')
         except LTIProfile.DoesNotExist:
             # if it's a new user (profile doesn't exist), set up and save a new LTI Profile
@@ -116,48 +126,24 @@ def launch_lti(request):
             # log the user into the Django backend
         lti_profile.user.backend = 'django.contrib.auth.backends.ModelBackend'
         login(request, lti_profile.user)
-        save_session(
-            request,
-            user_id=user_id,
-            user_name=display_name,
-            user_scope=user_scope,
-            context_id=course,
-            roles=roles,
-            is_staff=True,
-            resource_link_id=resource_link_id
-        )
-    else:
-        # For HX, students only access one object or collection, and don't
-        # have an index
-        # For ATG, students have the index  to choose where to go, so
-        # collection_id and object_id are probably blank for their session
-        # right now.
-        collection_id = request.LTI['launch_params'].get(settings.LTI_COLLECTION_ID)
-        object_id = request.LTI['launch_params'].get(settings.LTI_OBJECT_ID)
-        save_session(
-            request,
-            user_id=user_id,
-            user_name=display_name,
-            user_scope=user_scope,
-            context_id=course,
-            roles=roles,
-            is_staff=False,
-            resource_link_id=resource_link_id
-        )
+
+    # saved to the session in one go once the course is known
+    session_values = dict(
+        user_id=user_id,
+        user_name=display_name,
+        user_scope=user_scope,
+        context_id=course,
+        roles=roles,
+        is_staff=is_admin,
+        resource_link_id=resource_link_id
+    )
 
     # now it's time to deal with the course_id it does not associate
     # with users as they can flow in and out in a MOOC
+    course_object = None
     try:
-        course_object = LTICourse.get_course_by_id(course)
+        course_object = LTICourse.get_cached_course_by_id(course)
         logger.debug('DEBUG - Course was found %s' % course)
-
-        # save the course name to the session so it auto-populate later.
-        save_session(
-            request,
-            course_name=course_object.course_name,
-            course_id=course_object.id,
-        )
-
     except LTICourse.DoesNotExist:
         logger.debug('DEBUG - Course %s was NOT found. Will be created.' %course)
 
@@ -165,7 +151,7 @@ def launch_lti(request):
         message_error = "Sorry, the course you are trying to reach does not exist."
         messages.error(request, message_error)
 
-        if set(roles) & set(settings.ADMIN_ROLES):
+        if is_admin:
             # This must be the instructor's first time accessing the annotation tool
             # Make him/her a new course within the tool
 
@@ -178,32 +164,25 @@ def launch_lti(request):
                 context_title = request.LTI['launch_params']['context_title']
             course_object = LTICourse.create_course(course, lti_profile, name=context_title)
             create_new_user(anon_id=str(course), username='preview:%s' % course_object.id, display_name="Preview %s" % str(course_object), roles=['student'], scope=user_scope)
-
-            # save the course name to the session so it auto-populate later.
-            save_session(
-                request,
-                course_name=course_object.course_name,
-                course_id=course_object.id,
-            )
         else:
             logger.info('Course not created because user does not have an admin role')
+
+    if course_object is not None:
+        # save the course name to the session so it auto-populate later.
+        session_values.update(course_name=course_object.course_name, course_id=course_object.id)
+    save_session(request, **session_values)
+
+    if is_admin and course_object is not None:
+        add_pending_admin(course_object, lti_profile)
+
     try:
-        config = LTIResourceLinkConfig.objects.get(resource_link_id=resource_link_id)
+        config = LTIResourceLinkConfig.get_cached(resource_link_id)
+        if config is None:
+            raise LTIResourceLinkConfig.DoesNotExist
         assignment_id = config.collection_id
         object_id = config.object_id
         logger.debug("DEBUG - LTIResourceLinkConfig: resource_link_id=%s collection_id=%s object_id=%s" % (resource_link_id, config.collection_id, config.object_id))
         course_id = str(course)
-        if set(roles) & set(settings.ADMIN_ROLES):
-            try:
-                userfound = LTICourseAdmin.objects.get(
-                    admin_unique_identifier=lti_profile.user.username,
-                    new_admin_course_id=course
-                )
-                course_object.add_admin(lti_profile)
-                logger.info("CourseAdmin Pending found: %s" % userfound)
-                userfound.delete()
-            except:
-                logger.info("Not waiting to be added as admin")
         logger.debug("DEBUG - User wants to go directly to annotations for a specific target object using UI")
         return access_annotation_target(request, course_id, assignment_id, object_id)
     except AnnotationTargetDoesNotExist as e:
@@ -227,17 +206,7 @@ def launch_lti(request):
             assignment_id = request.LTI['launch_params'][settings.LTI_COLLECTION_ID]
             object_id = request.LTI['launch_params'][settings.LTI_OBJECT_ID]
             course_id = str(course)
-            if set(roles) & set(settings.ADMIN_ROLES):
-                try:
-                    userfound = LTICourseAdmin.objects.get(
-                        admin_unique_identifier=lti_profile.user.username,
-                        new_admin_course_id=course
-                    )
-                    course_object.add_admin(lti_profile)
-                    logger.info("CourseAdmin Pending found: %s" % userfound)
-                    userfound.delete()
-                except:
-                    logger.info("Not waiting to be added as admin")
+            if is_admin:
                 return course_admin_hub(request)
             else:
                 logger.debug("DEBUG - User wants to go directly to annotations for a specific target object")
@@ -245,19 +214,25 @@ def launch_lti(request):
         except:
             logger.debug("DEBUG - User wants the index")
 
-    try:
-        userfound = LTICourseAdmin.objects.get(
-            admin_unique_identifier=lti_profile.user.username,
-            new_admin_course_id=course
-        )
+    return course_admin_hub(request)
+
+
+def add_pending_admin(course_object, lti_profile):
+    """
+    Makes the user an admin of the course if an admin added them before they first launched
+    the tool, see edit_course.
+    """
+    pending = LTICourseAdmin.objects.filter(
+        admin_unique_identifier=lti_profile.user.username,
+        new_admin_course_id=course_object.course_id
+    )
+    if pending.exists():
         course_object.add_admin(lti_profile)
-        logger.info("CourseAdmin Pending found: %s" % userfound)
-        userfound.delete()
-    except:
+        logger.info("CourseAdmin Pending found: %s" % lti_profile.user.username)
+        pending.delete()
+    else:
         logger.debug("DEBUG - Not waiting to be added as admin")
 
-    return course_admin_hub(request)
-
 
 @login_required
 def edit_course(request, id):
@@ -267,32 +242,26 @@ def edit_course(request, id):
         form = CourseForm(request.POST, instance=course)
         if form.is_valid():
             course = form.save()
-            course.save()
+            selected = set(name.strip() for name in request.POST.getlist('select_existing_user') + request.POST['new_admin_list'].split(','))
+            selected.discard('')
+
             # this removes an administrator if they were checked off the list
-            admins = course.course_admins.all()
-            selected_list = request.POST.getlist('select_existing_user') + request.POST['new_admin_list'].split(',')
-            for admin in admins:
-                if admin.user.username not in selected_list:
-                    course.course_admins.remove(admin)
-                else:
-                    selected_list.remove(admin.user.username)
-            course.save()
+            admins = list(course.course_admins.values_list('id', 'user__username'))
+            course.course_admins.remove(*[profile_id for profile_id, username in admins if username not in selected])
 
             # this will create an item in the database so when the user
             # that was just added as an admin logs in, they get added
             # to the list of admins in the course.
-            if len(selected_list) > 0:
-                for name in selected_list:
-                    if str(name.strip()) != "":
-                        try:
-                            new_course_admin = LTICourseAdmin(
-                                admin_unique_identifier=name,
-                                new_admin_course_id=course.course_id
-                            )
-                            new_course_admin.save()
-                        except:
-                            # admin already pending
-                            logger.info("Admin already pending.")
+            new_admins = selected - set(username for profile_id, username in admins)
+            if new_admins:
+                already_pending = set(LTICourseAdmin.objects.filter(
+                    new_admin_course_id=course.course_id,
+                    admin_unique_identifier__in=new_admins
+                ).values_list('admin_unique_identifier', flat=True))
+                LTICourseAdmin.objects.bulk_create([
+                    LTICourseAdmin(admin_unique_identifier=name, new_admin_course_id=course.course_id)
+                    for name in sorted(new_admins - already_pending)
+                ])
 
             # save the course name to the session so it auto-populate later.
             save_session(request, course_name=course.course_name)
@@ -310,6 +279,8 @@ def edit_course(request, id):
     except:
         pending_admins = None
 
+    admin_usernames = course.course_admins.exclude(user__username__startswith='preview:').order_by('user__username').values_list('user__username', flat=True).distinct()
+
     return render(
         request,
         'hx_lti_initializer/edit_course.html',
@@ -317,24 +288,72 @@ def edit_course(request, id):
             'form': form,
             'user': request.user,
             'pending': pending_admins,
+            'admin_usernames': admin_usernames,
+            'course': course,
             'org': settings.ORGANIZATION,
             'is_instructor': request.LTI['is_staff'],
         }
     )
 
 
+@login_required
+def course_admin_candidates(request, id):
+    '''
+    Returns one page of the usernames that start with "q", in alphabetical order, for the
+    course admin picker of edit_course. Only users of the LMS the course is launched from
+    are listed, and preview users are left out. Usernames are unique, so their index serves
+    both the prefix match and the order.
+    Intended to be called via AJAX.
+    '''
+    if not request.LTI['is_staff']:
+        raise PermissionDenied("You must be a staff member to add course admins.")
+
+    course = get_object_or_404(LTICourse, pk=id)
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+        page_size = min(max(1, int(request.GET.get('page_size', ADMIN_CANDIDATES_PAGE_SIZE))), 100)
+    except ValueError:
+        return HttpResponse(json.dumps({'error': 'page and page_size must be integers'}), status=400, content_type='application/json')
+
+    profiles = LTIProfile.objects.exclude(user__username__startswith='preview:')
+    query = request.GET.get('q', '').strip()
+    if query:
+        profiles = profiles.filter(user__username__startswith=query)
+    user_scope = request.LTI.get('hx_user_scope', None)
+    if user_scope:
+        profiles = profiles.filter(Q(scope=user_scope) | Q(scope__isnull=True))
+    # one more than the page, to know if there is a next one
+    offset = (page - 1) * page_size
+    usernames = list(profiles.order_by('user__username').values_list('user__username', flat=True).distinct()[offset:offset + page_size + 1])
+    admins = set(course.course_admins.filter(user__username__in=usernames[:page_size]).values_list('user__username', flat=True))
+    data = {
+        'users': [{'username': username, 'is_admin': username in admins} for username in usernames[:page_size]],
+        'page': page,
+        'page_size': page_size,
+        'has_more': len(usernames) > page_size,
+    }
+    return HttpResponse(json.dumps(data), content_type='application/json')
+
+
 def course_admin_hub(request):
     """
     The index view for both students and instructors. Without the 'is_instructor' flag,
     students are directed to a version of admin_hub with reduced privileges
     """
     is_instructor = request.LTI['is_staff']
-    courses_for_user = LTICourse.objects.filter(course_id=request.LTI['hx_context_id'])
-    files_in_courses = TOD_Implementation.get_dict_of_files_from_courses(courses_for_user)
+    # the assignments and their sources in order are fetched up front, rather than by the
+    # template one assignment at a time
+    assignments = Assignment.objects.all() if is_instructor else Assignment.objects.filter(is_published=True)
+    assignments = assignments.prefetch_related(Prefetch(
+        'assignmenttargets_set',
+        queryset=AssignmentTargets.objects.select_related('target_object').order_by('order'),
+    ))
+    courses_for_user = LTICourse.objects.filter(course_id=request.LTI['hx_context_id']).prefetch_related(
+        Prefetch('assignments', queryset=assignments))
 
     logger.debug("course_admin_hub view")
     try:
-        config = LTIResourceLinkConfig.objects.get(resource_link_id=request.LTI['resource_link_id'])
+        config = LTIResourceLinkConfig.get_cached(request.LTI['resource_link_id'])
         object_id = int(config.object_id)
         collection_id = config.collection_id
         to = TargetObject.objects.get(pk=object_id)
@@ -348,7 +367,6 @@ def course_admin_hub(request):
 
     logger.debug("resource_link_config object_id=%s collection_id=%s target_object=%s" % (object_id, collection_id, to))
 
-    debug = files_in_courses
     return render(
         request,
         'hx_lti_initializer/admin_hub.html',
@@ -356,9 +374,7 @@ def course_admin_hub(request):
             'username': request.LTI['hx_user_name'],
             'is_instructor': request.LTI['is_staff'],
             'courses': courses_for_user,
-            'files': files_in_courses,
             'org': settings.ORGANIZATION,
-            'debug': debug,
             'starter_object': starter_object,
             'starter_object_id': object_id,
             'starter_collection_id': collection_id,
@@ -377,15 +393,16 @@ def access_annotation_target(
         user_id = request.LTI['hx_user_id']
         roles = request.LTI['hx_roles']
     try:
-        assignment = Assignment.objects.get(assignment_id=assignment_id)
-        targ_obj = TargetObject.objects.get(pk=object_id)
-        assignment_target = AssignmentTargets.objects.get(
-            assignment=assignment,
-            target_object=targ_obj
+        # the assignment, its course and the source in one query
+        assignment_target = AssignmentTargets.objects.select_related('assignment__course', 'target_object').get(
+            assignment__assignment_id=assignment_id,
+            target_object_id=object_id
         )
+        assignment = assignment_target.assignment
+        targ_obj = assignment_target.target_object
         object_uri = targ_obj.get_target_content_uri()
-        course_obj = LTICourse.objects.get(course_id=course_id)
-    except Assignment.DoesNotExist or TargetObject.DoesNotExist:
+        course_obj = LTICourse.get_cached_course_by_id(course_id)
+    except AssignmentTargets.DoesNotExist:
         logger.error("User attempted to access an Assignment or Target Object that does not exist: assignment_id={assignment_id} object_id={object_id}".format(assignment_id=assignment_id, object_id=object_id))
         raise AnnotationTargetDoesNotExist('Assignment or target object does not exist')
     try:
@@ -425,13 +442,14 @@ def access_annotation_target(
         'org': settings.ORGANIZATION,
         'logger_url': settings.ANNOTATION_LOGGER_URL,
     }
-    if not assignment.object_before(object_id) is None:
-        original['prev_object'] = assignment.object_before(object_id)
-        original['assignment_target'] = assignment_target
-
-    if not assignment.object_after(object_id) is None:
-        original['next_object'] = assignment.object_after(object_id)
-        original['assignment_target'] = assignment_target
+    navigation = assignment.navigation()
+    original.update({
+        'prev_object_id': navigation.previous(targ_obj.id),
+        'next_object_id': navigation.next(targ_obj.id),
+        'position': navigation.position(targ_obj.id),
+        'count': len(navigation),
+    })
+    config = assignment_target.config
 
     if targ_obj.target_type == 'vd':
         srcurl = targ_obj.target_content
@@ -444,13 +462,9 @@ def access_annotation_target(
         original.update({'typeSource': typeSource})
     elif targ_obj.target_type == 'ig':
         original.update({'osd_json': targ_obj.target_content})
-        viewtype = assignment_target.get_view_type_for_mirador()
-        canvas_id = assignment_target.get_canvas_id_for_mirador()
-
-        if viewtype is not None:
-            original.update({'viewType': viewtype})
-        if canvas_id is not None:
-            original.update({'canvas_id': canvas_id})
+        original.update({'viewType': config.view_type})
+        if config.canvas_id is not None:
+            original.update({'canvas_id': config.canvas_id})
 
     if assignment_target.target_external_css:
         original.update({
@@ -462,19 +476,10 @@ def access_annotation_target(
         })
 
     original.update({
-        'dashboard_hidden': assignment_target.get_dashboard_hidden()
-    })
-
-    original.update({
-        'transcript_hidden': assignment_target.get_transcript_hidden()
-    })
-
-    original.update({
-        'transcript_download': assignment_target.get_transcript_download()
-    })
-
-    original.update({
-        'video_download': assignment_target.get_video_download()
+        'dashboard_hidden': config.dashboard_hidden,
+        'transcript_hidden': config.transcript_hidden,
+        'transcript_download': config.transcript_download,
+        'video_download': config.video_download,
     })
 
     get_paras = {}
@@ -485,6 +490,11 @@ def access_annotation_target(
     return render(request, '%s/detail.html' % targ_obj.target_type, original)
 
 
+def invalid_filter_response():
+    # a fixed message, since the parse error repeats the parameter
+    return HttpResponse("Invalid filter: dates must be given as YYYY-MM-DD", status=400, content_type='text/plain')
+
+
 def instructor_dashboard_view(request):
     '''
         Renders the instructor dashboard (without annotations).
@@ -504,13 +514,26 @@ def instructor_dashboard_view(request):
         'session': request.session.session_key,
         'dashboard_context_js': json.dumps({
             'student_list_view_url': reverse('hx_lti_initializer:instructor_dashboard_student_list_view') + '?resource_link_id=%s' % resource_link_id,
-        })
+            'students_view_url': reverse('hx_lti_initializer:instructor_dashboard_students_view') + '?resource_link_id=%s' % resource_link_id,
+            'student_annotations_view_url': reverse('hx_lti_initializer:instructor_dashboard_student_annotations_view') + '?resource_link_id=%s' % resource_link_id,
+            # downloaded by following a link, so the session has to be in the url when cookies are blocked
+            'export_view_url': reverse('hx_lti_initializer:instructor_dashboard_export_view') + '?resource_link_id=%s&utm_source=%s' % (
+                resource_link_id, request.session.session_key),
+        }),
     }
+
+    # choices for the filters; image sources are annotated by canvas, so they can't be chosen by uri
+    reference = get_course_reference(context_id)
+    context['filter_assignments'] = sorted(reference['assignments'].items(), key=lambda choice: choice[1].lower())
+    context['filter_targets'] = sorted([(x['id'], x['target_title']) for x in reference['targets'] if x['target_type'] != 'ig'],
+                                       key=lambda choice: choice[1].lower())
     return render(request, 'hx_lti_initializer/dashboard_view.html', context)
 
+@gzip_response
 def instructor_dashboard_student_list_view(request):
     '''
-    Renders the student annotations for the instructor dashboard.
+    Renders the student annotations for the instructor dashboard, narrowed by the
+    filters of get_dashboard_filters(), which are passed on to the annotation database.
     Intended to be called via AJAX.
     '''
     if not request.LTI['is_staff']:
@@ -518,24 +541,150 @@ def instructor_dashboard_student_list_view(request):
 
     context_id = request.LTI['hx_context_id']
     user_id = request.LTI['hx_user_id']
+    try:
+        filters = get_dashboard_filters(request.GET)
+    except ValueError:
+        return invalid_filter_response()
 
     # Fetch the annotations and time how long the request takes
     fetch_start_time = time.time()
-    course_annotations = fetch_annotations_by_course(context_id, annotation_database.ADMIN_GROUP_ID)
+    course_annotations = fetch_annotations_by_course(context_id, annotation_database.ADMIN_GROUP_ID, filters=filters)
     fetch_end_time = time.time()
     fetch_elapsed_time = fetch_end_time - fetch_start_time
 
-    # Transform the raw annotation results into something useful for the dashboard
-    user_annotations = DashboardAnnotations(course_annotations).get_annotations_by_user()
     context = {
         'username': request.LTI['hx_user_name'],
         'is_instructor': request.LTI['is_staff'],
-        'user_annotations': user_annotations,
         'fetch_annotations_time': fetch_elapsed_time,
+        'fetch_annotations_pages': len(course_annotations['pages']),
+        'fetch_annotations_slowest_page': max([page.elapsed for page in course_annotations['pages']] or [0]),
+        'fetch_annotations_errors': course_annotations['errors'],
         'org': settings.ORGANIZATION,
     }
+
+    # Transform the raw annotation results into something useful for the dashboard,
+    # and let go of the raw rows before rendering
+    context['user_annotations'] = DashboardAnnotations(course_annotations, context_id).get_annotations_by_user()
+    del course_annotations
     return render(request, 'hx_lti_initializer/dashboard_student_list_view.html', context)
 
+def instructor_dashboard_students_view(request):
+    '''
+    Returns one page of the students with annotations in the course, with their names,
+    annotation counts and latest activity, as JSON. Students may be filtered by name. The
+    counts come from the course's dashboard snapshot, and the annotations themselves are
+    loaded separately from instructor_dashboard_student_annotations_view. The snapshot
+    counts all of the course's annotations, while the panel only lists those on the
+    sources of its assignments, so the two differ once a source is removed.
+    Intended to be called via AJAX.
+    '''
+    if not request.LTI['is_staff']:
+        raise PermissionDenied("You must be a staff member to view the dashboard.")
+
+    context_id = request.LTI['hx_context_id']
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+        page_size = min(max(1, int(request.GET.get('page_size', DASHBOARD_PAGE_SIZE))), 500)
+    except ValueError:
+        return HttpResponse(json.dumps({'error': 'page and page_size must be integers'}), status=400, content_type='application/json')
+    name = request.GET.get('name', '').strip().lower()
+
+    snapshot = dashboard_snapshot.get_snapshot(context_id)
+    students = snapshot.user_summaries.filter(total_annotations__gt=0)
+    if name:
+        students = students.filter(sort_name__contains=name)
+    total_students = students.count()
+    data = {
+        'students': [{
+            'id': student.user_id,
+            'name': student.user_name,
+            'total_annotations': student.total_annotations,
+            'latest_activity': student.latest_activity.isoformat() if student.latest_activity else None,
+        } for student in students.order_by('sort_name', 'user_id')[(page - 1) * page_size:page * page_size]],
+        'page': page,
+        'page_size': page_size,
+        'num_pages': (total_students + page_size - 1) // page_size,
+        'total_students': total_students,
+        'total_annotations': snapshot.total_annotations,
+        'refreshed_at': snapshot.refreshed_at.isoformat() if snapshot.refreshed_at else None,
+        'panel_cache': student_panel_stats(context_id),
+    }
+    return HttpResponse(json.dumps(data), content_type='application/json')
+
+@gzip_response
+def instructor_dashboard_student_annotations_view(request):
+    '''
+    Renders the annotations of the student given by the user_id parameter for the
+    instructor dashboard, when their panel is expanded.
+    Intended to be called via AJAX.
+
+    The rendered panel is cached under the student's count and latest activity in the
+    dashboard snapshot, so it is only rebuilt once they have annotated since. Writes through
+    the annotation store also invalidate it (see AnnotationStore.after_create()).
+    '''
+    if not request.LTI['is_staff']:
+        raise PermissionDenied("You must be a staff member to view the dashboard.")
+    student_id = request.GET.get('user_id', '')
+    if not student_id:
+        return HttpResponse("Missing user_id", status=400)
+    try:
+        filters = get_dashboard_filters(request.GET)
+    except ValueError:
+        return invalid_filter_response()
+
+    context_id = request.LTI['hx_context_id']
+    total_annotations, latest_activity = dashboard_snapshot.user_activity(context_id, student_id)
+    panel_key = student_panel_cache_key(context_id, student_id, total_annotations, latest_activity, filters)
+    content = cache.get(panel_key)
+    count_student_panel(context_id, hit=content is not None)
+    logger.info("Student panel cache %s for %s: %s" % ('miss' if content is None else 'hit', context_id, student_panel_stats(context_id)))
+    if content is not None:
+        response = HttpResponse(content)
+        response['X-Panel-Cache'] = 'hit'
+        return response
+
+    student_annotations = fetch_annotations_by_student(context_id, annotation_database.ADMIN_GROUP_ID, student_id, filters=filters)
+    dashboard_annotations = DashboardAnnotations(student_annotations, context_id, parent_annotations=student_annotations['parents'])
+    user_annotations = dashboard_annotations.get_annotations_by_user()
+    context = {
+        'annotations': user_annotations[0]['annotations'] if user_annotations else [],
+        'org': settings.ORGANIZATION,
+    }
+    response = render(request, 'hx_lti_initializer/dashboard_student_annotations.html', context)
+    cache.set(panel_key, response.content, DASHBOARD_PANEL_TIMEOUT)
+    response['X-Panel-Cache'] = 'miss'
+    return response
+
+EXPORT_FORMATS = {
+    'csv': (iter_export_csv, 'text/csv; charset=utf-8'),
+    'ndjson': (iter_export_ndjson, 'application/x-ndjson; charset=utf-8'),
+}
+
+@gzip_response
+def instructor_dashboard_export_view(request):
+    '''
+    Downloads the annotations of the course as CSV or NDJSON, as given by the format
+    parameter, narrowed by the dashboard's filters. The file is streamed as pages arrive from the annotation databases, so it
+    is never held in memory as a whole.
+    '''
+    if not request.LTI['is_staff']:
+        raise PermissionDenied("You must be a staff member to view the dashboard.")
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return HttpResponse("Unknown format, expected one of: %s" % ', '.join(sorted(EXPORT_FORMATS)), status=400, content_type='text/plain')
+    try:
+        filters = get_dashboard_filters(request.GET)
+    except ValueError:
+        return invalid_filter_response()
+
+    context_id = request.LTI['hx_context_id']
+    iter_export, content_type = EXPORT_FORMATS[export_format]
+    response = StreamingHttpResponse(iter_export(iter_course_export(context_id, annotation_database.ADMIN_GROUP_ID, filters=filters)),
+                                     content_type=content_type)
+    filename = 'annotations-%s-%s.%s' % (re.sub(r'[^\w.-]+', '_', context_id), datetime.date.today().isoformat(), export_format)
+    response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+    return response
+
 def error_view(request, message):
     '''
     Implements graceful and user-friendly (also debugger-friendly) error displays
@@ -589,12 +738,11 @@ def change_starting_resource(request, assignment_id, object_id):
             config.object_id = object_id
             config.save()
             data['response'] = 'Success: Updated'
-        except:
+        except LTIResourceLinkConfig.DoesNotExist:
             newConfig = LTIResourceLinkConfig(resource_link_id=resource_link_id, collection_id=assignment_id, object_id=object_id)
             newConfig.save()
             data['response'] = 'Success: Created'
     elif request.method == 'DELETE':
-        if LTIResourceLinkConfig.objects.filter(resource_link_id=resource_link_id).exists():
-            LTIResourceLinkConfig.objects.get(resource_link_id=resource_link_id).delete()
+        LTIResourceLinkConfig.objects.filter(resource_link_id=resource_link_id).delete()
         data['response'] = 'Success: Deleted'
     return HttpResponse(json.dumps(data), content_type='application/json')
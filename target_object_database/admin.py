@@ -1,9 +1,20 @@
 from django.contrib import admin
-from models import TargetObject
+from models import TargetObject, IIIFManifest
+import iiif
 
 class TargetObjectAdmin(admin.ModelAdmin):
     list_display = ('id', 'target_type', 'target_title', 'target_author', 'target_creator', 'target_created')
     list_filter = ('target_type','target_created')
     search_fields = ('target_title', 'target_author')
+    exclude = ('iiif_manifest',)
+
+    def save_model(self, request, obj, form, change):
+        super(TargetObjectAdmin, self).save_model(request, obj, form, change)
+        iiif.index_target(obj, force=True)
+
+class IIIFManifestAdmin(admin.ModelAdmin):
+    list_display = ('url', 'etag', 'last_modified', 'fetched_at', 'checked_at')
+    search_fields = ('url',)
 
 admin.site.register(TargetObject, TargetObjectAdmin)
+admin.site.register(IIIFManifest, IIIFManifestAdmin)
@@ -0,0 +1,155 @@
+"""
+Cache of IIIF manifests for image targets.
+
+Image targets store the URL of an IIIF manifest in target_content. Reading a manifest
+means downloading and parsing a document that can be megabytes long, so the canvas list is
+kept in the IIIFManifest/IIIFCanvas tables. Once a manifest is older than
+IIIF_MANIFEST_MAX_AGE seconds, it is revalidated with If-None-Match/If-Modified-Since and
+only downloaded again if it changed.
+
+Image annotations use a canvas id as their uri. Each image target is linked to its cached
+manifest, so targets_by_canvas() can match canvases to targets with an indexed query.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from models import TargetObject, IIIFManifest, IIIFCanvas
+
+import datetime
+import logging
+import requests
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_MAX_AGE = getattr(settings, 'IIIF_MANIFEST_MAX_AGE', 3600) # seconds before a cached manifest is revalidated
+REQUEST_TIMEOUT = 10.0
+
+# results of refresh_manifest()
+FRESH = 'fresh'
+NOT_MODIFIED = 'not_modified'
+UPDATED = 'updated'
+
+
+class ManifestError(Exception):
+    pass
+
+
+def parse_canvases(manifest_json):
+    """
+    Returns a list of (canvas_id, label) for the default sequence of an IIIF presentation
+    manifest.
+    """
+    sequences = manifest_json.get('sequences') or []
+    if not sequences:
+        return []
+    canvases = []
+    for canvas in sequences[0].get('canvases', []):
+        label = canvas.get('label', '')
+        if not isinstance(label, basestring):
+            label = ''
+        canvases.append((canvas['@id'], label[:255]))
+    return canvases
+
+
+def refresh_manifest(manifest, force=False, now=None):
+    """
+    Revalidates the cached manifest if it is older than MANIFEST_MAX_AGE (or if force is
+    set), and replaces its canvases if the manifest changed. Returns FRESH, NOT_MODIFIED or
+    UPDATED.
+    """
+    now = timezone.now() if now is None else now
+    if not force and manifest.checked_at and now - manifest.checked_at < datetime.timedelta(seconds=MANIFEST_MAX_AGE):
+        return FRESH
+
+    headers = {}
+    if manifest.fetched_at is not None:
+        if manifest.etag:
+            headers['If-None-Match'] = manifest.etag
+        if manifest.last_modified:
+            headers['If-Modified-Since'] = manifest.last_modified
+    try:
+        response = requests.get(manifest.url, headers=headers, timeout=REQUEST_TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        raise ManifestError("could not fetch manifest %s: %s" % (manifest.url, e))
+
+    if response.status_code == 304:
+        IIIFManifest.objects.filter(pk=manifest.pk).update(checked_at=now)
+        manifest.checked_at = now
+        return NOT_MODIFIED
+    if response.status_code != 200:
+        raise ManifestError("could not fetch manifest %s: status %s" % (manifest.url, response.status_code))
+    try:
+        canvases = parse_canvases(response.json())
+    except (ValueError, KeyError, AttributeError) as e:
+        raise ManifestError("could not parse manifest %s: %s" % (manifest.url, e))
+
+    with transaction.atomic():
+        manifest.canvases.all().delete()
+        IIIFCanvas.objects.bulk_create([
+            IIIFCanvas(manifest=manifest, canvas_id=canvas_id, label=label, position=position)
+            for position, (canvas_id, label) in enumerate(canvases)
+        ])
+        manifest.etag = response.headers.get('etag', '')[:255]
+        manifest.last_modified = response.headers.get('last-modified', '')[:64]
+        manifest.fetched_at = manifest.checked_at = now
+        manifest.save()
+    logger.info("Cached IIIF manifest %s with %s canvases", manifest.url, len(canvases))
+    return UPDATED
+
+
+def get_manifest(url, force=False):
+    """
+    Returns the cached IIIFManifest for the URL, fetching or revalidating it as needed.
+    """
+    manifest, created = IIIFManifest.objects.get_or_create(url=url.strip())
+    refresh_manifest(manifest, force=force)
+    return manifest
+
+
+def first_canvas_id(url):
+    """
+    Returns the id of the first canvas in the manifest at the URL.
+    """
+    canvas = get_manifest(url).canvases.first()
+    if canvas is None:
+        raise ManifestError("manifest %s has no canvases" % url)
+    return canvas.canvas_id
+
+
+def index_target(target_object, force=False):
+    """
+    Caches the manifest of an image target and links the target to it, so that its canvases
+    can be found by targets_by_canvas(). Errors are logged rather than raised, since a
+    manifest that can't be fetched right now shouldn't prevent saving the target.
+    Returns the result of refresh_manifest(), or None if the manifest couldn't be cached.
+    """
+    if target_object.target_type != 'ig':
+        return None
+    url = target_object.target_content.strip()
+    try:
+        manifest, created = IIIFManifest.objects.get_or_create(url=url)
+        result = refresh_manifest(manifest, force=force)
+    except ManifestError as e:
+        logger.warning("Image target %s: %s", target_object.pk, e)
+        return None
+    if target_object.iiif_manifest_id != manifest.pk:
+        TargetObject.objects.filter(pk=target_object.pk).update(iiif_manifest=manifest)
+        target_object.iiif_manifest = manifest
+    return result
+
+
+def targets_by_canvas(canvas_ids):
+    """
+    Returns a dict mapping each canvas id to the id of the image target whose manifest
+    contains it. Canvases of manifests that have not been cached are left out.
+    """
+    canvas_ids = set(canvas_ids)
+    if not canvas_ids:
+        return {}
+    rows = IIIFCanvas.objects.filter(
+        canvas_id__in=canvas_ids,
+        manifest__targets__target_type='ig',
+    ).order_by('-manifest__targets__id').values_list('canvas_id', 'manifest__targets__id')
+    # ordered so that the oldest target wins when several targets share a manifest
+    return dict(rows)
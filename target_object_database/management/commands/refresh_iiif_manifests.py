@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+
+from target_object_database import iiif
+from target_object_database.models import TargetObject
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Caches or revalidates the IIIF manifests of image targets.'
+    option_list = BaseCommand.option_list + (
+        make_option('--force', dest='force', action='store_true', default=False,
+                    help='Revalidate every manifest, even if it was checked recently.'),
+    )
+
+    def handle(self, *args, **options):
+        counts = {iiif.FRESH: 0, iiif.NOT_MODIFIED: 0, iiif.UPDATED: 0, None: 0}
+        for target_object in TargetObject.objects.filter(target_type='ig'):
+            counts[iiif.index_target(target_object, force=options['force'])] += 1
+        self.stdout.write("updated: %s, not modified: %s, fresh: %s, errors: %s" % (
+            counts[iiif.UPDATED], counts[iiif.NOT_MODIFIED], counts[iiif.FRESH], counts[None]))
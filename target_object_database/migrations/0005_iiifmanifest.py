@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('target_object_database', '0004_auto_20151104_2138'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IIIFCanvas',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('canvas_id', models.CharField(max_length=2048, db_index=True)),
+                ('label', models.CharField(default='', max_length=255, blank=True)),
+                ('position', models.PositiveIntegerField()),
+            ],
+            options={
+                'ordering': ['position'],
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='IIIFManifest',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('url', models.CharField(unique=True, max_length=2048)),
+                ('etag', models.CharField(default='', max_length=255, blank=True)),
+                ('last_modified', models.CharField(default='', max_length=64, blank=True)),
+                ('fetched_at', models.DateTimeField(null=True, blank=True)),
+                ('checked_at', models.DateTimeField(null=True, blank=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AddField(
+            model_name='iiifcanvas',
+            name='manifest',
+            field=models.ForeignKey(related_name='canvases', to='target_object_database.IIIFManifest'),
+            preserve_default=True,
+        ),
+        migrations.AlterUniqueTogether(
+            name='iiifcanvas',
+            unique_together=set([('manifest', 'position')]),
+        ),
+        migrations.AddField(
+            model_name='targetobject',
+            name='iiif_manifest',
+            field=models.ForeignKey(related_name='targets', on_delete=django.db.models.deletion.SET_NULL, blank=True, to='target_object_database.IIIFManifest', null=True),
+            preserve_default=True,
+        ),
+    ]
@@ -44,6 +44,8 @@ class TargetObject(LTI_TodApi):
         choices=ANNOTATION_TYPES,
         default='tx'
     )
+    # cached manifest for image targets, see target_object_database.iiif
+    iiif_manifest = models.ForeignKey('IIIFManifest', null=True, blank=True, on_delete=models.SET_NULL, related_name='targets')
 
     def __str__(self):
         return "\"" + self.target_title + "\" by " + self.target_author
@@ -102,3 +104,36 @@ class TargetObject(LTI_TodApi):
             return "<source src=\"" + result[0] + "\" type='" + get_extension(result[0]) + "' />" + \
                    "<source src=\"" + result[1] + "\" type='" + get_extension(result[1]) + "' />" + \
                    "<track kind='captions' src='" + result[2] + "' srclang='en' label='English' default />"
+
+
+class IIIFManifest(models.Model):
+    """
+    Cached canvas list of an IIIF manifest, refreshed with a conditional request when the
+    manifest may have changed (see target_object_database.iiif).
+    """
+    url = models.CharField(max_length=2048, unique=True)
+    etag = models.CharField(max_length=255, blank=True, default='')
+    last_modified = models.CharField(max_length=64, blank=True, default='')
+    fetched_at = models.DateTimeField(null=True, blank=True)
+    checked_at = models.DateTimeField(null=True, blank=True)
+
+    def __unicode__(self):
+        return self.url
+
+
+class IIIFCanvas(models.Model):
+    """
+    A canvas in the default sequence of a cached IIIF manifest. Indexed by canvas id, so
+    image annotations can be matched to their target objects with one query.
+    """
+    manifest = models.ForeignKey(IIIFManifest, related_name='canvases')
+    canvas_id = models.CharField(max_length=2048, db_index=True)
+    label = models.CharField(max_length=255, blank=True, default='')
+    position = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ['position']
+        unique_together = ('manifest', 'position')
+
+    def __unicode__(self):
+        return self.canvas_id
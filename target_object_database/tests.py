@@ -1,5 +1,10 @@
+import datetime
+
+import mock
 from django.test import TestCase
-from target_object_database.models import TargetObject
+from django.utils import timezone
+from target_object_database.models import TargetObject, IIIFManifest
+from target_object_database import iiif
 from hx_lti_assignment.models import Assignment, AssignmentTargets
 from hx_lti_initializer.models import LTICourse, LTIProfile
 from hx_lti_initializer.test_helper import *
@@ -99,3 +104,61 @@ class TODViewsTests(TestCase):
             self.tod.get_admin_url(),
             '/admin/target_object_database/targetobject/%d/' % self.tod.id
         )
+
+
+class IIIFManifestCacheTests(TestCase):
+    """
+    """
+    url = 'https://iiif.example.edu/manifests/drs:1'
+
+    def setUp(self):
+        self.target = TargetObject.objects.create(
+            target_title="Image", target_author="Author", target_content=self.url + '\n', target_type="ig")
+
+    def manifest_response(self, canvases, status_code=200, etag='"v1"'):
+        response = mock.Mock(status_code=status_code, headers={'etag': etag})
+        response.json.return_value = {'sequences': [{'canvases': [
+            {'@id': '%s/canvas/%s' % (self.url, name), 'label': name} for name in canvases
+        ]}]}
+        return response
+
+    def canvas_labels(self):
+        return list(IIIFManifest.objects.get(url=self.url).canvases.values_list('label', flat=True))
+
+    @mock.patch('requests.get')
+    def test_manifest_is_fetched_once_and_revalidated(self, mock_get):
+        mock_get.return_value = self.manifest_response(['p1', 'p2'])
+        self.assertEqual(self.url + '/canvas/p1', iiif.first_canvas_id(self.url))
+        self.assertEqual(iiif.FRESH, iiif.index_target(self.target))
+        self.assertEqual(1, mock_get.call_count)
+        self.assertEqual(['p1', 'p2'], self.canvas_labels())
+
+        IIIFManifest.objects.update(checked_at=timezone.now() - datetime.timedelta(seconds=iiif.MANIFEST_MAX_AGE + 1))
+        mock_get.return_value = mock.Mock(status_code=304, headers={})
+        self.assertEqual(iiif.NOT_MODIFIED, iiif.index_target(self.target))
+        self.assertEqual('"v1"', mock_get.call_args[1]['headers']['If-None-Match'])
+        self.assertEqual(['p1', 'p2'], self.canvas_labels())
+
+        mock_get.return_value = self.manifest_response(['p3'], etag='"v2"')
+        self.assertEqual(iiif.UPDATED, iiif.index_target(self.target, force=True))
+        self.assertEqual(['p3'], self.canvas_labels())
+        self.assertEqual('"v2"', IIIFManifest.objects.get(url=self.url).etag)
+
+    @mock.patch('requests.get')
+    def test_targets_by_canvas(self, mock_get):
+        mock_get.return_value = self.manifest_response(['p1', 'p2'])
+        iiif.index_target(self.target)
+        other = self.url + '/canvas/unknown'
+        self.assertEqual({self.url + '/canvas/p2': self.target.pk},
+                         iiif.targets_by_canvas([self.url + '/canvas/p2', other]))
+
+        annotations = {'rows': [{'id': 1, 'uri': self.url + '/canvas/p2', 'media': 'image', 'user': {'id': '1', 'name': 'A'},
+                                'contextId': 'course1', 'collectionId': 'assignment', 'parent': '0'}]}
+        self.assertEqual(self.target.pk, DashboardAnnotations(annotations, 'course1').get_target_id('image', self.url + '/canvas/p2'))
+
+    @mock.patch('requests.get')
+    def test_unreachable_manifest_does_not_raise(self, mock_get):
+        mock_get.return_value = mock.Mock(status_code=404, headers={})
+        self.assertEqual(None, iiif.index_target(self.target))
+        self.assertEqual(None, TargetObject.objects.get(pk=self.target.pk).iiif_manifest)
+        self.assertRaises(iiif.ManifestError, iiif.first_canvas_id, self.url)
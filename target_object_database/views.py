@@ -7,6 +7,7 @@ from django.forms import ValidationError
 from models import *
 from serializers import *
 from forms import SourceForm
+import iiif
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.conf import settings
@@ -44,6 +45,7 @@ def create_new_source(request):
         if form.is_valid():
             source = form.save()
             source.save()
+            iiif.index_target(source, force=True)
 
             messages.success(request, 'Source was successfully created!')
             url = reverse('hx_lti_initializer:course_admin_hub') + '?resource_link_id=%s' % request.LTI['resource_link_id']
@@ -74,6 +76,7 @@ def edit_source(request, id):
         if form.is_valid():
             source = form.save()
             source.save()
+            iiif.index_target(source, force=True)
 
             messages.success(request, 'Source was successfully edited!')
             url = reverse('hx_lti_initializer:course_admin_hub') + '?resource_link_id=%s' % request.LTI['resource_link_id']
@@ -105,6 +108,7 @@ def handlePopAdd(request, addForm, field):
             except ValidationError, error:
                 newObject = None
             if newObject:
+                iiif.index_target(newObject, force=True)
                 return HttpResponse('<script type="text/javascript">opener.dismissAddAnotherPopup(window, "%s", "%s", "%s", "%s", "%s");</script>' % (escape(newObject._get_pk_val()), escape(newObject.target_title), escape(newObject.target_author), escape(newObject.target_created), escape(newObject.target_type)))  # noqa
     else:
         form = addForm()